@@ -6,9 +6,12 @@ import sys
 import dj_database_url
 import environ
 import saml2
+from django.core.exceptions import ImproperlyConfigured
 from django.urls import reverse_lazy
 from saml2 import saml
 
+from sso.core import caches
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -82,6 +85,14 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = "config.urls"
 
+template_loaders = [
+    "django.template.loaders.filesystem.Loader",
+    "django.template.loaders.app_directories.Loader",
+]
+if not DEBUG:
+    # compile each template once per process, rather than while it's being edited
+    template_loaders = [("django.template.loaders.cached.Loader", template_loaders)]
+
 TEMPLATES = [
     {
         "BACKEND": "django.template.backends.django.DjangoTemplates",
@@ -96,10 +107,7 @@ TEMPLATES = [
                 "django.contrib.messages.context_processors.messages",
                 "sso.core.context_processors.template_settings",
             ],
-            "loaders": [
-                "django.template.loaders.filesystem.Loader",
-                "django.template.loaders.app_directories.Loader",
-            ],
+            "loaders": template_loaders,
         },
     }
 ]
@@ -182,6 +190,8 @@ if env("SAML_PRIVATE_KEY", default=None) and env("SAML_PUBLIC_CERT", default=Non
 SAML_ACS_URL = BASE_URL + "/saml2/acs/"
 XMLSEC1 = env("XMLSEC1")
 
+SAML_CONFIG_LOADER = "sso.samlauth.conf.config_loader"
+
 SAML_CONFIG = {
     # full path to the xmlsec1 binary, latter is where it ends up in Heroku
     # on ubuntu install with `apt-get install xmlsec`
@@ -283,6 +293,7 @@ OAUTH2_PROVIDER = {
     },
     "DEFAULT_SCOPES": ["read", "write", "data-hub:internal-front-end"],
     "REFRESH_TOKEN_EXPIRE_SECONDS": 24 * 60 * 60 * 2,
+    "OAUTH2_VALIDATOR_CLASS": "sso.oauth2.validators.CustomOAuth2Validator",
 }
 
 OAUTH2_PROVIDER_APPLICATION_MODEL = "oauth2.Application"
@@ -319,23 +330,91 @@ LOGGING = {
     },
 }
 
-CACHES = {
-    "default": {
-        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
-    },
-    "axes_cache": {
-        # See - https://github.com/jazzband/django-axes/blob/master/docs/configuration.rst#cache-problems
-        "BACKEND": "django.core.cache.backends.dummy.DummyCache",
-    },
+# Caches
+# Every caching feature has its own alias with its own default TTL (seconds). The backend
+# ("redis", "memcached" or "locmem", an in-process LRU cache) defaults to CACHE_BACKEND and can be
+# overridden per alias with CACHE_<ALIAS>_BACKEND, and the TTL with CACHE_<ALIAS>_TTL, e.g.
+# CACHE_INTROSPECTION_TTL=30. CACHE_<ALIAS>_MAX_ENTRIES limits the size of a locmem cache; redis
+# and memcached are limited by their own memory settings.
+# Cached entries are invalidated across processes, so outside DEBUG every cache must be shared:
+# the backend defaults to redis, and locmem is refused.
+CACHE_BACKEND = env("CACHE_BACKEND", default=caches.LOCMEM if DEBUG else caches.REDIS)
+REDIS_URL = env("REDIS_URL", default="redis://localhost:6379/0")
+MEMCACHED_LOCATION = env.list("MEMCACHED_LOCATION", default=["localhost:11211"])
+
+CACHE_ALIASES = {
+    # alias: (default ttl, default max entries if locmem)
+    "default": (300, 1000),
+    "applications": (60 * 60, 1000),
+    "introspection": (60, 100000),
+    "sessions": (24 * 60 * 60, 100000),
+    "axes": (60 * 60, 10000),
+    "nonces": (60, 100000),
 }
 
-AXES_CACHE = "axes_cache"
+
+def _cache_config(alias, timeout, max_entries):
+    name = alias.upper()
+    return caches.cache_config(
+        env(f"CACHE_{name}_BACKEND", default=CACHE_BACKEND),
+        alias=alias,
+        timeout=env.int(f"CACHE_{name}_TTL", default=timeout),
+        max_entries=env.int(f"CACHE_{name}_MAX_ENTRIES", default=max_entries),
+        redis_url=REDIS_URL,
+        memcached_location=MEMCACHED_LOCATION,
+    )
+
+
+CACHES = {alias: _cache_config(alias, *defaults) for alias, defaults in CACHE_ALIASES.items()}
+
+if CACHES["axes"]["BACKEND"] == caches.LOCMEM_BACKEND:
+    # Lockouts must be shared between instances
+    # See - https://github.com/jazzband/django-axes/blob/master/docs/configuration.rst#cache-problems
+    CACHES["axes"] = {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}
+
+if not DEBUG and caches.local_aliases(CACHES):
+    raise ImproperlyConfigured(
+        "The caches must be shared between processes when DEBUG is off, but these use locmem: "
+        + ", ".join(caches.local_aliases(CACHES))
+    )
+
+# The alias used by each caching feature
+APPLICATION_CACHE = "applications"
+INTROSPECTION_CACHE = "introspection"
+SESSION_CACHE_ALIAS = "sessions"
+NONCE_CACHE = "nonces"
+AXES_CACHE = "axes"
+
+# How long inactive and denied introspection responses are cached for, in seconds
+INTROSPECTION_NEGATIVE_CACHE_TTL = env.int("INTROSPECTION_NEGATIVE_CACHE_TTL", default=5)
+
+# The maximum number of tokens accepted by the batch introspection endpoint
+INTROSPECTION_BATCH_MAX_TOKENS = env.int("INTROSPECTION_BATCH_MAX_TOKENS", default=100)
+
 AXES_ONLY_USER_FAILURES = True
 AXES_VERBOSE = True
 AXES_RESET_ON_SUCCESS = True
 AXES_FAILURE_LIMIT = 3
 IPWARE_META_PRECEDENCE_ORDER = ["HTTP_X_FORWARDED_FOR"]
 
+# last accessed updates
+# Skip updating a user's last accessed time if it was updated less than this many seconds ago
+LAST_ACCESSED_RESOLUTION = env.int("LAST_ACCESSED_RESOLUTION", default=300)
+# Buffer last accessed times in memory and write them in bulk every flush interval
+LAST_ACCESSED_WRITE_BEHIND = env.bool("LAST_ACCESSED_WRITE_BEHIND", default=False)
+LAST_ACCESSED_FLUSH_INTERVAL = env.int("LAST_ACCESSED_FLUSH_INTERVAL", default=30)
+
+# SAML application metadata
+# Each web process refreshes the remote metadata of SAML applications that is due every this many
+# seconds, see sso.samlidp.metadata; 0 disables it, leaving it to `refresh_saml_metadata`
+SAML_METADATA_REFRESH_INTERVAL = env.int("SAML_METADATA_REFRESH_INTERVAL", default=600)
+
+# user search
+# How /api/v1/user/search/ matches autocomplete searches: "regex" uses the original word boundary
+# regexes, "fulltext" opts in to the indexed full text search document of names and email
+# addresses, which also matches email addresses and ranks the results
+USER_SEARCH_MODE = env("USER_SEARCH_MODE", default="regex")
+
 # admin ip restriction
 RESTRICT_ADMIN = env("RESTRICT_ADMIN")
 ALLOWED_ADMIN_IPS = env("ALLOWED_ADMIN_IPS")
@@ -357,12 +436,35 @@ EMAIL_HOST_PASSWORD = env("EMAIL_HOST_PASSWORD", default="")
 EMAIL_PORT = env("EMAIL_PORT", default=587)
 EMAIL_FROM = env("EMAIL_FROM", default="test@example.com")
 
+# email outbox
+# Send queued emails from a thread in each process; without it `send_outbound_emails` sends them
+EMAIL_OUTBOX_THREAD = env.bool("EMAIL_OUTBOX_THREAD", default=True)
+EMAIL_OUTBOX_POLL_INTERVAL = env.int("EMAIL_OUTBOX_POLL_INTERVAL", default=10)
+# An email that fails is tried again after this many seconds, doubled for each failed attempt
+EMAIL_OUTBOX_RETRY_DELAY = env.int("EMAIL_OUTBOX_RETRY_DELAY", default=30)
+EMAIL_OUTBOX_MAX_ATTEMPTS = env.int("EMAIL_OUTBOX_MAX_ATTEMPTS", default=5)
+# Other senders skip the emails a sender has claimed for this many seconds, then send them again
+EMAIL_OUTBOX_LEASE = env.int("EMAIL_OUTBOX_LEASE", default=300)
+# The number of emails that each requester ip can queue for an address in each period of seconds
+EMAIL_OUTBOX_RATE_LIMIT = env.int("EMAIL_OUTBOX_RATE_LIMIT", default=5)
+EMAIL_OUTBOX_RATE_LIMIT_PERIOD = env.int("EMAIL_OUTBOX_RATE_LIMIT_PERIOD", default=900)
+
 # session settings
 SESSION_EXPIRE_AT_BROWSER_CLOSE = False
 SESSION_COOKIE_AGE = env.int("SESSION_COOKIE_AGE_SECONDS")
 SESSION_COOKIE_SAMESITE = "None"
 SESSION_COOKIE_SECURE = True
 SESSION_SAVE_EVERY_REQUEST = True
+# sso.core.sessions reads sessions from the sessions cache, so it's only used if the cache is
+# shared between processes; otherwise a session flushed by one process would still be loaded
+# from the cache of the others
+if caches.is_shared(CACHES[SESSION_CACHE_ALIAS]):
+    SESSION_ENGINE = "sso.core.sessions"
+else:
+    SESSION_ENGINE = "django.contrib.sessions.backends.db"
+# Skip saving a session whose data is unchanged if its expiry would slide by less than this
+SESSION_SAVE_TOLERANCE = env.int("SESSION_SAVE_TOLERANCE_SECONDS", default=300)
+SESSION_CLEAR_BATCH_SIZE = env.int("SESSION_CLEAR_BATCH_SIZE", default=5000)
 
 # google analytics
 GOOGLE_ANALYTICS_CODE = env("GOOGLE_ANALYTICS_CODE", default=None)
@@ -474,6 +576,8 @@ MI_GOOGLE_SERVICE_ACCOUNT_DATA = (
 MI_GOOGLE_SERVICE_ACCOUNT_DELEGATED_USER = env("MI_GOOGLE_SERVICE_ACCOUNT_DELEGATED_USER")
 MI_GOOGLE_USER_SYNC_SAML_APPLICATION_SLUG = env("MI_GOOGLE_USER_SYNC_SAML_APPLICATION_SLUG")
 AUTH_EMAIL_TO_IPD_MAP = env.json("AUTH_EMAIL_TO_IPD_MAP", default={})
+# also route the email domains in the samlauth.EmailDomainRoute table
+AUTH_EMAIL_TO_IDP_FROM_DB = env.bool("AUTH_EMAIL_TO_IDP_FROM_DB", default=False)
 EMAIL_ID_DOMAIN = env("EMAIL_ID_DOMAIN")
 
 # Elastic APM settings
@@ -487,6 +591,7 @@ ELASTIC_APM = {
 
 ACTIVITY_STREAM_HAWK_ID = env("ACTIVITY_STREAM_HAWK_ID")
 ACTIVITY_STREAM_HAWK_SECRET = env("ACTIVITY_STREAM_HAWK_SECRET")
+ACTIVITY_STREAM_MAX_PAGE_SIZE = env.int("ACTIVITY_STREAM_MAX_PAGE_SIZE", default=1000)
 
 SAML_IDP_SERVICE_PROVIDER_MODEL = "samlidp.SamlApplication"
 SAML_IDP_SERVICE_PROVIDER_ADMIN_CLASS = "sso.samlidp.admin.SamlApplicationAdmin"
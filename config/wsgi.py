@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 
 application = get_wsgi_application()
+
+# the metadata of SAML applications is refreshed by each web process, once the apps are loaded
+from sso.samlidp.metadata import refresher  # noqa: E402
+
+refresher.start()
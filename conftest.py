@@ -1,8 +1,75 @@
 import pytest
+from django.core.cache import caches
 from rest_framework.test import APIClient
 
+from sso.core.caches import cache_config, REDIS
+
 
 @pytest.fixture
 def api_client():
     """Pytest fixture for Django REST framework ApiClient."""
     return APIClient()
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """Database changes are rolled back between tests, so cached entries must be cleared too."""
+    yield
+    for cache in caches.all():
+        cache.clear()
+
+
+@pytest.fixture
+def redis_caches(settings):
+    """Replace every cache alias with a Redis cache backed by an in-memory fakeredis server."""
+    settings.DJANGO_REDIS_CONNECTION_FACTORY = "sso.tests.cache_harness.FakeRedisConnectionFactory"
+    settings.CACHES = {
+        alias: cache_config(
+            REDIS,
+            alias=alias,
+            timeout=timeout,
+            max_entries=max_entries,
+            redis_url="redis://fakeredis:6379/0",
+        )
+        for alias, (timeout, max_entries) in settings.CACHE_ALIASES.items()
+    }
+    yield
+    for cache in caches.all():
+        cache.clear()
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("benchmarks")
+    group.addoption(
+        "--benchmarks",
+        action="store_true",
+        default=False,
+        help="Run only the benchmarks in sso/tests/benchmarks, which are skipped otherwise.",
+    )
+    group.addoption(
+        "--update-baselines",
+        action="store_true",
+        default=False,
+        help="Record the benchmark results as the new baselines instead of comparing them.",
+    )
+    group.addoption(
+        "--benchmark-latency",
+        action="store_true",
+        default=False,
+        help="Also compare (or record) the latency of each benchmark, not only its query count.",
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    """Benchmarks seed a large dataset, so they are run on their own with `--benchmarks`."""
+    if config.getoption("--benchmarks"):
+        selected, deselected = [], []
+        for item in items:
+            (selected if item.get_closest_marker("benchmark") else deselected).append(item)
+        config.hook.pytest_deselected(items=deselected)
+        items[:] = selected
+    else:
+        skip = pytest.mark.skip(reason="benchmarks only run with --benchmarks")
+        for item in items:
+            if item.get_closest_marker("benchmark"):
+                item.add_marker(skip)
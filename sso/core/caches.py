@@ -0,0 +1,64 @@
+"""
+Builds the `CACHES` setting.
+
+Each caching feature has its own cache alias so that it can be given its own backend and
+default TTL. Redis and memcached are shared between instances; `locmem` is an in-process LRU
+cache bounded by `max_entries`, which is ignored for the shared backends.
+"""
+REDIS = "redis"
+MEMCACHED = "memcached"
+LOCMEM = "locmem"
+
+BACKENDS = (REDIS, MEMCACHED, LOCMEM)
+
+LOCMEM_BACKEND = "django.core.cache.backends.locmem.LocMemCache"
+
+
+def cache_config(backend, *, alias, timeout, max_entries, redis_url=None, memcached_location=None):
+    """Return the `CACHES` entry for a cache alias"""
+
+    if backend not in BACKENDS:
+        raise ValueError(
+            f"Unknown cache backend {backend!r} for {alias}; expected one of {BACKENDS}"
+        )
+
+    config = {
+        "TIMEOUT": timeout,
+        "KEY_PREFIX": f"staff-sso:{alias}",
+    }
+
+    if backend == REDIS:
+        config.update(
+            {
+                "BACKEND": "django_redis.cache.RedisCache",
+                "LOCATION": redis_url,
+                "OPTIONS": {"CLIENT_CLASS": "django_redis.client.DefaultClient"},
+            }
+        )
+    elif backend == MEMCACHED:
+        config.update(
+            {
+                "BACKEND": "django.core.cache.backends.memcached.MemcachedCache",
+                "LOCATION": memcached_location,
+            }
+        )
+    else:
+        config.update(
+            {
+                "BACKEND": LOCMEM_BACKEND,
+                "LOCATION": alias,
+                "OPTIONS": {"MAX_ENTRIES": max_entries},
+            }
+        )
+
+    return config
+
+
+def is_shared(config):
+    """Return whether a `CACHES` entry is a cache shared between processes"""
+    return config["BACKEND"] != LOCMEM_BACKEND
+
+
+def local_aliases(caches):
+    """Return the aliases in a `CACHES` setting whose cache isn't shared between processes"""
+    return [alias for alias, config in caches.items() if not is_shared(config)]
@@ -0,0 +1,86 @@
+"""
+Credentials and replay protection for Hawk authenticated endpoints.
+
+Nonces are remembered in the `settings.NONCE_CACHE` cache, which is shared between instances
+when it is backed by Redis or memcached. Each is stored with an atomic `add`, so checking a nonce
+is a single cache operation. A nonce only needs to be remembered for as long as a request using
+it could pass the timestamp check, which is `max_skew` seconds either side of its `ts`.
+
+If the shared cache can't be reached, nonces are remembered in a bounded in-process store
+instead, so replay protection degrades to per-instance rather than failing requests.
+"""
+import functools
+import hashlib
+import hmac
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+MAX_SKEW_SECONDS = 15
+
+
+@functools.lru_cache(maxsize=32)
+def _lookup_credentials(passed_id, hawk_id, hawk_secret):
+    credentials = {"id": hawk_id, "key": hawk_secret}
+    return credentials if hmac.compare_digest(passed_id, hawk_id) else None
+
+
+def lookup_credentials(passed_id):
+    """Return the activity stream's Hawk credentials if they have this id"""
+    return _lookup_credentials(
+        passed_id, settings.ACTIVITY_STREAM_HAWK_ID, settings.ACTIVITY_STREAM_HAWK_SECRET
+    )
+
+
+class LocalNonceStore:
+    """An in-process store of recently seen nonces, bounded to `max_entries`"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._expiries = OrderedDict()
+
+    def add(self, key, timeout):
+        """Remember a key for `timeout` seconds, returning False if it is already remembered"""
+        now = time.time()
+
+        with self._lock:
+            # expiries are in insertion order, as every key has the same timeout
+            while self._expiries and next(iter(self._expiries.values())) <= now:
+                self._expiries.popitem(last=False)
+
+            if key in self._expiries:
+                return False
+
+            self._expiries[key] = now + timeout
+
+            while len(self._expiries) > self.max_entries:
+                self._expiries.popitem(last=False)
+
+        return True
+
+
+_local_nonces = LocalNonceStore(max_entries=100000)
+
+
+def _nonce_key(nonce, credentials_id):
+    return "hawk:nonce:" + hashlib.sha256(f"{credentials_id}:{nonce}".encode("utf-8")).hexdigest()
+
+
+def seen_nonce(nonce, credentials_id, max_skew=MAX_SKEW_SECONDS):
+    """Record a nonce and return whether it has been seen before within the skew window"""
+    key = _nonce_key(nonce, credentials_id)
+    timeout = 2 * max_skew
+
+    try:
+        return not caches[settings.NONCE_CACHE].add(key, True, timeout)
+    except Exception:
+        logger.warning("Unable to check the Hawk nonce in the shared cache", exc_info=True)
+
+    return not _local_nonces.add(key, timeout)
@@ -1,7 +1,6 @@
 import logging
-from ipaddress import ip_address, ip_network
 
-from django.conf import settings
+from .policy import admin_ip_allowlist
 
 logger = logging.getLogger(__file__)
 
@@ -11,15 +10,7 @@ def is_valid_ip(client_ip):
     if not client_ip:
         return False
 
-    if client_ip in settings.ALLOWED_ADMIN_IPS:
-        return True
-
-    ip_addr = ip_address(client_ip)
-    for cidr in settings.ALLOWED_ADMIN_IP_RANGES:
-        if ip_addr in ip_network(cidr):
-            return True
-
-    return False
+    return client_ip in admin_ip_allowlist.get()
 
 
 def get_client_ip(request):
@@ -1,8 +1,10 @@
+import functools
 import logging
 
 from django.conf import settings
 from django.http import HttpResponse
-from django.urls import resolve
+from django.urls import get_resolver, resolve, URLResolver
+from django.urls.resolvers import RoutePattern
 from django.utils.cache import add_never_cache_headers
 from django.utils.deprecation import MiddlewareMixin
 
@@ -20,9 +22,54 @@ class NeverCacheMiddleware(MiddlewareMixin):
         return response
 
 
+def _includes_admin(resolver):
+    return resolver.app_name == "admin" or any(
+        _includes_admin(pattern)
+        for pattern in resolver.url_patterns
+        if isinstance(pattern, URLResolver)
+    )
+
+
+@functools.lru_cache()
+def get_admin_path_prefixes(resolver):
+    """
+    Return the path prefixes of the root URLconf's includes that contain the admin, or `None`
+    if one of them isn't a plain path prefix
+    """
+    prefixes = []
+
+    for pattern in resolver.url_patterns:
+        if not isinstance(pattern, URLResolver) or not _includes_admin(pattern):
+            continue
+
+        route = str(pattern.pattern)
+
+        if not isinstance(pattern.pattern, RoutePattern) or "<" in route:
+            return None
+
+        prefixes.append("/" + route)
+
+    return tuple(prefixes)
+
+
+def is_admin_request(request):
+    """
+    Is the request for a view of the admin site?
+
+    Only paths under the prefix of an include that contains the admin are resolved, so that
+    other requests don't pay for resolving the URL twice.
+    """
+    prefixes = get_admin_path_prefixes(get_resolver())
+
+    if prefixes is not None and not request.path.startswith(prefixes):
+        return False
+
+    return resolve(request.path).app_name == "admin"
+
+
 def AdminIpRestrictionMiddleware(get_response):
     def middleware(request):
-        if resolve(request.path).app_name == "admin":
+        if is_admin_request(request):
             if settings.RESTRICT_ADMIN:
                 client_ip = get_client_ip(request)
 
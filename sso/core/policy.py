@@ -0,0 +1,144 @@
+"""
+Compiled forms of the comma separated lists in application settings and Django settings.
+
+Email domain lists, email orderings and ip allowlists are checked on every sign in and every
+admin request, so they are parsed into frozensets, tuples and network tables once, rather than
+split and parsed on every call. The email domain to IdP map is compiled by
+`sso.samlauth.routing`.
+
+Application fields are compiled by an `lru_cache` keyed on their raw value, so each version of
+a field is compiled once per process and a saved change is compiled the first time it's used,
+without anything to evict. Django settings are compiled by a `CompiledSetting`, which compiles
+the setting again when it's replaced (as tests do), but not when it's changed in place.
+"""
+import functools
+import logging
+from bisect import bisect_right
+from ipaddress import ip_address, ip_network
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def split_list(value):
+    """Split a comma separated list into a tuple of its stripped, non empty items"""
+
+    if not value:
+        return ()
+
+    return tuple(item for item in (item.strip() for item in value.split(",")) if item)
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_email_domains(value):
+    """
+    Return the frozenset of domains in a comma separated `allow_access_by_email_suffix`, lower
+    cased as the domains of email addresses are
+    """
+    return frozenset(domain.lower() for domain in split_list(value))
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_email_order(value):
+    """Return the domains in a comma separated `email_ordering`, in order"""
+    return split_list(value)
+
+
+class IpAllowlist:
+    """
+    A set of IPv4 and IPv6 networks, which `in` checks an ip address string against.
+
+    The networks of each ip version are merged into a sorted table of disjoint ranges of
+    addresses, and an address is looked up with a binary search of the table, so a lookup
+    takes the same time however the allowlist is written and grows slowly with its size.
+    """
+
+    def __init__(self, networks=()):
+        ranges = {4: [], 6: []}
+
+        for network in networks:
+            ranges[network.version].append(
+                (int(network.network_address), int(network.broadcast_address))
+            )
+
+        self._starts = {}
+        self._ends = {}
+
+        for version, version_ranges in ranges.items():
+            merged = []
+
+            for start, end in sorted(version_ranges):
+                if merged and start <= merged[-1][1] + 1:
+                    merged[-1][1] = max(merged[-1][1], end)
+                else:
+                    merged.append([start, end])
+
+            self._starts[version] = [start for start, _ in merged]
+            self._ends[version] = [end for _, end in merged]
+
+    def __bool__(self):
+        return any(self._starts.values())
+
+    def __contains__(self, client_ip):
+        try:
+            ip_addr = ip_address(client_ip)
+        except ValueError:
+            return False
+
+        value = int(ip_addr)
+        i = bisect_right(self._starts[ip_addr.version], value) - 1
+
+        return i >= 0 and value <= self._ends[ip_addr.version][i]
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_ip_allowlist(entries):
+    """
+    Return an `IpAllowlist` of a tuple of ip addresses and networks in CIDR notation.
+    Invalid entries are logged and skipped.
+    """
+    networks = []
+
+    for entry in entries:
+        try:
+            network = ip_network(entry, strict=False)
+        except ValueError:
+            logger.warning("Ignoring invalid ip allowlist entry %r", entry)
+            continue
+
+        networks.append(network)
+
+    return IpAllowlist(networks)
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_allowed_ips(value):
+    """Return an `IpAllowlist` of a comma separated `allowed_ips`"""
+    return compile_ip_allowlist(split_list(value))
+
+
+class CompiledSetting:
+    """A Django setting compiled by `compile`, which is compiled again if the setting is replaced"""
+
+    def __init__(self, *names, compile):
+        self.names = names
+        self.compile = compile
+        self._compiled = None
+
+    def get(self):
+        values = tuple(getattr(settings, name) for name in self.names)
+        compiled = self._compiled
+
+        # the values are kept with the result, so their ids can't be reused by a new value
+        if compiled is None or any(a is not b for a, b in zip(compiled[0], values)):
+            compiled = self._compiled = (values, self.compile(*values))
+
+        return compiled[1]
+
+
+admin_ip_allowlist = CompiledSetting(
+    "ALLOWED_ADMIN_IPS",
+    "ALLOWED_ADMIN_IP_RANGES",
+    compile=lambda ips, ranges: compile_ip_allowlist(tuple(ips) + tuple(ranges)),
+)
@@ -0,0 +1,104 @@
+"""
+Session engine for `SESSION_SAVE_EVERY_REQUEST`.
+
+Sessions are stored in the database and written through to the `settings.SESSION_CACHE_ALIAS`
+cache, as with Django's `cached_db` engine. Saving every request only slides the expiry date
+forward, so a save is skipped when the session data is unchanged since it was loaded and the
+stored expiry date is less than `settings.SESSION_SAVE_TOLERANCE` seconds behind the new one.
+The tolerance should be small compared to `SESSION_COOKIE_AGE`, as a session can expire up to
+that much earlier than its cookie.
+
+Sessions are loaded from the cache when they are in it, so a session deleted by one process is
+only gone for the others if they share the cache. The settings only use this engine if the
+sessions cache is shared, and otherwise use Django's `db` engine.
+
+`clear_expired`, and so the `clearsessions` command, deletes expired sessions in batches of
+`settings.SESSION_CLEAR_BATCH_SIZE` rather than in a single statement.
+"""
+from django.conf import settings
+from django.contrib.sessions.backends import cached_db
+from django.utils import timezone
+
+KEY_PREFIX = "sso.core.sessions"
+
+
+class SessionStore(cached_db.SessionStore):
+    cache_key_prefix = KEY_PREFIX
+
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        self._stored_payload = None
+        self._stored_expire_date = None
+        self._saved = None
+
+    def _payload(self, data):
+        return self.serializer().dumps(data)
+
+    def load(self):
+        try:
+            stored = self._cache.get(self.cache_key)
+        except Exception:
+            # Some backends (e.g. memcache) raise an exception on invalid
+            # cache keys. If this happens, reset the session.
+            stored = None
+
+        if stored is None:
+            s = self._get_session_from_db()
+            if not s:
+                return {}
+            stored = {"session_data": s.session_data, "expire_date": s.expire_date}
+            self._cache.set(self.cache_key, stored, self.get_expiry_age(expiry=s.expire_date))
+
+        data = self.decode(stored["session_data"])
+        self._stored_payload = self._payload(data)
+        self._stored_expire_date = stored["expire_date"]
+
+        return data
+
+    def is_unchanged(self):
+        """Return whether saving the session would only slide its expiry within the tolerance"""
+        data = self._get_session()
+
+        if self._stored_expire_date is None or self._payload(data) != self._stored_payload:
+            return False
+
+        slide = self.get_expiry_date() - self._stored_expire_date
+
+        return 0 <= slide.total_seconds() < settings.SESSION_SAVE_TOLERANCE
+
+    def create_model_instance(self, data):
+        obj = super().create_model_instance(data)
+        self._saved = obj, self._payload(data)
+        return obj
+
+    def save(self, must_create=False):
+        if self.session_key is not None and not must_create and self.is_unchanged():
+            return
+
+        # skip cached_db's save, which caches the decoded data without its expiry date
+        super(cached_db.SessionStore, self).save(must_create)
+
+        if self._saved is not None:
+            obj, self._stored_payload = self._saved
+            self._saved = None
+            self._stored_expire_date = obj.expire_date
+            self._cache.set(
+                self.cache_key,
+                {"session_data": obj.session_data, "expire_date": obj.expire_date},
+                self.get_expiry_age(),
+            )
+
+    @classmethod
+    def clear_expired(cls):
+        model = cls.get_model_class()
+        now = timezone.now()
+
+        while True:
+            session_keys = list(
+                model.objects.filter(expire_date__lt=now).values_list("session_key", flat=True)[
+                    : settings.SESSION_CLEAR_BATCH_SIZE
+                ]
+            )
+            if not session_keys:
+                break
+            model.objects.filter(session_key__in=session_keys).delete()
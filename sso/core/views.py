@@ -1,62 +1,57 @@
-import datetime
-import hmac
-import uuid
+from collections import defaultdict
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.http import JsonResponse
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
 from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_GET
 from hawkserver import authenticate_hawk_header
 
+from sso.core.hawk import lookup_credentials, MAX_SKEW_SECONDS, seen_nonce
 from sso.oauth2.models import Application as OAuthApplication
+from sso.user.change_log import events_after, format_cursor
+from sso.user.models import EmailAddress
 
+ACTIVITY_STREAM_DEFAULT_PAGE_SIZE = 50
 
-@require_GET
-@csrf_exempt
-def activity_stream(request):
-    def forbidden():
-        return JsonResponse(
-            data={},
-            status=403,
-        )
+# The number of users whose emails and permitted applications are loaded together
+ACTIVITY_STREAM_CHUNK_SIZE = 500
+
+
+def _forbidden():
+    return JsonResponse(
+        data={},
+        status=403,
+    )
+
+
+def _is_authenticated(request):
+    """Return whether the request came via private networking and is signed with Hawk"""
 
     ############################################
     ## Ensure not accessed via public networking
 
     via_public_internet = "x-forwarded-for" in request.headers
     if via_public_internet:
-        return forbidden()
+        return False
 
     ###########################
     ## Ensure signed with Hawk
 
-    def lookup_credentials(passed_id):
-        user = {
-            "id": settings.ACTIVITY_STREAM_HAWK_ID,
-            "key": settings.ACTIVITY_STREAM_HAWK_SECRET,
-        }
-        return user if hmac.compare_digest(passed_id, user["id"]) else None
-
-    def seen_nonce(nonce, id):
-        # No replay attack prevention since no shared cache between instances,
-        # but we're ok with that for
-        return False
-
     try:
         request.headers["authorization"]
     except KeyError:
-        return forbidden()
+        return False
 
     # This is brittle to not running in PaaS or not via private networking
     host, port = request.META["HTTP_HOST"].split(":")
 
-    max_skew_seconds = 15
     error_message, credentials = authenticate_hawk_header(
         lookup_credentials,
         seen_nonce,
-        max_skew_seconds,
+        MAX_SKEW_SECONDS,
         request.headers["authorization"],
         request.method,
         host,
@@ -65,126 +60,185 @@ def activity_stream(request):
         request.headers.get("content-type", ""),
         request.body,
     )
-    if error_message is not None:
-        return forbidden()
 
-    #############
-    ## Get cursor
+    return error_message is None
 
-    after_ts_str, after_user_id_str = request.GET.get(
-        "cursor", "0.0_00000000-0000-4000-0000-000000000000"
-    ).split("_")
-    after_ts = datetime.datetime.fromtimestamp(float(after_ts_str))
-    after_user_id = uuid.UUID(after_user_id_str)
 
-    ##########################################################
-    ## Fetch activities after cursor (i.e. user modifications)
+def _get_page_size(request):
+    """Return the requested page size, capped at the maximum, or None if it's invalid"""
+    try:
+        page_size = int(request.GET.get("page_size", ACTIVITY_STREAM_DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return None
+
+    if page_size < 1:
+        return None
+
+    return min(page_size, settings.ACTIVITY_STREAM_MAX_PAGE_SIZE)
+
+
+def _get_events(cursor, page_size):
+    """
+    Return a page of the user change events after the cursor, with their users.
+
+    See `sso.user.change_log` for how events are returned exactly once. Cursors issued before the
+    change log existed restart the stream from the beginning.
+    """
+    return events_after(cursor).only(
+        "id",
+        "transaction_id",
+        "created",
+        "user",
+        "user__user_id",
+        "user__email_user_id",
+        "user__last_accessed",
+        "user__is_active",
+        "user__became_inactive_on",
+        "user__first_name",
+        "user__last_name",
+        "user__email",
+        "user__contact_email",
+        "user__date_joined",
+    )[:page_size]
+
+
+def _without_duplicates(seq):
+    seen = set()
+    return [x for x in seq if not (x in seen or seen.add(x))]
+
+
+def _activity(event, emails, permitted_applications):
+    user = event.user
+    return {
+        "id": f"dit:StaffSSO:User:{user.user_id}:Update",
+        "published": event.created,
+        "object": {
+            "id": f"dit:StaffSSO:User:{user.user_id}",
+            "type": "dit:StaffSSO:User",
+            "name": user.get_full_name(),
+            "dit:StaffSSO:User:userId": user.user_id,
+            "dit:StaffSSO:User:emailUserId": user.email_user_id,
+            "dit:StaffSSO:User:contactEmailAddress": user.contact_email
+            if user.contact_email
+            else None,
+            "dit:StaffSSO:User:joined": user.date_joined,
+            "dit:StaffSSO:User:lastAccessed": user.last_accessed,
+            "dit:StaffSSO:User:permittedApplications": [
+                {
+                    # name and url are both in the W3C Activity Streams 2.0 Vocab
+                    "name": app["name"],
+                    "url": app["url"],
+                }
+                for app in permitted_applications
+            ],
+            "dit:StaffSSO:User:status": "active" if user.is_active else "inactive",
+            "dit:StaffSSO:User:becameInactiveOn": None
+            if user.is_active
+            else user.became_inactive_on,
+            "dit:firstName": user.first_name,
+            "dit:lastName": user.last_name,
+            "dit:emailAddress": _without_duplicates([user.email] + sorted(emails)),
+        },
+    }
+
 
-    # `STATEMENT_TIMESTAMP`: it is often more typical to use CURRENT_TIMESTAMP,
-    # however, CURRENT_TIMESTAMP is the time of the start of the current
-    # transaction, and pytest tests are run in a transaction, so
-    # CURRENT_TIMESTAMP does not progress
-    #
-    # `- INTERVAL 1 second`: `last_modified` is not strictly monotonically
-    # increasing due to overlapping transactions committed in a non-guarenteed
-    # order. It's technically an eventually consistent situation, so updates
-    # can be missed if serveral are close together. We mitigate this risk by
-    # adding a delay before activities appear in the stream.
-
-    per_page = 50
+def _activities(events, default_access_apps):
+    """Yield each event with its activity"""
     User = get_user_model()
-    users = list(
-        User.objects.only(
-            "user_id",
-            "email_user_id",
-            "last_modified",
-            "last_accessed",
-            "is_active",
-            "first_name",
-            "last_name",
-            "email",
-            "contact_email",
-            "date_joined",
-        )
-        .prefetch_related(
-            "emails",
-            "permitted_applications",
-            "access_profiles__oauth2_applications",
-            "access_profiles__saml2_applications",
-        )
-        .extra(
-            where=[
-                "(last_modified, user_id) > (%s, %s)",
-                "last_modified < STATEMENT_TIMESTAMP() - INTERVAL '1 second'",
-            ],
-            params=(after_ts, after_user_id),
-        )
-        .order_by("last_modified", "user_id")[:per_page]
-    )
 
-    ################################################################
-    ## Convert to activities, with link to next page if at least one
+    # The emails and permitted applications of each chunk of users are loaded together
+    # while the events and their users are read from a server-side cursor
+    for chunk in chunked(
+        events.iterator(chunk_size=ACTIVITY_STREAM_CHUNK_SIZE), ACTIVITY_STREAM_CHUNK_SIZE
+    ):
+        user_ids = [event.user_id for event in chunk]
+
+        emails = defaultdict(list)
+        for user_id, email in EmailAddress.objects.filter(user_id__in=user_ids).values_list(
+            "user_id", "email"
+        ):
+            emails[user_id].append(email)
+
+        permitted_applications = User.objects.get_permitted_applications_by_user(
+            user_ids,
+            include_non_public=True,
+            get_default_access_allowed_apps=lambda: default_access_apps,
+        )
 
-    def next_url(after_ts, after_user_id):
-        return request.build_absolute_uri(
-            reverse("api-v1:core:activity-stream")
-        ) + "?cursor={}_{}".format(str(after_ts.timestamp()), str(after_user_id))
+        for event in chunk:
+            yield event, _activity(
+                event, emails[event.user_id], permitted_applications[event.user_id]
+            )
 
-    def without_duplicates(seq):
-        seen = set()
-        return [x for x in seq if not (x in seen or seen.add(x))]
 
-    default_access_apps = OAuthApplication.get_default_access_applications()
+def _page(activities, next_url):
+    """Yield the JSON of a page of activities, with a link to the next page if there are any"""
+    encoder = DjangoJSONEncoder()
 
-    page = {
-        "@context": [
+    yield '{"@context": ' + encoder.encode(
+        [
             "https://www.w3.org/ns/activitystreams",
             {"dit": "https://www.trade.gov.uk/ns/activitystreams/v1"},
-        ],
-        "type": "Collection",
-        "orderedItems": [
-            {
-                "id": f"dit:StaffSSO:User:{user.user_id}:Update",
-                "published": user.last_modified,
-                "object": {
-                    "id": f"dit:StaffSSO:User:{user.user_id}",
-                    "type": "dit:StaffSSO:User",
-                    "name": user.get_full_name(),
-                    "dit:StaffSSO:User:userId": user.user_id,
-                    "dit:StaffSSO:User:emailUserId": user.email_user_id,
-                    "dit:StaffSSO:User:contactEmailAddress": user.contact_email
-                    if user.contact_email
-                    else None,
-                    "dit:StaffSSO:User:joined": user.date_joined,
-                    "dit:StaffSSO:User:lastAccessed": user.last_accessed,
-                    "dit:StaffSSO:User:permittedApplications": [
-                        {
-                            # name and url are both in the W3C Activity Streams 2.0 Vocab
-                            "name": app["name"],
-                            "url": app["url"],
-                        }
-                        for app in user.get_permitted_applications(
-                            include_non_public=True,
-                            get_default_access_allowed_apps=lambda: default_access_apps,
-                        )
-                    ],
-                    "dit:StaffSSO:User:status": "active" if user.is_active else "inactive",
-                    "dit:StaffSSO:User:becameInactiveOn": None
-                    if user.is_active
-                    else user.became_inactive_on,
-                    "dit:firstName": user.first_name,
-                    "dit:lastName": user.last_name,
-                    "dit:emailAddress": without_duplicates(
-                        [user.email] + sorted([email.email for email in user.emails.all()])
-                    ),
-                },
-            }
-            for user in users
-        ],
-        **({"next": next_url(users[-1].last_modified, users[-1].user_id)} if users else {}),
-    }
+        ]
+    ) + ', "type": "Collection", "orderedItems": ['
 
-    return JsonResponse(
-        data=page,
+    last_event = None
+    for event, item in activities:
+        yield ("" if last_event is None else ", ") + encoder.encode(item)
+        last_event = event
+
+    yield "]"
+
+    if last_event is not None:
+        yield ', "next": ' + encoder.encode(next_url(last_event))
+
+    yield "}"
+
+
+@require_GET
+@csrf_exempt
+def activity_stream(request):
+    if not _is_authenticated(request):
+        return _forbidden()
+
+    #############
+    ## Get cursor
+
+    cursor = request.GET.get("cursor")
+    page_size = _get_page_size(request)
+
+    if page_size is None:
+        return JsonResponse(data={}, status=400)
+
+    ##########################################################
+    ## Fetch activities after cursor (i.e. user modifications)
+
+    events = _get_events(cursor, page_size)
+    default_access_apps = OAuthApplication.get_default_access_applications()
+
+    ################################################################
+    ## Convert to activities, with link to next page if at least one
+
+    def next_url(event):
+        return (
+            request.build_absolute_uri(reverse("api-v1:core:activity-stream"))
+            + "?cursor={}".format(format_cursor(event))
+            + (f"&page_size={page_size}" if "page_size" in request.GET else "")
+        )
+
+    return StreamingHttpResponse(
+        _page(_activities(events, default_access_apps), next_url),
         status=200,
+        content_type="application/json",
     )
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -2,12 +2,14 @@ from urllib.parse import parse_qs, quote_plus, urlparse
 
 from django import forms
 from django.conf import settings
-from django.core.mail import send_mail
 from django.core.validators import EmailValidator
-from django.template.loader import render_to_string
 from django.urls import reverse
 
+from sso.core.ip_filter import get_client_ip
+
+from . import outbox
 from .models import EmailToken
+from .signin_email import render_signin_email
 
 
 class EmailForm(forms.Form):
@@ -54,8 +56,14 @@ class EmailForm(forms.Form):
 
     def send_signin_email(self, request):
         """
-        Generate an EmailToken and send a sign in email to the user
+        Generate an EmailToken and queue a sign in email to the user, unless the requester has
+        reached its rate limit
         """
+        requester_ip = get_client_ip(request)
+
+        if outbox.is_rate_limited(self.email, requester_ip):
+            return
+
         token = EmailToken.objects.create_token(self.email)
         next_url = request.GET.get("next", "")
 
@@ -69,13 +77,6 @@ class EmailForm(forms.Form):
             scheme="https://", host=request.get_host(), path=path, next_url=next_url
         )
 
-        subject = render_to_string("emailauth/email_subject.txt").strip()
-        message = render_to_string("emailauth/email.txt", context=dict(auth_url=url))
+        subject, message = render_signin_email(url)
 
-        send_mail(
-            subject,
-            message,
-            settings.EMAIL_FROM,
-            [self.email],
-            fail_silently=False,
-        )
+        outbox.enqueue(self.email, subject, message, requester_ip=requester_ip)
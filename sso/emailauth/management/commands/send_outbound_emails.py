@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from sso.emailauth.outbox import delete_old, send_pending
+
+
+class Command(BaseCommand):
+    help = (
+        "Send the emails in the outbox that are due, and delete sent and failed emails that are "
+        "older than the retention period"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--keep-days",
+            type=int,
+            default=7,
+            help="delete sent and failed emails created more than this many days ago (default 7)",
+        )
+
+    def handle(self, *args, keep_days, **kwargs):
+        sent = send_pending()
+        deleted = delete_old(keep_days)
+
+        self.stdout.write(f"Sent {sent} email(s), deleted {deleted} old email(s)")
@@ -61,3 +61,37 @@ class EmailToken(models.Model):
     def mark_used(self):
         self.used = True
         self.save()
+
+
+class OutboundEmail(models.Model):
+    """An email waiting in the outbox, or sent from it, see `sso.emailauth.outbox`"""
+
+    PENDING = "pending"
+    SENT = "sent"
+    FAILED = "failed"
+
+    STATUS_CHOICES = [(PENDING, "Pending"), (SENT, "Sent"), (FAILED, "Failed")]
+
+    created = models.DateTimeField(auto_now_add=True)
+    from_address = models.EmailField()
+    to_address = models.EmailField()
+    requester_ip = models.GenericIPAddressField(null=True, blank=True)
+    subject = models.CharField(max_length=255)
+    message = models.TextField()
+    status = models.CharField(max_length=8, choices=STATUS_CHOICES, default=PENDING)
+    send_after = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    sent = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f"{self.to_address}: {self.subject} ({self.status})"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "send_after"], name="outbound_email_due_idx"),
+            models.Index(
+                fields=["to_address", "requester_ip", "created"],
+                name="outbound_email_address_idx",
+            ),
+        ]
@@ -0,0 +1,303 @@
+"""
+A durable outbox for the emails sent while signing in.
+
+`enqueue` stores an `OutboundEmail` instead of sending it, so that a request doesn't wait for the
+mail relay. The emails are sent by `send_pending`, which claims the due emails in batches and
+sends each batch over one connection. A batch is claimed in a short transaction, locked with
+`SKIP LOCKED` so that several senders can run at once, which leases its emails by putting their
+`send_after` back by `settings.EMAIL_OUTBOX_LEASE` seconds. They are sent once that has
+committed, so that no transaction is held open while the relay is waiting, and an email leased
+by a sender that stops is sent by another once its lease runs out. An email that can't be sent is
+tried again after a delay that doubles with each attempt, until
+`settings.EMAIL_OUTBOX_MAX_ATTEMPTS` have failed.
+
+With `settings.EMAIL_OUTBOX_THREAD` enabled, each process has a sender thread, which is woken
+when an email is queued and otherwise checks for due emails every
+`settings.EMAIL_OUTBOX_POLL_INTERVAL` seconds. It keeps its connection to the mail relay open
+for as long as there are emails to send, and opens a new one if the relay has closed it.
+Without it, the `send_outbound_emails` management command has to be run to send them. Emails are
+kept in the database until they are sent, so an email queued by a process that stops is sent by
+another sender. The message of an email, which holds a sign in link, is cleared once the email
+has been sent or given up on. The emails sent and failed, the connections opened and the time
+taken to send are counted in `stats`.
+
+Each requester ip may have at most `settings.EMAIL_OUTBOX_RATE_LIMIT` emails sent to an address
+in every `settings.EMAIL_OUTBOX_RATE_LIMIT_PERIOD` seconds, which `is_rate_limited` checks before
+a sign in link is made. The limit is per requester as well as per address, so that requests from
+one ip can't stop an address being sent emails requested from another.
+"""
+import atexit
+import logging
+import threading
+import time
+from datetime import timedelta
+from smtplib import SMTPServerDisconnected
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+
+_lock = threading.Lock()
+
+stats = {"sent": 0, "failed": 0, "connections": 0, "send_seconds": 0.0}
+
+
+def is_rate_limited(to_address, requester_ip):
+    """
+    Return True if `requester_ip` has queued its limit of emails to `to_address` in the current
+    period. The ip is None if the client's ip isn't known, which is limited as one requester.
+    """
+    since = timezone.now() - timedelta(seconds=settings.EMAIL_OUTBOX_RATE_LIMIT_PERIOD)
+
+    queued = OutboundEmail.objects.filter(
+        to_address=to_address, requester_ip=requester_ip, created__gte=since
+    ).count()
+
+    if queued < settings.EMAIL_OUTBOX_RATE_LIMIT:
+        return False
+
+    logger.warning(
+        "Not sending an email to %s requested by %s, it has reached its rate limit",
+        to_address,
+        requester_ip,
+    )
+    return True
+
+
+def enqueue(to_address, subject, message, from_address=None, requester_ip=None):
+    """
+    Queue an email to be sent once the current transaction commits, and return it. Emails
+    requested by a client should be checked with `is_rate_limited` first.
+    """
+    email = OutboundEmail.objects.create(
+        from_address=from_address or settings.EMAIL_FROM,
+        to_address=to_address,
+        requester_ip=requester_ip,
+        subject=subject,
+        message=message,
+    )
+
+    if settings.EMAIL_OUTBOX_THREAD:
+        transaction.on_commit(sender.wake)
+
+    return email
+
+
+def _retry_delay(attempts):
+    return timedelta(seconds=settings.EMAIL_OUTBOX_RETRY_DELAY * 2 ** (attempts - 1))
+
+
+def _record_failure(email, error, now):
+    email.attempts += 1
+    email.last_error = str(error)
+
+    if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+        email.status = OutboundEmail.FAILED
+        email.message = ""
+        logger.error(
+            "Giving up on email %d to %s after %d attempts: %s",
+            email.pk,
+            email.to_address,
+            email.attempts,
+            error,
+        )
+    else:
+        email.send_after = now + _retry_delay(email.attempts)
+        logger.warning(
+            "Failed to send email %d to %s, attempt %d: %s",
+            email.pk,
+            email.to_address,
+            email.attempts,
+            error,
+        )
+
+
+def _open(connection):
+    if connection.open():
+        with _lock:
+            stats["connections"] += 1
+
+
+def _send(message, connection):
+    try:
+        message.send()
+    except SMTPServerDisconnected:
+        # the relay closed a connection that was kept open, so open a new one and try again
+        connection.close()
+        _open(connection)
+        message.send()
+
+
+def _send_batch(emails, connection):
+    now = timezone.now()
+    start = time.perf_counter()
+    sent = 0
+
+    try:
+        _open(connection)
+    except Exception as error:
+        for email in emails:
+            _record_failure(email, error, now)
+    else:
+        for email in emails:
+            message = EmailMessage(
+                email.subject,
+                email.message,
+                email.from_address,
+                [email.to_address],
+                connection=connection,
+            )
+            try:
+                _send(message, connection)
+            except Exception as error:
+                _record_failure(email, error, now)
+            else:
+                email.status = OutboundEmail.SENT
+                email.sent = timezone.now()
+                email.message = ""
+                email.attempts += 1
+                sent += 1
+
+    OutboundEmail.objects.bulk_update(
+        emails, ["status", "message", "send_after", "attempts", "sent", "last_error"]
+    )
+
+    elapsed = time.perf_counter() - start
+
+    with _lock:
+        stats["sent"] += sent
+        stats["failed"] += len(emails) - sent
+        stats["send_seconds"] += elapsed
+
+    logger.info("Sent %d of %d emails in %.3f seconds", sent, len(emails), elapsed)
+
+    return sent
+
+
+def _claim(batch_size):
+    """Lease a batch of the due emails to this sender, and return them"""
+    with transaction.atomic():
+        emails = list(
+            OutboundEmail.objects.select_for_update(skip_locked=True)
+            .filter(status=OutboundEmail.PENDING, send_after__lte=timezone.now())
+            .order_by("send_after", "pk")[:batch_size]
+        )
+
+        if emails:
+            OutboundEmail.objects.filter(pk__in=[email.pk for email in emails]).update(
+                send_after=timezone.now() + timedelta(seconds=settings.EMAIL_OUTBOX_LEASE)
+            )
+
+    return emails
+
+
+def _close(connection):
+    try:
+        connection.close()
+    except Exception:
+        logger.exception("Failed to close the email connection")
+
+
+def send_pending(batch_size=BATCH_SIZE, connection=None):
+    """
+    Send the emails in the outbox that are due, and return how many were sent. They are sent
+    over `connection`, which is left open for the next call, or else over a new connection,
+    which is closed when they have been sent.
+    """
+    close = connection is None
+
+    if close:
+        connection = get_connection(fail_silently=False)
+
+    sent = 0
+
+    try:
+        while True:
+            emails = _claim(batch_size)
+
+            if emails:
+                sent += _send_batch(emails, connection)
+
+            if len(emails) < batch_size:
+                return sent
+    finally:
+        if close:
+            _close(connection)
+
+
+def delete_old(days):
+    """Delete the sent and failed emails created more than `days` days ago"""
+    deleted, _ = (
+        OutboundEmail.objects.exclude(status=OutboundEmail.PENDING)
+        .filter(created__lt=timezone.now() - timedelta(days=days))
+        .delete()
+    )
+
+    return deleted
+
+
+class OutboxSender:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._wake = threading.Event()
+        self._stopped = False
+
+    def wake(self):
+        """Have the sender thread send the due emails now, starting it if it isn't running"""
+        self._start()
+        self._wake.set()
+
+    def _start(self):
+        if self._thread is not None:
+            return
+
+        with self._lock:
+            if self._thread is None:
+                self._stopped = False
+                self._thread = threading.Thread(
+                    target=self._run, name="email-outbox-sender", daemon=True
+                )
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def _run(self):
+        # kept open while there are emails to send, and closed once a poll finds none
+        connection = get_connection(fail_silently=False)
+
+        while not self._stopped:
+            self._wake.wait(settings.EMAIL_OUTBOX_POLL_INTERVAL)
+            self._wake.clear()
+
+            if self._stopped:
+                break
+
+            close_old_connections()
+            try:
+                sent = send_pending(connection=connection)
+            except Exception:
+                logger.exception("Failed to send the emails in the outbox")
+                sent = 0
+
+            if not sent:
+                _close(connection)
+
+        _close(connection)
+
+    def stop(self):
+        """Stop the sender thread; emails still in the outbox are left for the next sender"""
+        if self._thread is not None:
+            self._stopped = True
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+
+
+sender = OutboxSender()
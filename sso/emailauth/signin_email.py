@@ -0,0 +1,45 @@
+"""
+Rendering of the sign in email.
+
+The subject and message templates are compiled once per process, rather than found and parsed
+by the template loaders for each email, and compiled again if `settings.TEMPLATES` is replaced.
+The subject doesn't depend on the sign in link, so it's only rendered once. The number of emails
+rendered and the time taken to render them are counted in `stats`.
+"""
+import threading
+import time
+
+from django.template.loader import get_template
+
+from sso.core.policy import CompiledSetting
+
+SUBJECT_TEMPLATE = "emailauth/email_subject.txt"
+MESSAGE_TEMPLATE = "emailauth/email.txt"
+
+_lock = threading.Lock()
+
+stats = {"rendered": 0, "render_seconds": 0.0}
+
+
+def _compile_templates(templates):
+    subject = get_template(SUBJECT_TEMPLATE).render().strip()
+    return subject, get_template(MESSAGE_TEMPLATE)
+
+
+_templates = CompiledSetting("TEMPLATES", compile=_compile_templates)
+
+
+def render_signin_email(auth_url):
+    """Return the subject and message of the email with the sign in link `auth_url`"""
+    start = time.perf_counter()
+
+    subject, message_template = _templates.get()
+    message = message_template.render({"auth_url": auth_url})
+
+    elapsed = time.perf_counter() - start
+
+    with _lock:
+        stats["rendered"] += 1
+        stats["render_seconds"] += elapsed
+
+    return subject, message
@@ -0,0 +1 @@
+default_app_config = "sso.oauth2.apps.OAuth2Config"
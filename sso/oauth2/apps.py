@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class OAuth2Config(AppConfig):
+    name = "sso.oauth2"
+    label = "oauth2"
+
+    def ready(self):
+        from . import signals  # noqa: F401
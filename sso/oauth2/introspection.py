@@ -0,0 +1,184 @@
+"""
+Caches token introspection responses.
+
+Responses are cached per (introspecting client, token) in the `settings.INTROSPECTION_CACHE`
+cache. Active tokens are cached for up to the cache's default TTL, capped at the token's own
+expiry; inactive and denied responses for `settings.INTROSPECTION_NEGATIVE_CACHE_TTL` seconds.
+
+Each cached response records the generation of its introspecting client and of its token at the
+time it was built. The generations are replaced once the saving or revoking of a token, or a
+change to a client's `allow_tokens_from` list, has committed (see `sso.oauth2.signals`), which
+invalidates every response that depends on them without having to know their keys. The response, client and token
+generation are fetched in a single cache round trip.
+
+A generation that is missing, e.g. because it was evicted, is a miss, and a new one is added
+before the response is built, so that a response cached against an evicted generation is never
+served again, and an invalidation made while the response is being built is never overwritten.
+
+Tokens are hashed before being used in cache keys.
+"""
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+def _cache():
+    return caches[settings.INTROSPECTION_CACHE]
+
+
+def hash_token(token_value):
+    return hashlib.sha256((token_value or "").encode("utf-8")).hexdigest()
+
+
+def _response_key(client_id, token_hash):
+    return f"introspect:response:{client_id}:{token_hash}"
+
+
+def _client_generation_key(client_id):
+    return f"introspect:client:{client_id}"
+
+
+def _token_generation_key(token_hash):
+    return f"introspect:token:{token_hash}"
+
+
+def positive_timeout(expires, now):
+    """Return how long an active token's response can be cached for"""
+    return min(_cache().default_timeout, int((expires - now).total_seconds()))
+
+
+def negative_timeout():
+    """Return how long an inactive or denied response can be cached for"""
+    return settings.INTROSPECTION_NEGATIVE_CACHE_TTL
+
+
+class CachedIntrospection:
+    """
+    The cached introspection response, if any, for a token introspected by a client.
+
+    `response` is a tuple `(status, data)` or None on a cache miss; `set()` stores a response
+    against the generations read when the object was created, so a response built from data that
+    was invalidated in the meantime is never served.
+    """
+
+    def __init__(self, client_id, token_value, values=None):
+        token_hash = hash_token(token_value)
+
+        self.token_value = token_value
+        self.key = _response_key(client_id, token_hash)
+        self.client_key = _client_generation_key(client_id)
+        self.token_key = _token_generation_key(token_hash)
+
+        if values is None:
+            values = _cache().get_many(self.cache_keys())
+            _add_missing_generations(values, [self.client_key, self.token_key])
+
+        self.generations = (values.get(self.client_key), values.get(self.token_key))
+
+        cached = values.get(self.key)
+
+        if (
+            cached is not None
+            and None not in self.generations
+            and cached["generations"] == self.generations
+        ):
+            self.response = cached["status"], cached["data"]
+        else:
+            self.response = None
+
+        self.timeout = 0
+
+    @classmethod
+    def many(cls, client_id, token_values):
+        """Return a dict of token to `CachedIntrospection`, read in a single cache round trip"""
+        token_values = list(dict.fromkeys(token_values))
+
+        response_keys = []
+        generation_keys = [_client_generation_key(client_id)]
+        for token_value in token_values:
+            token_hash = hash_token(token_value)
+            response_keys.append(_response_key(client_id, token_hash))
+            generation_keys.append(_token_generation_key(token_hash))
+
+        values = _cache().get_many(response_keys + generation_keys)
+        _add_missing_generations(values, generation_keys)
+
+        return {token_value: cls(client_id, token_value, values) for token_value in token_values}
+
+    def cache_keys(self):
+        return [self.key, self.client_key, self.token_key]
+
+    def _value(self):
+        status, data = self.response
+        return {"generations": self.generations, "status": status, "data": data}
+
+    def set(self, status, data, timeout):
+        self.response = status, data
+        self.timeout = timeout
+
+        if timeout > 0 and None not in self.generations:
+            _cache().set(self.key, self._value(), timeout)
+
+    @staticmethod
+    def set_many(entries):
+        """
+        Store several `CachedIntrospection` responses whose `response` and `timeout` have been
+        assigned.
+
+        Active responses share the shortest of their timeouts, so they are written in a single
+        cache round trip, as are inactive and denied ones.
+        """
+        active, inactive = {}, {}
+        active_timeout = inactive_timeout = None
+
+        for entry in entries:
+            if entry.timeout <= 0 or None in entry.generations:
+                continue
+            if entry.response[1].get("active"):
+                active[entry.key] = entry._value()
+                active_timeout = min(entry.timeout, active_timeout or entry.timeout)
+            else:
+                inactive[entry.key] = entry._value()
+                inactive_timeout = min(entry.timeout, inactive_timeout or entry.timeout)
+
+        cache = _cache()
+        if active:
+            cache.set_many(active, active_timeout)
+        if inactive:
+            cache.set_many(inactive, inactive_timeout)
+
+
+def _add_missing_generations(values, generation_keys):
+    """Add a new generation for each of `generation_keys` that is missing from `values`"""
+    cache = _cache()
+    taken = []
+
+    for key in generation_keys:
+        if values.get(key) is None:
+            generation = uuid.uuid4().hex
+            if cache.add(key, generation, cache.default_timeout):
+                values[key] = generation
+            else:
+                taken.append(key)
+
+    # another process added these first, so use theirs
+    if taken:
+        values.update(cache.get_many(taken))
+
+
+def _new_generation(key):
+    # generations must outlive any response cached against them
+    cache = _cache()
+    cache.set(key, uuid.uuid4().hex, cache.default_timeout)
+
+
+def invalidate_token(token_value):
+    """Invalidate every cached response for a token"""
+    _new_generation(_token_generation_key(hash_token(token_value)))
+
+
+def invalidate_client(client_id):
+    """Invalidate every cached response for an introspecting client"""
+    _new_generation(_client_generation_key(client_id))
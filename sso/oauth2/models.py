@@ -3,6 +3,8 @@ from django.db import models
 from django.utils.translation import gettext_lazy as _
 from oauth2_provider.models import AbstractApplication
 
+from sso.core.policy import compile_email_order
+
 
 class Application(AbstractApplication):
     application_key = models.SlugField(_("unique text id"), max_length=50, unique=True)
@@ -89,11 +91,10 @@ class Application(AbstractApplication):
     def get_email_order(self):
         ordering = self.email_ordering or getattr(settings, "DEFAULT_EMAIL_ORDER", "")
 
-        if not ordering:
-            return []
-
-        return [email.strip() for email in ordering.split(",")]
+        return list(compile_email_order(ordering))
 
     @staticmethod
     def get_default_access_applications():
-        return Application.objects.filter(default_access_allowed=True)
+        from .registry import get_default_access_applications
+
+        return get_default_access_applications()
@@ -0,0 +1,70 @@
+"""
+Cached lookups of OAuth2 applications.
+
+Applications are loaded on every authorize, token and introspect request but rarely change, so
+they are cached by `client_id` and `application_key` in the `settings.APPLICATION_CACHE` cache,
+whose TTL is set by `CACHE_APPLICATIONS_TTL`. Entries are evicted by the handlers in
+`sso.oauth2.signals` once the saving or deleting of an application has committed.
+"""
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import Application
+
+DEFAULT_ACCESS_APPLICATIONS_KEY = "oauth2:application:default-access"
+
+
+def _cache():
+    return caches[settings.APPLICATION_CACHE]
+
+
+def _key(field, value):
+    return f"oauth2:application:{field}:{value}"
+
+
+def _get(field, value):
+    cache = _cache()
+    key = _key(field, value)
+
+    application = cache.get(key)
+
+    if application is None:
+        application = Application.objects.get(**{field: value})
+        cache.set(key, application)
+
+    return application
+
+
+def get_application_by_client_id(client_id):
+    """Return the application with this `client_id` or raise `Application.DoesNotExist`"""
+    return _get("client_id", client_id)
+
+
+def get_application_by_key(application_key):
+    """Return the application with this `application_key` or raise `Application.DoesNotExist`"""
+    return _get("application_key", application_key)
+
+
+def get_default_access_applications():
+    """Return a list of the applications that all users are allowed to access"""
+    cache = _cache()
+
+    applications = cache.get(DEFAULT_ACCESS_APPLICATIONS_KEY)
+
+    if applications is None:
+        applications = list(Application.objects.filter(default_access_allowed=True))
+        cache.set(DEFAULT_ACCESS_APPLICATIONS_KEY, applications)
+
+    return applications
+
+
+def evict_application(client_id=None, application_key=None):
+    """Remove an application's entries from the cache"""
+    keys = [DEFAULT_ACCESS_APPLICATIONS_KEY]
+
+    if client_id:
+        keys.append(_key("client_id", client_id))
+    if application_key:
+        keys.append(_key("application_key", application_key))
+
+    _cache().delete_many(keys)
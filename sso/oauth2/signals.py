@@ -0,0 +1,73 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+from oauth2_provider.models import get_access_token_model
+
+from .introspection import invalidate_client, invalidate_token
+from .models import Application
+from .registry import evict_application
+
+
+@receiver(pre_save, sender=Application)
+def application_pre_save(sender, instance, **kwargs):
+    # the client_id or application_key may be changing, so evict the entries stored under the
+    # values currently in the database as well.
+    if instance.pk:
+        previous = (
+            Application.objects.filter(pk=instance.pk)
+            .values("client_id", "application_key")
+            .first()
+        )
+        if previous:
+            transaction.on_commit(partial(evict_application, **previous))
+
+
+@receiver(post_save, sender=Application)
+@receiver(post_delete, sender=Application)
+def application_changed(sender, instance, **kwargs):
+    # evicted once the change has committed, as a lookup made before then would cache the row
+    # being replaced again
+    transaction.on_commit(
+        partial(
+            evict_application,
+            client_id=instance.client_id,
+            application_key=instance.application_key,
+        )
+    )
+    transaction.on_commit(partial(invalidate_client, instance.client_id))
+
+
+@receiver(post_save, sender=get_access_token_model())
+@receiver(post_delete, sender=get_access_token_model())
+def access_token_changed(sender, instance, **kwargs):
+    # replaced once the change has committed, as an introspection made before then would cache
+    # the token as it was against the new generation
+    transaction.on_commit(partial(invalidate_token, instance.token))
+
+
+@receiver(m2m_changed, sender=Application.allow_tokens_from.through)
+def allow_tokens_from_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        # the introspecting application's list has changed
+        if action in ("post_add", "post_remove", "post_clear"):
+            transaction.on_commit(partial(invalidate_client, instance.client_id))
+        return
+
+    # the applications whose lists `instance` was added to or removed from
+    if action == "pre_clear":
+        instance._introspecting_client_ids = list(
+            instance.application_set.values_list("client_id", flat=True)
+        )
+        return
+
+    if action in ("post_add", "post_remove"):
+        client_ids = Application.objects.filter(pk__in=pk_set).values_list("client_id", flat=True)
+    elif action == "post_clear":
+        client_ids = getattr(instance, "_introspecting_client_ids", [])
+    else:
+        return
+
+    for client_id in client_ids:
+        transaction.on_commit(partial(invalidate_client, client_id))
@@ -1,10 +1,11 @@
 from django.urls import path
 
-from .views import CustomAuthorizationView, CustomIntrospectTokenView
+from .views import BatchIntrospectTokenView, CustomAuthorizationView, CustomIntrospectTokenView
 
 app_name = "staff_sso_oauth2"
 
 urlpatterns = [
     path("authorize/", CustomAuthorizationView.as_view(), name="authorize"),
     path("introspect/", CustomIntrospectTokenView.as_view(), name="introspect"),
+    path("introspect/batch/", BatchIntrospectTokenView.as_view(), name="introspect-batch"),
 ]
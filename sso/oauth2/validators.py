@@ -0,0 +1,29 @@
+import logging
+
+from oauth2_provider.oauth2_validators import OAuth2Validator
+
+from .models import Application
+from .registry import get_application_by_client_id
+
+log = logging.getLogger("oauth2_provider")
+
+
+class CustomOAuth2Validator(OAuth2Validator):
+    def _load_application(self, client_id, request):
+        """
+        Overridden django-oauth-toolkit method which loads the application from the
+        application registry cache instead of the database.
+        """
+
+        assert hasattr(request, "client"), '"request" instance has no "client" attribute'
+
+        try:
+            request.client = request.client or get_application_by_client_id(client_id)
+            # Check that the application can be used (defaults to always True)
+            if not request.client.is_usable(request):
+                log.debug("Failed body authentication: Application %r is disabled" % (client_id))
+                return None
+            return request.client
+        except Application.DoesNotExist:
+            log.debug("Failed body authentication: Application %r does not exist" % (client_id))
+            return None
@@ -2,19 +2,22 @@ import calendar
 import json
 import logging
 
-from django.core.exceptions import ObjectDoesNotExist
+from django.conf import settings
 from django.http import HttpResponse
 from django.shortcuts import redirect
+from django.utils import timezone
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 from oauth2_provider.exceptions import OAuthToolkitError
-from oauth2_provider.models import get_access_token_model, get_application_model
+from oauth2_provider.models import get_access_token_model
 from oauth2_provider.scopes import get_scopes_backend
 from oauth2_provider.views.base import AuthorizationView
 from oauth2_provider.views.introspect import IntrospectTokenView
 from oauthlib.oauth2.rfc6749.errors import AccessDeniedError
 
 from sso.core.logging import create_x_access_log
+from .introspection import CachedIntrospection, negative_timeout, positive_timeout
+from .registry import get_application_by_client_id
 
 log = logging.getLogger("oauth2_provider")
 
@@ -36,9 +39,7 @@ class CustomAuthorizationView(AuthorizationView):
         kwargs["scopes_descriptions"] = [all_scopes[scope] for scope in scopes]
         kwargs["scopes"] = scopes
         # at this point we know an Application instance with such client_id exists in the database
-
-        # TODO: Cache this!
-        application = get_application_model().objects.get(client_id=credentials["client_id"])
+        application = get_application_by_client_id(credentials["client_id"])
 
         kwargs["application"] = application
         kwargs["client_id"] = credentials["client_id"]
@@ -84,42 +85,46 @@ class CustomAuthorizationView(AuthorizationView):
 
 @method_decorator(csrf_exempt, name="dispatch")
 class CustomIntrospectTokenView(IntrospectTokenView):
-    def _access_denied(self):
-        return HttpResponse(
-            content=json.dumps({"active": False}), status=401, content_type="application/json"
-        )
+    introspecting_application = None
+    allowed_application_ids = None
 
-    def get_introspecting_application(self):  # TODO(jf): get application from here
-        token = self.request.META["HTTP_AUTHORIZATION"][7:]
+    def verify_request(self, request):
+        valid, oauthlib_request = super().verify_request(request)
 
-        return get_access_token_model().objects.get(token=token).application
+        if valid:
+            # keep the application of the (now validated) bearer token to avoid loading it again
+            self.introspecting_application = oauthlib_request.client
 
-    def get_token_response(self, token_value=None):
+        return valid, oauthlib_request
 
-        introspecting_application = self.get_introspecting_application()
+    def get_introspecting_application(self):
+        if self.introspecting_application is None:
+            token = self.request.META["HTTP_AUTHORIZATION"][7:]
+            self.introspecting_application = (
+                get_access_token_model().objects.select_related("application").get(token=token)
+            ).application
 
-        try:
-            token = get_access_token_model().objects.get(token=token_value)
-        except ObjectDoesNotExist:
-            return self._access_denied()
+        return self.introspecting_application
+
+    def introspect(self, introspecting_application, token):
+        """
+        Introspect a token on behalf of an application.
+
+        Returns a tuple `(status, data, timeout)`, where timeout is how long the response can
+        be cached for.
+        """
+        if token is None:
+            return 401, {"active": False}, negative_timeout()
 
         if not token.is_valid():
-            return HttpResponse(
-                content=json.dumps(
-                    {
-                        "active": False,
-                    }
-                ),
-                status=200,
-                content_type="application/json",
-            )
+            return 200, {"active": False}, negative_timeout()
 
         assert token.application is not None
 
         result = {}
         if token.application == introspecting_application:
             result["access_type"] = "client"
-        elif token.application in introspecting_application.allow_tokens_from.all():
+        elif token.application_id in self.get_allowed_application_ids(introspecting_application):
             result.update(
                 {
                     "access_type": "cross_client",
@@ -128,7 +133,7 @@ class CustomIntrospectTokenView(IntrospectTokenView):
                 }
             )
         else:
-            return self._access_denied()
+            return 401, {"active": False}, negative_timeout()
 
         result.update(
             {
@@ -143,4 +148,112 @@ class CustomIntrospectTokenView(IntrospectTokenView):
             result["user_id"] = str(token.user.user_id)
             result["email_user_id"] = token.user.email_user_id
 
-        return HttpResponse(content=json.dumps(result), status=200, content_type="application/json")
+        return 200, result, positive_timeout(token.expires, timezone.now())
+
+    def get_allowed_application_ids(self, introspecting_application):
+        """Return the ids of the applications whose tokens the application can introspect"""
+        if self.allowed_application_ids is None:
+            self.allowed_application_ids = frozenset(
+                introspecting_application.allow_tokens_from.values_list("pk", flat=True)
+            )
+
+        return self.allowed_application_ids
+
+    def get_tokens(self, token_values):
+        """
+        Return a dict of token value to access token, loaded with their applications, users and
+        users' email addresses in two queries
+        """
+        tokens = (
+            get_access_token_model()
+            .objects.select_related("application", "user")
+            .prefetch_related("user__emails")
+            .filter(token__in=token_values)
+        )
+        return {token.token: token for token in tokens}
+
+    def get_token_response(self, token_value=None):
+
+        introspecting_application = self.get_introspecting_application()
+
+        cached = CachedIntrospection(introspecting_application.client_id, token_value)
+
+        if cached.response is None:
+            token = self.get_tokens([token_value]).get(token_value)
+            status, data, timeout = self.introspect(introspecting_application, token)
+            cached.set(status, data, timeout)
+
+        status, data = cached.response
+
+        return HttpResponse(
+            content=json.dumps(data), status=status, content_type="application/json"
+        )
+
+
+class BatchIntrospectTokenView(CustomIntrospectTokenView):
+    """
+    Introspects several tokens in one request.
+
+    Tokens are posted as repeated `token` form fields, or as a JSON body
+    `{"tokens": [...]}`, and are subject to the same rules as `CustomIntrospectTokenView`.
+    The response is `{"results": [{"token": ..., "status": ..., "data": {...}}, ...]}` in
+    request order, where `status` and `data` are what the single token endpoint would return.
+    """
+
+    http_method_names = ["post", "options"]
+
+    def _bad_request(self, error):
+        return HttpResponse(
+            content=json.dumps({"error": error}), status=400, content_type="application/json"
+        )
+
+    def get_token_values(self, request):
+        if request.content_type == "application/json":
+            try:
+                body = json.loads(request.body)
+            except ValueError:
+                return None
+            token_values = body.get("tokens") if isinstance(body, dict) else None
+        else:
+            token_values = request.POST.getlist("token")
+
+        if not isinstance(token_values, list) or not all(
+            isinstance(token_value, str) for token_value in token_values
+        ):
+            return None
+
+        return token_values
+
+    def post(self, request, *args, **kwargs):
+        token_values = self.get_token_values(request)
+
+        if not token_values:
+            return self._bad_request("tokens must be a non-empty list of strings")
+
+        if len(token_values) > settings.INTROSPECTION_BATCH_MAX_TOKENS:
+            return self._bad_request(
+                f"at most {settings.INTROSPECTION_BATCH_MAX_TOKENS} tokens can be introspected "
+                "in one request"
+            )
+
+        introspecting_application = self.get_introspecting_application()
+
+        cached = CachedIntrospection.many(introspecting_application.client_id, token_values)
+
+        missing = [entry for entry in cached.values() if entry.response is None]
+        if missing:
+            tokens = self.get_tokens([entry.token_value for entry in missing])
+            for entry in missing:
+                token = tokens.get(entry.token_value)
+                status, data, entry.timeout = self.introspect(introspecting_application, token)
+                entry.response = status, data
+            CachedIntrospection.set_many(missing)
+
+        results = []
+        for token_value in token_values:
+            status, data = cached[token_value].response
+            results.append({"token": token_value, "status": status, "data": data})
+
+        return HttpResponse(
+            content=json.dumps({"results": results}), status=200, content_type="application/json"
+        )
@@ -0,0 +1 @@
+default_app_config = "sso.samlauth.apps.SamlConfig"
@@ -0,0 +1,9 @@
+from django.contrib import admin
+
+from .models import EmailDomainRoute
+
+
+@admin.register(EmailDomainRoute)
+class EmailDomainRouteAdmin(admin.ModelAdmin):
+    list_display = ("domain", "idp_ref")
+    search_fields = ("domain", "idp_ref")
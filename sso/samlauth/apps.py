@@ -2,4 +2,8 @@ from django.apps import AppConfig
 
 
 class SamlConfig(AppConfig):
-    name = "saml"
+    name = "sso.samlauth"
+    label = "samlauth"
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,56 @@
+"""
+A djangosaml2 config loader that parses the IdP metadata once per process.
+
+djangosaml2's default loader builds a pysaml2 `SPConfig` from `settings.SAML_CONFIG` whenever a
+view needs one, which parses every metadata file listed in `SAML_CONFIG["metadata"]`. This
+loader, set as `SAML_CONFIG_LOADER`, still builds a new `SPConfig` for each caller, but gives
+each one the same metadata store, which is only read from. The store is cached by the value of
+`SAML_CONFIG["metadata"]`, so it is parsed again if the list of metadata files changes.
+"""
+import copy
+import functools
+import json
+
+from django.conf import settings
+from djangosaml2.utils import available_idps
+from saml2.config import SPConfig
+
+
+def _metadata_key():
+    return json.dumps(settings.SAML_CONFIG.get("metadata"), sort_keys=True)
+
+
+@functools.lru_cache(maxsize=8)
+def _load_metadata(metadata_key):
+    conf = SPConfig()
+    conf.load(copy.deepcopy(settings.SAML_CONFIG))
+    return conf.metadata
+
+
+def config_loader(request=None):
+    """Return an `SPConfig` for `settings.SAML_CONFIG`, with the cached metadata store"""
+    saml_config = copy.deepcopy(settings.SAML_CONFIG)
+    has_metadata = saml_config.pop("metadata", None) is not None
+
+    conf = SPConfig()
+    conf.load(saml_config)
+
+    if has_metadata:
+        conf.metadata = _load_metadata(_metadata_key())
+
+    return conf
+
+
+@functools.lru_cache(maxsize=8)
+def _idp_entity_ids(metadata_key):
+    entity_ids = {}
+
+    for entity_id, name in available_idps(config_loader()).items():
+        entity_ids.setdefault(name, entity_id)
+
+    return entity_ids
+
+
+def get_idp_entity_id(name):
+    """Return the entity id of the IdP with this name in the metadata, or None"""
+    return _idp_entity_ids(_metadata_key()).get(name)
@@ -1,18 +1,11 @@
 from django import forms
 from django.conf import settings
 
+from .routing import lookup_idp_ref
 
-def lookup_idp_ref_from_email(email_domain):
-    idp_ref = None
-
-    domain = email_domain.lower()
 
-    for ref, allowed_email_domains in settings.AUTH_EMAIL_TO_IPD_MAP.items():
-        if domain in allowed_email_domains:
-            idp_ref = ref
-            break
-
-    return idp_ref
+def lookup_idp_ref_from_email(email_domain):
+    return lookup_idp_ref(email_domain)
 
 
 class EmailForm(forms.Form):
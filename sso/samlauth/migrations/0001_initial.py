@@ -0,0 +1,54 @@
+# Generated by Django 3.1.6 on 2026-10-17 11:02
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="EmailDomainRoute",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                (
+                    "domain",
+                    models.CharField(
+                        help_text=(
+                            "The domain with a leading @, e.g. @trade.gov.uk. "
+                            "@*.trade.gov.uk routes every subdomain of trade.gov.uk."
+                        ),
+                        max_length=255,
+                        unique=True,
+                        validators=[
+                            django.core.validators.RegexValidator(
+                                message=(
+                                    "Enter a domain starting with @, "
+                                    "e.g. @trade.gov.uk or @*.trade.gov.uk"
+                                ),
+                                regex="^@(\\*\\.)?[a-zA-Z0-9-]+(\\.[a-zA-Z0-9-]+)+$",
+                            )
+                        ],
+                        verbose_name="email domain",
+                    ),
+                ),
+                (
+                    "idp_ref",
+                    models.CharField(
+                        help_text="The name of the IdP in the SAML metadata",
+                        max_length=255,
+                        verbose_name="IdP reference",
+                    ),
+                ),
+            ],
+        ),
+    ]
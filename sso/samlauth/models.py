@@ -0,0 +1,49 @@
+from django.core.exceptions import ValidationError
+from django.core.validators import RegexValidator
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+
+route_domain_validator = RegexValidator(
+    regex=r"^@(\*\.)?[a-zA-Z0-9-]+(\.[a-zA-Z0-9-]+)+$",
+    message=_("Enter a domain starting with @, e.g. @trade.gov.uk or @*.trade.gov.uk"),
+)
+
+
+class EmailDomainRoute(models.Model):
+    """An email domain whose users sign in with an IdP, as in `settings.AUTH_EMAIL_TO_IPD_MAP`
+
+    These are only used when `settings.AUTH_EMAIL_TO_IDP_FROM_DB` is set; see
+    `sso.samlauth.routing`.
+    """
+
+    domain = models.CharField(
+        _("email domain"),
+        max_length=255,
+        unique=True,
+        validators=[route_domain_validator],
+        help_text=_(
+            "The domain with a leading @, e.g. @trade.gov.uk. "
+            "@*.trade.gov.uk routes every subdomain of trade.gov.uk."
+        ),
+    )
+
+    idp_ref = models.CharField(
+        _("IdP reference"),
+        max_length=255,
+        help_text=_("The name of the IdP in the SAML metadata"),
+    )
+
+    def clean(self):
+        from .conf import get_idp_entity_id
+
+        if self.idp_ref and get_idp_entity_id(self.idp_ref) is None:
+            raise ValidationError(
+                {"idp_ref": _("There is no IdP with this name in the SAML metadata")}
+            )
+
+    def save(self, *args, **kwargs):
+        self.domain = self.domain.lower()
+        return super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.domain} - {self.idp_ref}"
@@ -0,0 +1,133 @@
+"""
+Routing of email domains to the IdP that their users sign in with.
+
+Domains are routed by `settings.AUTH_EMAIL_TO_IPD_MAP`, a dict of IdP reference to a list of
+domains written with a leading `@`. A domain written as `@*.example.com` routes every subdomain
+of `example.com`, but not `example.com` itself; the most specific match wins, and an exact
+domain wins over a wildcard.
+
+When `settings.AUTH_EMAIL_TO_IDP_FROM_DB` is set, the `EmailDomainRoute`s in the database are
+routed as well, after the setting, so that domains can be added without a deploy. If the
+`settings.APPLICATION_CACHE` cache is shared between processes, each process keeps a compiled
+table, which is rebuilt when the version number stored in the cache changes; the handlers in
+`sso.samlauth.signals` change it once the saving or deleting of a route has committed. A cache local to a process
+can't tell it about routes changed by another, so without a shared cache the routes are read
+from the database for each lookup.
+"""
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+from sso.core.caches import is_shared
+from sso.core.policy import CompiledSetting
+
+ROUTES_VERSION_KEY = "samlauth:idp-routes:version"
+
+
+class RoutingTable:
+    """Email domains and wildcard subdomains compiled for a lookup per domain label"""
+
+    def __init__(self, routes=()):
+        self.domains = {}
+        # a trie of the labels of wildcard domains, from the last label; a node's `None` entry
+        # is the IdP reference for the subdomains of the labels leading to it
+        self.wildcards = {}
+
+        for domain, idp_ref in routes:
+            domain = domain.lower().lstrip("@")
+
+            if domain.startswith("*."):
+                node = self.wildcards
+                for label in reversed(domain[2:].split(".")):
+                    node = node.setdefault(label, {})
+                node.setdefault(None, idp_ref)
+            else:
+                self.domains.setdefault(domain, idp_ref)
+
+    def lookup(self, domain):
+        """Return the IdP reference for an email domain, with or without its `@`, or None"""
+        domain = domain.lower().lstrip("@")
+
+        idp_ref = self.domains.get(domain)
+
+        if idp_ref is not None or not self.wildcards:
+            return idp_ref
+
+        labels = domain.split(".")
+        node = self.wildcards
+
+        # a wildcard matches at least one label, so the first label is never a suffix
+        for i in range(len(labels) - 1, 0, -1):
+            node = node.get(labels[i])
+            if node is None:
+                break
+            idp_ref = node.get(None, idp_ref)
+
+        return idp_ref
+
+
+def _setting_routes(email_to_idp_map):
+    return [
+        (domain, idp_ref) for idp_ref, domains in email_to_idp_map.items() for domain in domains
+    ]
+
+
+_setting_table = CompiledSetting(
+    "AUTH_EMAIL_TO_IPD_MAP",
+    compile=lambda email_to_idp_map: RoutingTable(_setting_routes(email_to_idp_map)),
+)
+
+_db_table = None
+
+
+def _cache():
+    return caches[settings.APPLICATION_CACHE]
+
+
+def invalidate_routes():
+    """Have every process rebuild its table with the routes in the database"""
+    _cache().delete(ROUTES_VERSION_KEY)
+
+
+def _build_db_table():
+    from .models import EmailDomainRoute
+
+    routes = _setting_routes(settings.AUTH_EMAIL_TO_IPD_MAP)
+    routes.extend(EmailDomainRoute.objects.order_by("pk").values_list("domain", "idp_ref"))
+
+    return RoutingTable(routes)
+
+
+def _get_db_table():
+    global _db_table
+
+    if not is_shared(settings.CACHES[settings.APPLICATION_CACHE]):
+        return _build_db_table()
+
+    cache = _cache()
+    version = cache.get(ROUTES_VERSION_KEY)
+
+    if version is None:
+        cache.add(ROUTES_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+        version = cache.get(ROUTES_VERSION_KEY)
+
+    table = _db_table
+
+    if table is None or table[0] != version or table[1] is not settings.AUTH_EMAIL_TO_IPD_MAP:
+        table = _db_table = (version, settings.AUTH_EMAIL_TO_IPD_MAP, _build_db_table())
+
+    return table[2]
+
+
+def get_routing_table():
+    """Return the `RoutingTable` of the setting, and of the database if it's enabled"""
+    if settings.AUTH_EMAIL_TO_IDP_FROM_DB:
+        return _get_db_table()
+
+    return _setting_table.get()
+
+
+def lookup_idp_ref(email_domain):
+    """Return the reference of the IdP for an email domain, e.g. `@trade.gov.uk`, or None"""
+    return get_routing_table().lookup(email_domain)
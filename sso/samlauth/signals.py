@@ -0,0 +1,13 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import EmailDomainRoute
+from .routing import invalidate_routes
+
+
+@receiver(post_save, sender=EmailDomainRoute)
+@receiver(post_delete, sender=EmailDomainRoute)
+def email_domain_route_changed(sender, instance, **kwargs):
+    # invalidated once the change has committed, as a table built before then wouldn't have it
+    transaction.on_commit(invalidate_routes)
@@ -5,20 +5,20 @@ from urllib.parse import parse_qs, quote, quote_plus, urlparse
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
-from django.core.mail import send_mail
 from django.http import HttpRequest, HttpResponseRedirect
 from django.shortcuts import redirect, render
-from django.template.loader import render_to_string
 from django.urls import reverse
 from django.utils.http import is_safe_url
 from django.views.generic.edit import FormView
-from djangosaml2.conf import get_config
-from djangosaml2.utils import available_idps
 from djangosaml2.views import AssertionConsumerServiceView
 
+from sso.core.ip_filter import get_client_ip
 from sso.core.logging import create_x_access_log
+from sso.emailauth import outbox
 from sso.emailauth.models import EmailToken
+from sso.emailauth.signin_email import render_signin_email
 
+from .conf import get_idp_entity_id
 from .forms import EmailForm
 
 logger = logging.getLogger("sso.samlauth")
@@ -111,19 +111,24 @@ class LoginStartView(FormView):
         return initial
 
     def lookup_idp_from_ref(self, ref):
-
-        conf = get_config(None, self.request)
-        idps = available_idps(conf)
-
-        return [k for k, v in idps.items() if v == ref][0]
+        return get_idp_entity_id(ref)
 
     def form_valid(self, form):
 
         email = form.cleaned_data["email"]
 
-        if form.idp_ref:
-            idp = quote(self.lookup_idp_from_ref(form.idp_ref))
-            url = reverse("saml2_login") + f"?idp={idp}"
+        idp = self.lookup_idp_from_ref(form.idp_ref) if form.idp_ref else None
+
+        if form.idp_ref and idp is None:
+            logger.error(
+                "No IdP named %s in the SAML metadata, which %s is routed to; "
+                "sending a sign in email instead",
+                form.idp_ref,
+                email,
+            )
+
+        if idp is not None:
+            url = reverse("saml2_login") + f"?idp={quote(idp)}"
             args = self.request.META.get("QUERY_STRING", "")
 
             if args:
@@ -165,8 +170,14 @@ class LoginStartView(FormView):
 
     def send_signin_email(self, email):
         """
-        Generate an EmailToken and send a sign in email to the user
+        Generate an EmailToken and queue a sign in email to the user, unless the requester has
+        reached its rate limit
         """
+        requester_ip = get_client_ip(self.request)
+
+        if outbox.is_rate_limited(email, requester_ip):
+            return
+
         token = EmailToken.objects.create_token(email)
         next_url = self.get_next_url()
 
@@ -182,13 +193,6 @@ class LoginStartView(FormView):
             next_url=next_url,
         )
 
-        subject = render_to_string("emailauth/email_subject.txt").strip()
-        message = render_to_string("emailauth/email.txt", context=dict(auth_url=url))
+        subject, message = render_signin_email(url)
 
-        send_mail(
-            subject,
-            message,
-            settings.EMAIL_FROM,
-            [email],
-            fail_silently=False,
-        )
+        outbox.enqueue(email, subject, message, requester_ip=requester_ip)
@@ -2,6 +2,8 @@ from django.apps import AppConfig
 
 
 class SamlIdpConfig(AppConfig):
-    name = "samlidp"
-    label = "saml2 idp"
-    verbose_name = "saml2 idp"
+    name = "sso.samlidp"
+    label = "samlidp"
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from sso.samlidp.metadata import DUE_MINUTES, refresh_due_metadata
+
+
+class Command(BaseCommand):
+    help = (
+        "Fetch the metadata of SAML applications with a remote metadata url that has expired, or "
+        "will expire soon, so that it isn't fetched while building the IdP for a request"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--minutes",
+            type=int,
+            default=DUE_MINUTES,
+            help=f"refresh metadata that expires within this many minutes (default {DUE_MINUTES})",
+        )
+
+    def handle(self, *args, minutes, **kwargs):
+        refreshed, failed = refresh_due_metadata(minutes)
+
+        for application in failed:
+            self.stderr.write(f"{application.slug}: metadata could not be refreshed")
+
+        self.stdout.write(
+            f"Refreshed the metadata of {len(refreshed)} application(s), {len(failed)} failed"
+        )
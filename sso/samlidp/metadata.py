@@ -0,0 +1,104 @@
+"""
+Refreshing the remote metadata of SAML applications off the request path.
+
+`refresh_due_metadata` fetches the metadata of the active applications with a remote metadata
+url that has expired, expires soon or has no expiry, so that the IdP finds it current when it loads instead of
+fetching it while building the IdP for a request. The `refresh_saml_metadata` management
+command runs it once.
+
+Each web process also runs it from a thread every `settings.SAML_METADATA_REFRESH_INTERVAL`
+seconds, which `config.wsgi` starts; an interval of 0 disables the thread. Every process
+refreshes the metadata that is due, so an application's metadata may be fetched by more than
+one process before its new expiry is saved.
+"""
+import atexit
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import SamlApplication
+
+logger = logging.getLogger(__name__)
+
+DUE_MINUTES = 60
+
+# the fields refresh_metadata sets, which is all a refresh saves
+METADATA_FIELDS = ["local_metadata", "metadata_expiration_dt"]
+
+
+def refresh_due_metadata(minutes=DUE_MINUTES):
+    """
+    Refresh the metadata that expires within `minutes` or has no expiry, and return the applications refreshed
+    and the applications whose metadata couldn't be refreshed
+    """
+    due = (
+        SamlApplication.objects.filter(active=True)
+        .exclude(remote_metadata_url="")
+        .filter(
+            Q(metadata_expiration_dt__isnull=True)
+            | Q(metadata_expiration_dt__lte=timezone.now() + timedelta(minutes=minutes))
+        )
+    )
+    refreshed, failed = [], []
+
+    for application in due:
+        if application.refresh_metadata(force_refresh=True):
+            application.save(update_fields=METADATA_FIELDS)
+            refreshed.append(application)
+        else:
+            # the reason is logged by refresh_metadata
+            failed.append(application)
+
+    return refreshed, failed
+
+
+class MetadataRefresher:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = None
+
+    def start(self):
+        """Start the refresh thread, unless it's running or disabled"""
+        if self._thread is not None or settings.SAML_METADATA_REFRESH_INTERVAL <= 0:
+            return
+
+        with self._lock:
+            if self._thread is None:
+                self._stopped = threading.Event()
+                self._thread = threading.Thread(
+                    target=self._run, name="saml-metadata-refresh", daemon=True
+                )
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stopped.wait(settings.SAML_METADATA_REFRESH_INTERVAL):
+            close_old_connections()
+            try:
+                refreshed, failed = refresh_due_metadata()
+            except Exception:
+                logger.exception("Failed to refresh the SAML application metadata")
+                continue
+
+            if refreshed or failed:
+                logger.info(
+                    "Refreshed the metadata of %d SAML application(s), %d failed",
+                    len(refreshed),
+                    len(failed),
+                )
+
+    def stop(self):
+        """Stop the refresh thread"""
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+
+
+refresher = MetadataRefresher()
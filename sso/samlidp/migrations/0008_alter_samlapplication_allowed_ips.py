@@ -0,0 +1,24 @@
+# Generated by Django 3.1.6 on 2026-10-17 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("samlidp", "0007_samlapplication_public"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="samlapplication",
+            name="allowed_ips",
+            field=models.CharField(
+                blank=True,
+                help_text="A comma separated list of allowed ips and ip ranges in CIDR notation, e.g. 1.2.3.4, 10.0.0.0/8. Leave blank to disable ip restriction.",
+                max_length=255,
+                null=True,
+                verbose_name="allowed ips",
+            ),
+        ),
+    ]
@@ -5,6 +5,7 @@ from django.utils.translation import gettext_lazy as _
 from djangosaml2idp.models import AbstractServiceProvider
 
 from sso.core.ip_filter import get_client_ip
+from sso.core.policy import compile_allowed_ips, split_list
 
 logger = logging.getLogger(__file__)
 
@@ -31,7 +32,8 @@ class SamlApplication(AbstractServiceProvider):
     allowed_ips = models.CharField(
         _("allowed ips"),
         help_text=_(
-            "A comma separated list of allowed ips. Leave blank to disable ip restriction."
+            "A comma separated list of allowed ips and ip ranges in CIDR notation, "
+            "e.g. 1.2.3.4, 10.0.0.0/8. Leave blank to disable ip restriction."
         ),
         max_length=255,
         null=True,
@@ -83,15 +85,18 @@ class SamlApplication(AbstractServiceProvider):
         return self.pretty_name
 
     def is_valid_ip(self, request):
-        if not self.allowed_ips or not self.allowed_ips.strip():
+        if not split_list(self.allowed_ips):
             return True
 
+        # an allowlist with no valid entries allows no ip, rather than disabling the restriction
+        allowed_ips = compile_allowed_ips(self.allowed_ips)
+
         client_ip = get_client_ip(request)
 
         if not client_ip:
             return False
 
-        return client_ip in self.allowed_ips
+        return client_ip in allowed_ips
 
     def get_entity_id(self):
         return self.real_entity_id or self.entity_id
@@ -1,18 +1,28 @@
 import logging
 from typing import Dict
 
+from django.contrib.postgres.fields import ArrayField
 from django.core.exceptions import ImproperlyConfigured
+from django.db.models import CharField, Exists, OuterRef, Subquery
 
 from djangosaml2idp.processors import BaseProcessor
 
 from sso.core.logging import create_x_access_log
-from sso.user.models import ServiceEmailAddress
+from sso.user.models import ApplicationAccess, ApplicationPermission, ServiceEmailAddress, User
 from .models import SamlApplication
+from .registry import get_application_by_entity_id
 
 
 logger = logging.getLogger(__name__)
 
 
+class ArraySubquery(Subquery):
+    """An array of the values of a single column subquery"""
+
+    template = "ARRAY(%(subquery)s)"
+    output_field = ArrayField(CharField())
+
+
 class ModelProcessor(BaseProcessor):
     """
     Load an associated `sso.samlidp.models.SamlApplication` model
@@ -21,7 +31,48 @@ class ModelProcessor(BaseProcessor):
     USER_ID_FIELD = "email"
 
     def __init__(self, entity_id, *args, **kwargs):
-        self._application = SamlApplication.objects.get(entity_id=entity_id)
+        self._application = get_application_by_entity_id(entity_id)
+        self._identity_plans = {}
+
+    def get_identity_plan(self, user):
+        """
+        Return a dict of what the assertion for a user needs: their `service_email` for this
+        application (or None), their `permissions` on it and whether the access index grants
+        them access (`has_access`).
+
+        These are loaded in one query the first time they're needed, so the number of queries
+        a login makes doesn't depend on how the user was granted access.
+        """
+        plan = self._identity_plans.get(user.pk)
+
+        if plan is None:
+            user_ref = OuterRef("pk")
+            plan = self._identity_plans[user.pk] = (
+                User.objects.filter(pk=user.pk)
+                .annotate(
+                    service_email=Subquery(
+                        ServiceEmailAddress.objects.filter(
+                            user=user_ref, saml_application=self._application
+                        )
+                        .order_by("pk")
+                        .values("email__email")[:1]
+                    ),
+                    permissions=ArraySubquery(
+                        ApplicationPermission.objects.filter(
+                            application_permissions=user_ref, saml2_application=self._application
+                        ).values("permission")
+                    ),
+                    has_access=Exists(
+                        ApplicationAccess.objects.filter(
+                            user=user_ref, saml2_application=self._application
+                        )
+                    ),
+                )
+                .values("service_email", "permissions", "has_access")
+                .get()
+            )
+
+        return plan
 
     def get_user_id(self, user, name_id_format: str, service_provider: SamlApplication, idp_config):
         return str(self.get_service_email(user) or getattr(user, self.USER_ID_FIELD) or user.email)
@@ -30,15 +81,14 @@ class ModelProcessor(BaseProcessor):
         """Get the email address specified for this user & service.
 
         Returns None if a service email isn't defined"""
-        try:
-            return user.service_emails.get(saml_application=self._application).email.email
-        except ServiceEmailAddress.DoesNotExist:
-            return None
+        return self.get_identity_plan(user)["service_email"]
 
     def has_access(self, request):
 
+        # as `User.can_access`, with the access index lookup from the identity plan
         access = (
-            request.user.can_access(self._application)
+            request.user.is_active
+            and self.get_identity_plan(request.user)["has_access"]
             and self._application.active
             and self._application.is_valid_ip(request)
         )
@@ -82,12 +132,6 @@ class ApplicationPermissionProcessor(ModelProcessor):
 
         identity = super().create_identity(user, sp_mapping)
 
-        permissions = list(
-            user.application_permissions.filter(saml2_application=self._application).values_list(
-                "permission", flat=True
-            )
-        )
-
-        identity["groups"] = permissions
+        identity["groups"] = list(self.get_identity_plan(user)["permissions"])
 
         return identity
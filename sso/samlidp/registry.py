@@ -0,0 +1,40 @@
+"""
+Cached lookups of SAML applications.
+
+The application a SAML processor works for is loaded on every SSO request but rarely changes,
+so it is cached by `entity_id` in the `settings.APPLICATION_CACHE` cache, whose TTL is set by
+`CACHE_APPLICATIONS_TTL`. Entries are evicted by the handlers in `sso.samlidp.signals` once the
+saving or deleting of an application has committed.
+"""
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import SamlApplication
+
+
+def _cache():
+    return caches[settings.APPLICATION_CACHE]
+
+
+def _key(entity_id):
+    return f"samlidp:application:entity_id:{entity_id}"
+
+
+def get_application_by_entity_id(entity_id):
+    """Return the application with this `entity_id` or raise `SamlApplication.DoesNotExist`"""
+    cache = _cache()
+    key = _key(entity_id)
+
+    application = cache.get(key)
+
+    if application is None:
+        application = SamlApplication.objects.get(entity_id=entity_id)
+        cache.set(key, application)
+
+    return application
+
+
+def evict_application(entity_id=None):
+    """Remove an application's entry from the cache"""
+    if entity_id:
+        _cache().delete(_key(entity_id))
@@ -0,0 +1,29 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import SamlApplication
+from .registry import evict_application
+
+
+@receiver(pre_save, sender=SamlApplication)
+def application_pre_save(sender, instance, **kwargs):
+    # the entity_id may be changing, so evict the entry stored under the value currently in the
+    # database as well.
+    if instance.pk:
+        previous = (
+            SamlApplication.objects.filter(pk=instance.pk)
+            .values_list("entity_id", flat=True)
+            .first()
+        )
+        transaction.on_commit(partial(evict_application, previous))
+
+
+@receiver(post_save, sender=SamlApplication)
+@receiver(post_delete, sender=SamlApplication)
+def application_changed(sender, instance, **kwargs):
+    # evicted once the change has committed, as a lookup made before then would cache the row
+    # being replaced again
+    transaction.on_commit(partial(evict_application, instance.entity_id))
@@ -0,0 +1,123 @@
+"""
+Query count and latency benchmarks for the busiest endpoints.
+
+Benchmarks only run with `pytest --benchmarks`, against the dataset seeded by `dataset.seed`.
+Each benchmark makes one warm up request, then times `BENCHMARK_ROUNDS` more and keeps the
+fastest, along with the number of queries the last one made. These are compared with the
+results in `baselines.json`: a benchmark fails if it makes more queries than its baseline, and
+fails if it has no baseline, so that every new benchmark commits one.
+
+A benchmark that times a batch of operations can set `benchmark.operations` to the size of the
+batch, so that the results also record the rate of operations per second.
+
+Baselines are recorded by running with `--update-baselines`. Query counts don't depend on the
+machine, but some grow with the size of the dataset, so they are recorded with its default size.
+
+Timings depend on the machine, so latency is only compared with `--benchmark-latency`, against
+timings recorded on the same machine by running with both options. A benchmark then also fails
+if it is slower than its baseline by more than `BENCHMARK_THRESHOLD` (a fraction, 0.25 by
+default).
+"""
+import json
+import os
+import time
+from pathlib import Path
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from . import dataset
+
+BASELINES_PATH = Path(__file__).parent / "baselines.json"
+
+ROUNDS = int(os.environ.get("BENCHMARK_ROUNDS", 5))
+THRESHOLD = float(os.environ.get("BENCHMARK_THRESHOLD", 0.25))
+
+
+class Benchmark:
+    def __init__(self, name, baseline, results, latency):
+        self.name = name
+        self.baseline = baseline
+        self.results = results
+        self.latency = latency
+        self.operations = 1
+
+    def __call__(self, func, *args, **kwargs):
+        """Benchmark `func`, returning the result of its last call"""
+        func(*args, **kwargs)
+
+        timings = []
+        for _ in range(ROUNDS):
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                result = func(*args, **kwargs)
+                timings.append(time.perf_counter() - start)
+
+        measured = {"queries": len(queries)}
+        if self.latency:
+            measured["seconds"] = round(min(timings), 6)
+            measured["per_second"] = round(self.operations / min(timings), 1)
+        self.results[self.name] = measured
+
+        if self.baseline is not None:
+            self.check(measured)
+
+        return result
+
+    def check(self, measured):
+        if "queries" not in self.baseline:
+            pytest.fail(f"{self.name} has no query baseline, record one with --update-baselines")
+
+        assert measured["queries"] <= self.baseline["queries"], (
+            f"{self.name} made {measured['queries']} queries, "
+            f"the baseline is {self.baseline['queries']}"
+        )
+
+        if not self.latency:
+            return
+
+        if "seconds" not in self.baseline:
+            pytest.fail(
+                f"{self.name} has no latency baseline, record one on this machine with "
+                "--update-baselines --benchmark-latency"
+            )
+
+        limit = self.baseline["seconds"] * (1 + THRESHOLD)
+        assert measured["seconds"] <= limit, (
+            f"{self.name} took {measured['seconds']:.6f}s, more than {THRESHOLD:.0%} slower than "
+            f"the baseline of {self.baseline['seconds']:.6f}s"
+        )
+
+
+@pytest.fixture(scope="session")
+def benchmark_results(request):
+    """Collect the results of every benchmark, and record them if updating the baselines"""
+    update = request.config.getoption("--update-baselines")
+    baselines = json.loads(BASELINES_PATH.read_text()) if BASELINES_PATH.exists() else {}
+    results = {}
+
+    yield baselines, results, update
+
+    if update and results:
+        # recording only the query counts keeps any timings already recorded
+        for name, measured in results.items():
+            baselines.setdefault(name, {}).update(measured)
+        BASELINES_PATH.write_text(json.dumps(baselines, indent=2, sort_keys=True) + "\n")
+
+
+@pytest.fixture
+def benchmark(request, benchmark_results):
+    baselines, results, update = benchmark_results
+    name = request.node.name
+
+    latency = request.config.getoption("--benchmark-latency")
+
+    return Benchmark(name, None if update else baselines.get(name, {}), results, latency)
+
+
+@pytest.fixture(scope="session")
+def benchmark_data(django_db_setup, django_db_blocker):
+    """The seeded dataset, created once for the session and kept outside each test's transaction"""
+    with django_db_blocker.unblock():
+        return dataset.seed()
@@ -0,0 +1,192 @@
+"""
+Seed a realistic dataset for the benchmarks.
+
+Rows are inserted with `bulk_create`, which doesn't send signals, so the application access
+index and the user change log are built explicitly once everything else exists. The size of
+the dataset can be reduced for a quick local run with the `BENCHMARK_*` environment variables.
+"""
+import os
+import random
+from datetime import timedelta
+
+from django.utils import timezone
+
+from sso.oauth2.models import Application
+from sso.tests.factories.saml import SamlApplicationFactory
+from sso.user.access_index import all_applications, rebuild_application_access
+from sso.user.change_log import record_user_changes
+from sso.user.models import (
+    AccessProfile,
+    build_email_user_id,
+    EmailAddress,
+    get_email_domain,
+    User,
+)
+
+BATCH_SIZE = 5000
+
+USERS = int(os.environ.get("BENCHMARK_USERS", 100000))
+EMAILS_PER_USER = int(os.environ.get("BENCHMARK_EMAILS_PER_USER", 3))
+APPLICATIONS = int(os.environ.get("BENCHMARK_APPLICATIONS", 200))
+ACCESS_PROFILES = int(os.environ.get("BENCHMARK_ACCESS_PROFILES", 50))
+
+EMAIL_DOMAINS = ["trade.gov.uk", "digital.trade.gov.uk", "mobile.trade.gov.uk", "example.com"]
+
+FIRST_NAMES = ["Alex", "Sam", "Jo", "Chris", "Pat", "Robin", "Kim", "Lee", "Max", "Charlie"]
+LAST_NAMES = ["Smith", "Jones", "Taylor", "Brown", "Williams", "Wilson", "Evans", "Thomas"]
+
+# the service provider in sp-saml.xml, which the SAML login flow benchmark signs in to
+SAML_ENTITY_ID = "http://testsp/saml2/metadata/"
+
+
+def _batches(objects, size=BATCH_SIZE):
+    for start in range(0, len(objects), size):
+        yield objects[start : start + size]
+
+
+def _create_applications(count, rng):
+    oauth2_count = count // 2
+
+    oauth2_applications = Application.objects.bulk_create(
+        [
+            Application(
+                name=f"benchmark oauth2 app {i}",
+                application_key=f"benchmark-oauth2-app-{i}",
+                display_name=f"Benchmark OAuth2 app {i}",
+                start_url=f"https://oauth2-app-{i}.example.com",
+                redirect_uris=f"https://oauth2-app-{i}.example.com/authorised",
+                client_type=Application.CLIENT_CONFIDENTIAL,
+                authorization_grant_type=Application.GRANT_AUTHORIZATION_CODE,
+                skip_authorization=True,
+                default_access_allowed=i % 20 == 0,
+                allow_access_by_email_suffix=(
+                    ",".join(rng.sample(EMAIL_DOMAINS, 2)) if i % 10 == 1 else ""
+                ),
+                public=i % 2 == 0,
+            )
+            for i in range(oauth2_count)
+        ]
+    )
+
+    saml2_applications = SamlApplicationFactory.create_batch(count - oauth2_count - 1)
+    saml2_applications.append(
+        SamlApplicationFactory(
+            entity_id=SAML_ENTITY_ID, _processor="sso.samlidp.processors.ModelProcessor"
+        )
+    )
+
+    return oauth2_applications, saml2_applications
+
+
+def _create_access_profiles(count, oauth2_applications, saml2_applications, rng):
+    profiles = AccessProfile.objects.bulk_create(
+        [
+            AccessProfile(slug=f"benchmark-profile-{i}", name=f"Benchmark profile {i}")
+            for i in range(count)
+        ]
+    )
+
+    oauth2_through = AccessProfile.oauth2_applications.through
+    saml2_through = AccessProfile.saml2_applications.through
+
+    oauth2_through.objects.bulk_create(
+        [
+            oauth2_through(accessprofile_id=profile.pk, application_id=application.pk)
+            for profile in profiles
+            for application in rng.sample(oauth2_applications, min(5, len(oauth2_applications)))
+        ]
+    )
+    saml2_through.objects.bulk_create(
+        [
+            saml2_through(accessprofile_id=profile.pk, samlapplication_id=application.pk)
+            for profile in profiles
+            for application in rng.sample(saml2_applications, min(5, len(saml2_applications)))
+        ]
+    )
+
+    return profiles
+
+
+def _create_users(count, emails_per_user, rng):
+    now = timezone.now()
+    users = []
+
+    for i in range(count):
+        first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        user = User(
+            email=f"{first_name}.{last_name}.{i}@{EMAIL_DOMAINS[i % len(EMAIL_DOMAINS)]}".lower(),
+            first_name=first_name,
+            last_name=last_name,
+            contact_email=f"{first_name}.{last_name}.{i}@contact.example.com".lower(),
+            last_accessed=now - timedelta(minutes=rng.randrange(60 * 24 * 90)),
+        )
+        user.email_user_id = build_email_user_id(user.email, user.user_id)
+        user.set_unusable_password()
+        users.append(user)
+
+    for batch in _batches(users):
+        User.objects.bulk_create(batch)
+
+    emails = []
+    for i, user in enumerate(users):
+        emails.append(
+            EmailAddress(user_id=user.pk, email=user.email, last_login=user.last_accessed)
+        )
+        emails.extend(
+            EmailAddress(user_id=user.pk, email=f"{user.first_name}.{i}.{n}@alias{n}.example.com")
+            for n in range(1, emails_per_user)
+        )
+
+    # as EmailAddress.save would
+    for email in emails:
+        email.email = email.email.lower()
+        email.domain = get_email_domain(email.email)
+
+    for batch in _batches(emails):
+        EmailAddress.objects.bulk_create(batch)
+
+    return users
+
+
+def _assign_access(users, profiles, oauth2_applications, rng):
+    profile_through = User.access_profiles.through
+    application_through = User.permitted_applications.through
+
+    profile_rows = []
+    application_rows = []
+
+    for user in users:
+        profile_rows.extend(
+            profile_through(user_id=user.pk, accessprofile_id=profile.pk)
+            for profile in rng.sample(profiles, min(rng.randint(1, 3), len(profiles)))
+        )
+        if rng.random() < 0.25:
+            application_rows.extend(
+                application_through(user_id=user.pk, application_id=application.pk)
+                for application in rng.sample(oauth2_applications, min(2, len(oauth2_applications)))
+            )
+
+    for batch in _batches(profile_rows):
+        profile_through.objects.bulk_create(batch)
+
+    for batch in _batches(application_rows):
+        application_through.objects.bulk_create(batch)
+
+
+def seed(seed=0):
+    """Create the dataset and return the users, OAuth2 applications and SAML applications"""
+    rng = random.Random(seed)
+
+    oauth2_applications, saml2_applications = _create_applications(APPLICATIONS, rng)
+    profiles = _create_access_profiles(
+        ACCESS_PROFILES, oauth2_applications, saml2_applications, rng
+    )
+    users = _create_users(USERS, EMAILS_PER_USER, rng)
+    _assign_access(users, profiles, oauth2_applications, rng)
+
+    for application in all_applications():
+        rebuild_application_access(application)
+
+    record_user_changes(user.pk for user in users)
+
+    return users, oauth2_applications, saml2_applications
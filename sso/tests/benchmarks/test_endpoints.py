@@ -0,0 +1,154 @@
+from datetime import timedelta
+
+import pytest
+from django.urls import reverse
+from django.utils import timezone
+
+from sso.tests.factories.oauth import AccessTokenFactory
+from sso.tests.factories.user import AccessProfileFactory, UserFactory
+from sso.tests.factories.usersettings import UserSettingsFactory
+from sso.tests.test_activity_stream import hawk_auth_header
+from sso.tests.test_samlidp import saml_request
+
+pytestmark = [pytest.mark.django_db, pytest.mark.benchmark]
+
+
+def consume(response):
+    """Return the content of a response, reading it first if it is streamed"""
+    if response.streaming:
+        return b"".join(response.streaming_content)
+    return response.content
+
+
+def get(client, path, status_code=200, **kwargs):
+    response = client.get(path, **kwargs)
+    content = consume(response)
+
+    assert response.status_code == status_code, content
+
+    return response
+
+
+def access_token(application, user, scope):
+    return AccessTokenFactory(
+        application=application,
+        user=user,
+        expires=timezone.now() + timedelta(days=1),
+        scope=scope,
+    ).token
+
+
+@pytest.fixture
+def data(benchmark_data):
+    users, oauth2_applications, saml2_applications = benchmark_data
+
+    # the first application allows access to everyone and the second by email domain
+    return users, oauth2_applications[0], oauth2_applications[1], saml2_applications[-1]
+
+
+@pytest.fixture
+def admin_client(client):
+    client.force_login(UserFactory(is_staff=True, is_superuser=True))
+    return client
+
+
+def test_oauth2_authorize(benchmark, client, data):
+    users, application, _, _ = data
+    client.force_login(users[0])
+    params = {
+        "client_id": application.client_id,
+        "response_type": "code",
+        "scope": "read",
+        "redirect_uri": application.redirect_uris,
+    }
+
+    benchmark(get, client, reverse("oauth2:authorize"), status_code=302, data=params)
+
+
+def test_oauth2_introspect(benchmark, api_client, data):
+    users, application, _, _ = data
+    api_client.credentials(
+        HTTP_AUTHORIZATION="Bearer " + access_token(application, users[0], "introspection read")
+    )
+    token = access_token(application, users[1], "read")
+
+    benchmark(get, api_client, reverse("oauth2:introspect"), data={"token": token})
+
+
+def test_user_me(benchmark, api_client, data):
+    users, application, _, _ = data
+    api_client.credentials(
+        HTTP_AUTHORIZATION="Bearer " + access_token(application, users[0], "read")
+    )
+
+    benchmark(get, api_client, reverse("api-v1:user:me"))
+
+
+def test_user_introspect(benchmark, api_client, data):
+    users, application, _, _ = data
+    api_client.credentials(
+        HTTP_AUTHORIZATION="Bearer " + access_token(application, users[0], "introspection")
+    )
+
+    benchmark(
+        get, api_client, reverse("api-v1:user:user-introspect"), data={"email": users[1].email}
+    )
+
+
+def test_user_search(benchmark, api_client, data):
+    users, _, application, _ = data
+    api_client.credentials(
+        HTTP_AUTHORIZATION="Bearer " + access_token(application, users[0], "search")
+    )
+
+    benchmark(get, api_client, reverse("api-v1:user:user-search"), data={"autocomplete": "sam"})
+
+
+def test_activity_stream(benchmark, api_client, benchmark_data):
+    path = reverse("api-v1:core:activity-stream")
+    url = f"http://localhost:8080{path}"
+
+    def request():
+        # every request needs a new Hawk header, as its nonce can't be reused
+        return get(
+            api_client,
+            path,
+            content_type=None,
+            HTTP_HOST="localhost:8080",
+            HTTP_AUTHORIZATION=hawk_auth_header("the-id", "the-secret", url, "GET", b"", ""),
+        )
+
+    benchmark(request)
+
+
+def test_user_settings(benchmark, api_client, data):
+    users, application, _, _ = data
+    UserSettingsFactory.create_batch(20, user=users[0])
+    api_client.credentials(
+        HTTP_AUTHORIZATION="Bearer " + access_token(application, users[0], "read")
+    )
+
+    benchmark(get, api_client, reverse("api-v1:user-settings:list-all-my-settings"))
+
+
+def test_saml_idp_login_flow(benchmark, client, data):
+    users, _, _, saml_application = data
+    access_profile = AccessProfileFactory(saml_apps_list=[saml_application])
+    client.force_login(UserFactory(add_access_profiles=[access_profile]))
+    path = reverse("djangosaml2idp:saml_login_binding", kwargs={"binding": "redirect"})
+
+    benchmark(
+        get, client, path, data={"SAMLRequest": saml_request(), "RelayState": ""}, follow=True
+    )
+
+
+def test_admin_user_changelist(benchmark, admin_client, benchmark_data):
+    benchmark(get, admin_client, reverse("admin:user_user_changelist"))
+
+
+def test_admin_user_export(benchmark, admin_client, benchmark_data):
+    benchmark(get, admin_client, reverse("user-export-view"))
+
+
+def test_admin_email_export(benchmark, admin_client, benchmark_data):
+    benchmark(get, admin_client, reverse("email-export-view"))
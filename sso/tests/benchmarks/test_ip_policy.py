@@ -0,0 +1,30 @@
+import random
+from ipaddress import IPv4Address, IPv4Network
+
+import pytest
+
+from sso.core.policy import compile_ip_allowlist
+
+pytestmark = [pytest.mark.django_db, pytest.mark.benchmark]
+
+LOOKUPS = 10000
+
+
+def _random_networks(rng, count):
+    return tuple(
+        str(IPv4Network((rng.getrandbits(32), prefix), strict=False))
+        for prefix in (rng.choice([8, 16, 24, 32]) for _ in range(count))
+    )
+
+
+def _lookup_all(allowlist, ips):
+    return sum(ip in allowlist for ip in ips)
+
+
+@pytest.mark.parametrize("networks", [10, 1000])
+def test_ip_allowlist_lookup(benchmark, networks):
+    rng = random.Random(0)
+    allowlist = compile_ip_allowlist(_random_networks(rng, networks))
+    ips = [str(IPv4Address(rng.getrandbits(32))) for _ in range(LOOKUPS)]
+
+    benchmark(_lookup_all, allowlist, ips)
@@ -0,0 +1,28 @@
+import pytest
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+from sso.core.middleware import AdminIpRestrictionMiddleware
+
+pytestmark = [pytest.mark.django_db, pytest.mark.benchmark]
+
+REQUESTS = 10000
+
+
+def _call_all(middleware, requests):
+    for request in requests:
+        middleware(request)
+
+
+@pytest.mark.parametrize("path", ["/o/introspect/", "/api/v1/user/me/", "/admin/"])
+def test_admin_ip_restriction_middleware(benchmark, settings, path):
+    settings.RESTRICT_ADMIN = True
+    settings.ALLOWED_ADMIN_IPS = ["1.1.1.1"]
+
+    middleware = AdminIpRestrictionMiddleware(lambda _: HttpResponse(status=200))
+    requests = [
+        RequestFactory().get(path, HTTP_X_FORWARDED_FOR="1.1.1.1, 2.2.2.2, 3.3.3.3")
+        for _ in range(REQUESTS)
+    ]
+
+    benchmark(_call_all, middleware, requests)
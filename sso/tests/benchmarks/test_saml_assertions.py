@@ -0,0 +1,49 @@
+"""
+The rate at which the IdP builds and signs assertions, for each of the processors that high
+traffic service providers use. Each assertion is built as the login views build it, from a
+freshly loaded service provider.
+"""
+import pytest
+from djangosaml2idp.idp import IDP
+from djangosaml2idp.views import build_authn_response, get_authn, get_sp_config
+from saml2 import BINDING_HTTP_REDIRECT
+
+from sso.samlidp.models import SamlApplication
+from sso.tests.test_samlidp import saml_request
+
+pytestmark = [pytest.mark.django_db, pytest.mark.benchmark]
+
+ASSERTIONS = 20
+
+AWS_ROLE = "arn:aws:iam::123456789012:role/sso,arn:aws:iam::123456789012:saml-provider/sso"
+
+
+def _build_assertions(users, entity_id, resp_args):
+    for user in users:
+        service_provider = get_sp_config(entity_id)
+        build_authn_response(user, get_authn(), resp_args, service_provider)
+
+
+@pytest.mark.parametrize(
+    "processor",
+    [
+        "sso.samlidp.processors.ModelProcessor",
+        "sso.samlidp.processors.AWSProcessor",
+        "sso.samlidp.processors.ApplicationPermissionProcessor",
+    ],
+)
+def test_saml_assertions(benchmark, benchmark_data, processor):
+    users, _, saml2_applications = benchmark_data
+    # a copy, so that the session's dataset isn't changed
+    saml_application = SamlApplication.objects.get(pk=saml2_applications[-1].pk)
+
+    saml_application._processor = processor
+    saml_application.extra_config = {"role": AWS_ROLE}
+    saml_application.save()
+
+    idp_server = IDP.load()
+    req_info = idp_server.parse_authn_request(saml_request(), BINDING_HTTP_REDIRECT)
+    resp_args = idp_server.response_args(req_info.message)
+
+    benchmark.operations = ASSERTIONS
+    benchmark(_build_assertions, users[:ASSERTIONS], saml_application.entity_id, resp_args)
@@ -0,0 +1,32 @@
+"""
+The rate at which sign in emails are rendered, queued and sent, with the outbox sending them to
+the in-memory mail backend that tests use, so that the rate doesn't depend on a mail relay.
+"""
+import itertools
+
+import pytest
+from django.core import mail
+
+from sso.emailauth.outbox import enqueue, send_pending
+from sso.emailauth.signin_email import render_signin_email
+
+pytestmark = [pytest.mark.django_db, pytest.mark.benchmark]
+
+EMAILS = 200
+
+_addresses = (f"benchmark.{i}@example.com" for i in itertools.count())
+
+
+def _send_signin_emails(count):
+    for _ in range(count):
+        address = next(_addresses)
+        enqueue(address, *render_signin_email(f"https://sso.test/email/signin/{address}/"))
+
+    mail.outbox = []
+
+    return send_pending()
+
+
+def test_signin_emails(benchmark):
+    benchmark.operations = EMAILS
+    assert benchmark(_send_signin_emails, EMAILS) == EMAILS
@@ -0,0 +1,11 @@
+import fakeredis
+from django_redis.pool import ConnectionFactory
+
+
+class FakeRedisConnectionFactory(ConnectionFactory):
+    """django-redis connection factory that connects every cache to an in-memory fakeredis server"""
+
+    server = fakeredis.FakeServer()
+
+    def connect(self, url):
+        return fakeredis.FakeStrictRedis(server=self.server)
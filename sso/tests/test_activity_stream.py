@@ -1,12 +1,18 @@
-import time
+import datetime
+import json
+import threading
 import urllib.parse
 
 import mohawk
 import pytest
+from django.core.management import call_command
+from django.db import connection, transaction
 from django.urls import reverse
 from freezegun import freeze_time
 
+from sso.core.hawk import LocalNonceStore, seen_nonce
 from sso.user.middleware import UpdatedLastAccessedMiddleware
+from sso.user.models import User, UserChangeEvent
 from .factories.oauth import ApplicationFactory
 from .factories.saml import SamlApplicationFactory
 from .factories.user import AccessProfileFactory, UserFactory
@@ -109,6 +115,49 @@ def test_via_internal_networking_no_content_type_then_200(api_client):
 
 
 @pytest.mark.django_db
+def test_replayed_request_then_403(api_client):
+    path = reverse("api-v1:core:activity-stream")
+    host = "localhost:8080"
+    url = f"http://{host}{path}"
+    auth_header = hawk_auth_header("the-id", "the-secret", url, "GET", b"", "")
+
+    def request():
+        return api_client.get(
+            path, content_type=None, HTTP_HOST=host, HTTP_AUTHORIZATION=auth_header
+        )
+
+    assert request().status_code == 200
+    assert request().status_code == 403
+
+
+def test_nonce_falls_back_to_local_store_if_cache_unavailable(mocker):
+    cache = mocker.Mock()
+    cache.add.side_effect = ConnectionError
+    mocker.patch("sso.core.hawk.caches", {"nonces": cache})
+    mocker.patch("sso.core.hawk._local_nonces", LocalNonceStore(max_entries=10))
+
+    assert not seen_nonce("nonce", "the-id")
+    assert seen_nonce("nonce", "the-id")
+    assert not seen_nonce("nonce", "another-id")
+
+
+def test_local_nonce_store_expires_and_bounds_nonces():
+    store = LocalNonceStore(max_entries=2)
+
+    with freeze_time("2021-04-19 09:00:00") as frozen_time:
+        assert store.add("a", 30)
+        assert not store.add("a", 30)
+
+        frozen_time.tick(datetime.timedelta(seconds=31))
+        assert store.add("a", 30)
+
+        assert store.add("b", 30)
+        assert store.add("c", 30)
+        # "a" is evicted to keep the store within max_entries
+        assert store.add("a", 30)
+
+
+@pytest.mark.django_db(transaction=True)
 def test_if_no_users_no_activities_one_page(api_client):
     host = "localhost:8080"
     path = reverse("api-v1:core:activity-stream")
@@ -118,10 +167,9 @@ def test_if_no_users_no_activities_one_page(api_client):
     assert "next" not in response_dict
 
 
-@pytest.mark.django_db
+@pytest.mark.django_db(transaction=True)
 def test_if_one_user_one_activity_two_pages_then_updates(api_client):
     UserFactory()
-    time.sleep(1)
 
     host = "localhost:8080"
     path = reverse("api-v1:core:activity-stream")
@@ -145,7 +193,6 @@ def test_if_one_user_one_activity_two_pages_then_updates(api_client):
     assert "next" not in response_2_dict
 
     UserFactory()
-    time.sleep(1)
 
     response_3 = hawk_request(
         api_client, host, next_url.path + (f"?{next_url.query}" if next_url.query else "")
@@ -166,10 +213,9 @@ def test_if_one_user_one_activity_two_pages_then_updates(api_client):
     assert "next" not in response_4_dict
 
 
-@pytest.mark.django_db
+@pytest.mark.django_db(transaction=True)
 def test_if_50_users_two_pages(api_client):
     UserFactory.create_batch(50)
-    time.sleep(1)
 
     host = "localhost:8080"
     path = reverse("api-v1:core:activity-stream")
@@ -192,10 +238,9 @@ def test_if_50_users_two_pages(api_client):
     assert "next" not in response_2_dict
 
 
-@pytest.mark.django_db
+@pytest.mark.django_db(transaction=True)
 def test_if_51_users_three_pages(api_client):
     UserFactory.create_batch(51)
-    time.sleep(1)
 
     host = "localhost:8080"
     path = reverse("api-v1:core:activity-stream")
@@ -228,7 +273,72 @@ def test_if_51_users_three_pages(api_client):
     assert "next" not in response_3_dict
 
 
-@pytest.mark.django_db
+@pytest.mark.django_db(transaction=True)
+def test_page_size(api_client, settings):
+    settings.ACTIVITY_STREAM_MAX_PAGE_SIZE = 1000
+    UserFactory.create_batch(5)
+
+    host = "localhost:8080"
+    path = reverse("api-v1:core:activity-stream")
+
+    response_1_dict = hawk_request(api_client, host, path + "?page_size=3").json()
+    assert len(response_1_dict["orderedItems"]) == 3
+
+    next_url = urllib.parse.urlsplit(response_1_dict["next"])
+    assert urllib.parse.parse_qs(next_url.query)["page_size"] == ["3"]
+
+    response_2_dict = hawk_request(api_client, host, f"{next_url.path}?{next_url.query}").json()
+    assert len(response_2_dict["orderedItems"]) == 2
+
+
+@pytest.mark.django_db(transaction=True)
+def test_page_size_is_limited_to_maximum(api_client, settings):
+    settings.ACTIVITY_STREAM_MAX_PAGE_SIZE = 2
+    UserFactory.create_batch(3)
+
+    host = "localhost:8080"
+    path = reverse("api-v1:core:activity-stream")
+
+    response_dict = hawk_request(api_client, host, path + "?page_size=100").json()
+    assert len(response_dict["orderedItems"]) == 2
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize("page_size", ["0", "-1", "not-a-number"])
+def test_invalid_page_size_then_400(api_client, page_size):
+    host = "localhost:8080"
+    path = reverse("api-v1:core:activity-stream")
+
+    response = hawk_request(api_client, host, path + f"?page_size={page_size}")
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db(transaction=True)
+def test_users_are_loaded_in_chunks(api_client, mocker):
+    mocker.patch("sso.core.views.ACTIVITY_STREAM_CHUNK_SIZE", 2)
+    app = ApplicationFactory(display_name="App A", start_url="https://a.com/")
+    users = [UserFactory(email=f"test{i}@a.com", email_list=[f"test{i}@b.com"]) for i in range(5)]
+    users[3].permitted_applications.add(app)
+
+    host = "localhost:8080"
+    path = reverse("api-v1:core:activity-stream")
+
+    items = hawk_request(api_client, host, path).json()["orderedItems"]
+
+    # adding the application moved the user to the end of the stream
+    assert [item["object"]["dit:emailAddress"] for item in items] == [
+        [f"test{i}@a.com", f"test{i}@b.com"] for i in [0, 1, 2, 4, 3]
+    ]
+    assert [len(item["object"]["dit:StaffSSO:User:permittedApplications"]) for item in items] == [
+        0,
+        0,
+        0,
+        0,
+        1,
+    ]
+
+
+@pytest.mark.django_db(transaction=True)
 def test_no_n_plus_1_query(api_client, django_assert_num_queries):
     ap = AccessProfileFactory()
     ap.oauth2_applications.add(ApplicationFactory())
@@ -236,16 +346,14 @@ def test_no_n_plus_1_query(api_client, django_assert_num_queries):
     app_direct = ApplicationFactory()
     UserFactory.create_batch(50, add_access_profiles=[ap], add_permitted_applications=[app_direct])
 
-    time.sleep(1)
-
     host = "localhost:8080"
     path = reverse("api-v1:core:activity-stream")
 
-    with django_assert_num_queries(7):
+    with django_assert_num_queries(4):
         hawk_request(api_client, host, path)
 
 
-@pytest.mark.django_db
+@pytest.mark.django_db(transaction=True)
 def test_with_permitted_apps(api_client, django_assert_num_queries):
     ap = AccessProfileFactory()
     ap.oauth2_applications.add(ApplicationFactory(display_name="App C", start_url="https://c.com/"))
@@ -262,8 +370,6 @@ def test_with_permitted_apps(api_client, django_assert_num_queries):
         display_name="App E", start_url="https://e.com/", default_access_allowed=True
     )
 
-    time.sleep(1)
-
     host = "localhost:8080"
     path = reverse("api-v1:core:activity-stream")
 
@@ -294,13 +400,12 @@ def test_with_permitted_apps(api_client, django_assert_num_queries):
     ]
 
 
-@pytest.mark.django_db
+@pytest.mark.django_db(transaction=True)
 def test_with_main_email_not_in_email_list(api_client):
     user = UserFactory(
         email="test@a.com", contact_email="test@b.com", email_list=["test@c.com", "test@d.com"]
     )
     user.emails.get(email="test@a.com").delete()
-    time.sleep(1)
 
     host = "localhost:8080"
     path = reverse("api-v1:core:activity-stream")
@@ -317,10 +422,9 @@ def test_with_main_email_not_in_email_list(api_client):
     ]
 
 
-@pytest.mark.django_db
+@pytest.mark.django_db(transaction=True)
 def test_with_main_email_in_email_list(api_client):
     UserFactory(email="test@a.com", email_list=["test@b.com", "test@c.com"])
-    time.sleep(1)
 
     host = "localhost:8080"
     path = reverse("api-v1:core:activity-stream")
@@ -337,11 +441,10 @@ def test_with_main_email_in_email_list(api_client):
     ]
 
 
-@pytest.mark.django_db
+@pytest.mark.django_db(transaction=True)
 def test_active_and_inactive(api_client):
     UserFactory(is_active=True)
     UserFactory(is_active=False)
-    time.sleep(1)
 
     host = "localhost:8080"
     path = reverse("api-v1:core:activity-stream")
@@ -355,10 +458,9 @@ def test_active_and_inactive(api_client):
     response_1_dict["orderedItems"][1]["object"]["dit:StaffSSO:User:status"] == "inactive"
 
 
-@pytest.mark.django_db
+@pytest.mark.django_db(transaction=True)
 def test_last_accessed_in_full_ingest(api_client, rf, mocker):
     user = UserFactory(email="test@a.com", email_list=["test@b.com", "test@c.com"])
-    time.sleep(1)
 
     host = "localhost:8080"
     path = reverse("api-v1:core:activity-stream")
@@ -387,7 +489,7 @@ def test_last_accessed_in_full_ingest(api_client, rf, mocker):
     )
 
 
-@pytest.mark.django_db
+@pytest.mark.django_db(transaction=True)
 def test_user_access_does_not_result_in_update(api_client, rf, mocker):
     # If a client wants to have the last login for a user, they have to wait for the next full
     # ingest from the Activity Stream: we do this to not pollute real-time updates which at the
@@ -397,7 +499,6 @@ def test_user_access_does_not_result_in_update(api_client, rf, mocker):
     # for last accessed to get into the Activity Stream
 
     user = UserFactory(email="test@a.com", email_list=["test@b.com", "test@c.com"])
-    time.sleep(1)
 
     host = "localhost:8080"
     path = reverse("api-v1:core:activity-stream")
@@ -413,8 +514,6 @@ def test_user_access_does_not_result_in_update(api_client, rf, mocker):
     request.user = user
     middleware(request)
 
-    time.sleep(1)
-
     next_str = response_1_dict["next"]
     next_url = urllib.parse.urlsplit(next_str)
     assert next_url.netloc == host
@@ -426,6 +525,149 @@ def test_user_access_does_not_result_in_update(api_client, rf, mocker):
     assert response_2_dict["orderedItems"] == []
 
 
+@pytest.mark.django_db
+def test_email_login_does_not_result_in_update():
+    # as for last accessed, the last login of each email is only picked up by a full ingest
+    UserFactory(email="test@a.com")
+    events = UserChangeEvent.objects.count()
+
+    User.objects.set_email_last_login_time("test@a.com")
+
+    assert UserChangeEvent.objects.count() == events
+
+
+@pytest.mark.django_db(transaction=True)
+def test_changes_appear_after_cursor_without_delay(api_client):
+    user = UserFactory(email="test@a.com")
+
+    host = "localhost:8080"
+    path = reverse("api-v1:core:activity-stream")
+
+    response_1_dict = hawk_request(api_client, host, path).json()
+    assert len(response_1_dict["orderedItems"]) == 1
+
+    next_url = urllib.parse.urlsplit(response_1_dict["next"])
+    next_path = f"{next_url.path}?{next_url.query}"
+
+    assert hawk_request(api_client, host, next_path).json()["orderedItems"] == []
+
+    user.emails.create(email="test@b.com")
+
+    response_2_dict = hawk_request(api_client, host, next_path).json()
+    assert len(response_2_dict["orderedItems"]) == 1
+    assert response_2_dict["orderedItems"][0]["object"]["dit:emailAddress"] == [
+        "test@a.com",
+        "test@b.com",
+    ]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_event_committed_late_is_not_skipped(api_client):
+    UserFactory(email="first@a.com")
+
+    recorded, commit = threading.Event(), threading.Event()
+
+    def record_in_long_transaction():
+        try:
+            with transaction.atomic():
+                UserFactory(email="late@a.com")
+                recorded.set()
+                commit.wait(10)
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=record_in_long_transaction)
+    thread.start()
+    assert recorded.wait(10)
+
+    # recorded and committed after the long transaction's event was recorded
+    UserFactory(email="second@a.com")
+
+    host = "localhost:8080"
+    path = reverse("api-v1:core:activity-stream")
+
+    response_1_dict = hawk_request(api_client, host, path).json()
+    assert [item["object"]["dit:emailAddress"] for item in response_1_dict["orderedItems"]] == [
+        ["first@a.com"]
+    ]
+
+    commit.set()
+    thread.join()
+
+    next_url = urllib.parse.urlsplit(response_1_dict["next"])
+    response_2_dict = hawk_request(api_client, host, f"{next_url.path}?{next_url.query}").json()
+    assert [item["object"]["dit:emailAddress"] for item in response_2_dict["orderedItems"]] == [
+        ["late@a.com"],
+        ["second@a.com"],
+    ]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_access_profile_changes_appear_for_its_users(api_client):
+    ap = AccessProfileFactory()
+    users = UserFactory.create_batch(2, add_access_profiles=[ap])
+    UserFactory()
+
+    host = "localhost:8080"
+    path = reverse("api-v1:core:activity-stream")
+
+    next_url = urllib.parse.urlsplit(hawk_request(api_client, host, path).json()["next"])
+    next_path = f"{next_url.path}?{next_url.query}"
+
+    ap.oauth2_applications.add(ApplicationFactory(display_name="App A"))
+
+    items = hawk_request(api_client, host, next_path).json()["orderedItems"]
+    assert sorted(item["object"]["dit:StaffSSO:User:userId"] for item in items) == sorted(
+        str(user.user_id) for user in users
+    )
+
+
+@pytest.mark.django_db
+def test_saving_last_accessed_or_last_login_does_not_record_change():
+    user = UserFactory()
+    events = UserChangeEvent.objects.count()
+
+    user.save(update_fields=["last_accessed"])
+    user.save(update_fields=["last_login"])
+
+    assert UserChangeEvent.objects.count() == events
+
+    user.save()
+
+    assert UserChangeEvent.objects.count() == events + 1
+
+
+@pytest.mark.django_db(transaction=True)
+def test_cursor_from_before_change_log_restarts_stream(api_client):
+    UserFactory.create_batch(2)
+
+    host = "localhost:8080"
+    path = reverse("api-v1:core:activity-stream")
+
+    response_dict = hawk_request(
+        api_client, host, path + "?cursor=1618822800.0_00000000-0000-4000-0000-000000000000"
+    ).json()
+    assert len(response_dict["orderedItems"]) == 2
+
+
+@pytest.mark.django_db(transaction=True)
+def test_compact_user_changes(api_client):
+    user = UserFactory(email="test@a.com")
+    user.emails.create(email="test@b.com")
+    deleted_user = UserFactory()
+    deleted_user.delete()
+
+    host = "localhost:8080"
+    path = reverse("api-v1:core:activity-stream")
+
+    before = hawk_request(api_client, host, path).json()["orderedItems"]
+
+    call_command("compact_user_changes")
+
+    assert list(UserChangeEvent.objects.values_list("user_id", flat=True)) == [user.pk]
+    assert hawk_request(api_client, host, path).json()["orderedItems"] == before
+
+
 def hawk_auth_header(key_id, secret_key, url, method, content, content_type):
     return mohawk.Sender(
         {
@@ -442,9 +684,15 @@ def hawk_auth_header(key_id, secret_key, url, method, content, content_type):
 
 def hawk_request(api_client, host, path):
     url = f"http://{host}{path}"
-    return api_client.get(
+    response = api_client.get(
         path,
         content_type=None,
         HTTP_HOST="localhost:8080",
         HTTP_AUTHORIZATION=hawk_auth_header("the-id", "the-secret", url, "GET", b"", ""),
     )
+
+    if response.streaming:
+        # consume the stream here, so it is read in any surrounding query count assertion
+        response._json = json.loads(b"".join(response.streaming_content))
+
+    return response
@@ -10,9 +10,10 @@ from freezegun import freeze_time
 
 from sso.user.admin import UserAdmin, UserForm
 from sso.user.admin_views import ShowUserPermissionsView
+from sso.user.data_export import _users_in_batches, UserDataExport
 
 from .factories.oauth import ApplicationFactory
-from .factories.user import UserFactory
+from .factories.user import AccessProfileFactory, UserFactory
 
 
 pytestmark = [pytest.mark.django_db]
@@ -84,6 +85,62 @@ class TestUserAdmin:
 
         assert {"is_staff", "is_superuser", "groups", "user_permissions"}.isdisjoint(fields)
 
+    def test_email_domain_filter(self, auth_client):
+        user = UserFactory(email="user@aaa.com", email_list=["user@bbb.com"])
+        UserFactory(email="other@bbb.com")
+        UserFactory(email="another@sub.aaa.com")
+
+        response = auth_client.get(
+            reverse("admin:user_user_changelist"), {"email_domain": "aaa.com"}
+        )
+
+        assert response.status_code == 200
+        assert list(response.context["cl"].result_list) == [user]
+
+    def test_changelist_lists_related_objects(self, auth_client):
+        application = ApplicationFactory(name="An application")
+        access_profile = AccessProfileFactory(name="An access profile")
+        UserFactory(
+            email="user@aaa.com",
+            email_list=["user@bbb.com"],
+            add_access_profiles=[access_profile],
+            add_permitted_applications=[application],
+        )
+
+        response = auth_client.get(reverse("admin:user_user_changelist"))
+
+        assert response.status_code == 200
+        content = response.content.decode()
+        assert "user@bbb.com" in content
+        assert "An application" in content
+        assert "An access profile" in content
+
+
+class TestUserDataExport:
+    def test_users_are_fetched_in_batches(self):
+        UserFactory(email="c@example.com")
+        UserFactory(email="a@example.com")
+        UserFactory(email="b@example.com")
+
+        users = list(_users_in_batches(batch_size=2))
+
+        assert [user.email for user in users] == ["a@example.com", "b@example.com", "c@example.com"]
+
+    def test_export_row(self):
+        application = ApplicationFactory(name="An application")
+        access_profile = AccessProfileFactory(slug="an-access-profile")
+        UserFactory(
+            email="user@aaa.com",
+            email_list=["user@bbb.com"],
+            add_access_profiles=[access_profile],
+            add_permitted_applications=[application],
+        )
+
+        header, row = list(UserDataExport())
+
+        assert row[3] == "user@aaa.com"
+        assert row[9:] == ["an-access-profile", "An application", "user@bbb.com"]
+
 
 class TestAdminSSOLogin:
     def test_login_authenticated_but_not_staff_leads_to_403(self, client):
@@ -6,12 +6,18 @@ from unittest.mock import Mock
 from urllib.parse import parse_qs, quote, urlencode, urlsplit
 
 import pytest
+from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.http import HttpRequest
 from django.http.cookie import SimpleCookie
 from django.urls import reverse, reverse_lazy
 from django.utils import timezone
 from freezegun import freeze_time
 
+from sso.emailauth.models import EmailToken, OutboundEmail
+from sso.samlauth.conf import config_loader, get_idp_entity_id
+from sso.samlauth.models import EmailDomainRoute
+from sso.samlauth.routing import invalidate_routes, lookup_idp_ref, RoutingTable
 from sso.user.models import AccessProfile, User
 
 from .factories.oauth import ApplicationFactory
@@ -787,6 +793,21 @@ class TestEmailBasedAuthFlow:
 
         assert response.url == reverse("emailauth:email-auth-initiate-success")
 
+    def test_email_token_based_email_queues_signin_email(self, client, settings, mailoutbox):
+        settings.EMAIL_TOKEN_DOMAIN_WHITELIST = ["@test.com"]
+
+        client.post(reverse("saml2_login_start"), {"email": "test@test.com"})
+
+        assert mailoutbox == []
+
+        email = OutboundEmail.objects.get()
+        token = EmailToken.objects.get()
+
+        assert email.to_address == "test@test.com"
+        assert reverse("emailauth:email-auth-signin", kwargs=dict(token=token.token)) in (
+            email.message
+        )
+
     def test_email_token_based_email_is_case_insensitive(self, client, settings):
         settings.EMAIL_TOKEN_DOMAIN_WHITELIST = ["@test.com"]
 
@@ -859,6 +880,153 @@ class TestEmailBasedAuthFlow:
         )
 
 
+class TestEmailDomainRouting:
+    def test_routing_table(self):
+        table = RoutingTable(
+            [
+                ("@trade.gov.uk", "core"),
+                ("@*.trade.gov.uk", "okta"),
+                ("@*.mobile.trade.gov.uk", "google"),
+                ("@digital.trade.gov.uk", "ukef"),
+                ("@TRADE.gov.uk", "ignored"),
+            ]
+        )
+
+        assert table.lookup("@trade.gov.uk") == "core"
+        assert table.lookup("@Digital.Trade.gov.uk") == "ukef"
+        assert table.lookup("@a.trade.gov.uk") == "okta"
+        assert table.lookup("@a.b.trade.gov.uk") == "okta"
+        assert table.lookup("@a.mobile.trade.gov.uk") == "google"
+        assert table.lookup("@mobile.trade.gov.uk") == "okta"
+        assert table.lookup("@gov.uk") is None
+        assert table.lookup("@example.com") is None
+
+    def test_routes_from_the_database(self, settings):
+        settings.AUTH_EMAIL_TO_IDP_FROM_DB = True
+        settings.AUTH_EMAIL_TO_IPD_MAP = {"a-test": ["@test.com"]}
+
+        assert lookup_idp_ref("@new.gov.uk") is None
+
+        route = EmailDomainRoute.objects.create(domain="@new.gov.uk", idp_ref="b-test")
+        EmailDomainRoute.objects.create(domain="@test.com", idp_ref="b-test")
+
+        assert lookup_idp_ref("@new.gov.uk") == "b-test"
+        assert lookup_idp_ref("@test.com") == "a-test"
+
+        route.delete()
+
+        assert lookup_idp_ref("@new.gov.uk") is None
+
+    def test_database_routes_are_read_for_each_lookup_with_a_local_cache(self, settings):
+        settings.AUTH_EMAIL_TO_IDP_FROM_DB = True
+        settings.AUTH_EMAIL_TO_IPD_MAP = {}
+        EmailDomainRoute.objects.create(domain="@new.gov.uk", idp_ref="a-test")
+
+        assert lookup_idp_ref("@new.gov.uk") == "a-test"
+
+        # as changed by another process, whose local cache this process can't see
+        EmailDomainRoute.objects.update(idp_ref="b-test")
+
+        assert lookup_idp_ref("@new.gov.uk") == "b-test"
+
+    def test_database_routes_are_kept_with_a_shared_cache(
+        self, settings, redis_caches, django_assert_num_queries
+    ):
+        settings.AUTH_EMAIL_TO_IDP_FROM_DB = True
+        settings.AUTH_EMAIL_TO_IPD_MAP = {}
+        EmailDomainRoute.objects.create(domain="@new.gov.uk", idp_ref="a-test")
+
+        assert lookup_idp_ref("@new.gov.uk") == "a-test"
+
+        with django_assert_num_queries(0):
+            assert lookup_idp_ref("@new.gov.uk") == "a-test"
+
+        EmailDomainRoute.objects.update(idp_ref="b-test")
+        invalidate_routes()
+
+        assert lookup_idp_ref("@new.gov.uk") == "b-test"
+
+    @pytest.mark.django_db(transaction=True)
+    def test_database_routes_are_rebuilt_once_a_change_commits(self, settings, redis_caches):
+        settings.AUTH_EMAIL_TO_IDP_FROM_DB = True
+        settings.AUTH_EMAIL_TO_IPD_MAP = {}
+
+        assert lookup_idp_ref("@new.gov.uk") is None
+
+        with transaction.atomic():
+            EmailDomainRoute.objects.create(domain="@new.gov.uk", idp_ref="a-test")
+
+            # other processes can't read the route until it commits
+            assert lookup_idp_ref("@new.gov.uk") is None
+
+        assert lookup_idp_ref("@new.gov.uk") == "a-test"
+
+    def test_route_to_an_unknown_idp_is_invalid(self):
+        route = EmailDomainRoute(domain="@new.gov.uk", idp_ref="not-an-idp")
+
+        with pytest.raises(ValidationError) as excinfo:
+            route.full_clean()
+
+        assert "idp_ref" in excinfo.value.message_dict
+
+        EmailDomainRoute(domain="@new.gov.uk", idp_ref="a-test").full_clean()
+
+    def test_route_to_an_unknown_idp_sends_a_signin_email(self, settings, client, caplog):
+        settings.AUTH_EMAIL_TO_IDP_FROM_DB = True
+        settings.AUTH_EMAIL_TO_IPD_MAP = {}
+        EmailDomainRoute.objects.create(domain="@test.com", idp_ref="not-an-idp")
+
+        response = client.post(reverse("saml2_login_start"), {"email": "test@test.com"})
+
+        assert response.status_code == 302
+        assert response.url == reverse("emailauth:email-auth-initiate-success")
+        assert OutboundEmail.objects.get().to_address == "test@test.com"
+        assert "No IdP named not-an-idp" in caplog.text
+
+    def test_database_routes_are_ignored_unless_enabled(self, settings):
+        settings.AUTH_EMAIL_TO_IDP_FROM_DB = False
+        EmailDomainRoute.objects.create(domain="@new.gov.uk", idp_ref="b-test")
+
+        assert lookup_idp_ref("@new.gov.uk") is None
+
+    def test_redirect_to_idp_routed_from_the_database(self, settings, client):
+        settings.AUTH_EMAIL_TO_IDP_FROM_DB = True
+        settings.AUTH_EMAIL_TO_IPD_MAP = {}
+        EmailDomainRoute.objects.create(domain="@test.com", idp_ref="a-test")
+
+        response = client.post(reverse("saml2_login_start"), {"email": "test@test.com"})
+
+        assert response.status_code == 302
+        assert (
+            response.url
+            == "/saml2/login/?idp=http%3A//localhost%3A8080/simplesaml/saml2/idp/metadata.php"
+        )
+
+
+class TestSAMLConfigLoader:
+    def test_metadata_is_parsed_once(self):
+        assert config_loader().metadata is config_loader().metadata
+
+    def test_metadata_is_parsed_again_when_changed(self, settings):
+        metadata = config_loader().metadata
+
+        settings.SAML_CONFIG = {
+            **settings.SAML_CONFIG,
+            "metadata": {
+                "local": settings.SAML_CONFIG["metadata"]["local"]
+                + [os.path.join(settings.SAML_CONFIG_DIR, "idp_metadata_2.xml")]
+            },
+        }
+
+        assert config_loader().metadata is not metadata
+
+    def test_get_idp_entity_id(self):
+        assert (
+            get_idp_entity_id("a-test") == "http://localhost:8080/simplesaml/saml2/idp/metadata.php"
+        )
+        assert get_idp_entity_id("not-an-idp") is None
+
+
 class TestLoggedInPage:
     def test_dynamic_links(self, client):
 
@@ -0,0 +1,87 @@
+import pytest
+from django.core.cache import caches
+
+from sso.core.caches import cache_config, is_shared, local_aliases, LOCMEM, MEMCACHED, REDIS
+from sso.oauth2.registry import get_application_by_client_id
+from .factories.oauth import ApplicationFactory
+
+pytestmark = [pytest.mark.django_db]
+
+
+class TestCacheConfig:
+    @pytest.mark.parametrize(
+        "backend, expected",
+        [
+            (REDIS, "django_redis.cache.RedisCache"),
+            (MEMCACHED, "django.core.cache.backends.memcached.MemcachedCache"),
+            (LOCMEM, "django.core.cache.backends.locmem.LocMemCache"),
+        ],
+    )
+    def test_backend(self, backend, expected):
+        config = cache_config(
+            backend,
+            alias="applications",
+            timeout=60,
+            max_entries=10,
+            redis_url="redis://localhost:6379/0",
+            memcached_location=["localhost:11211"],
+        )
+
+        assert config["BACKEND"] == expected
+        assert config["TIMEOUT"] == 60
+        assert config["KEY_PREFIX"] == "staff-sso:applications"
+
+    def test_locmem_is_bounded(self):
+        config = cache_config(LOCMEM, alias="nonces", timeout=60, max_entries=10)
+
+        assert config["OPTIONS"]["MAX_ENTRIES"] == 10
+        assert config["LOCATION"] == "nonces"
+
+    def test_unknown_backend(self):
+        with pytest.raises(ValueError):
+            cache_config("filesystem", alias="nonces", timeout=60, max_entries=10)
+
+    @pytest.mark.parametrize("backend, shared", [(REDIS, True), (MEMCACHED, True), (LOCMEM, False)])
+    def test_is_shared(self, backend, shared):
+        assert (
+            is_shared(cache_config(backend, alias="sessions", timeout=60, max_entries=10)) is shared
+        )
+
+    def test_local_aliases(self):
+        caches_setting = {
+            alias: cache_config(backend, alias=alias, timeout=60, max_entries=10)
+            for alias, backend in [("applications", REDIS), ("nonces", LOCMEM)]
+        }
+
+        assert local_aliases(caches_setting) == ["nonces"]
+
+    def test_every_alias_is_configured(self, settings):
+        for alias in (
+            settings.APPLICATION_CACHE,
+            settings.INTROSPECTION_CACHE,
+            settings.SESSION_CACHE_ALIAS,
+            settings.NONCE_CACHE,
+            settings.AXES_CACHE,
+        ):
+            assert alias in settings.CACHES
+
+
+class TestRedisCaches:
+    def test_aliases_do_not_share_keys(self, redis_caches):
+        caches["applications"].set("key", "value")
+
+        assert caches["applications"].get("key") == "value"
+        assert caches["introspection"].get("key") is None
+
+    @pytest.mark.django_db(transaction=True)
+    def test_application_registry(self, redis_caches, django_assert_num_queries):
+        application = ApplicationFactory()
+
+        with django_assert_num_queries(1):
+            assert get_application_by_client_id(application.client_id) == application
+            assert get_application_by_client_id(application.client_id) == application
+
+        application.display_name = "updated"
+        application.save()
+
+        assert get_application_by_client_id(application.client_id).display_name == "updated"
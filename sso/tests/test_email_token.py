@@ -1,13 +1,17 @@
 import datetime as dt
+from io import StringIO
+from smtplib import SMTPException, SMTPServerDisconnected
 from unittest.mock import ANY
 
 import pytest
 from django.conf import settings
+from django.core.management import call_command
 from django.utils import timezone
 from freezegun import freeze_time
 
+from sso.emailauth import outbox, signin_email
 from sso.emailauth.forms import EmailForm
-from sso.emailauth.models import EmailToken
+from sso.emailauth.models import EmailToken, OutboundEmail
 from sso.emailauth.views import EmailAuthView, InvalidToken
 
 from .factories.user import UserFactory
@@ -317,3 +321,278 @@ class TestEmailAuthView:
         client.post(url)
 
         assert user.emails.get(email="test@test.com").last_login == timezone.now()
+
+
+class TestOutbox:
+    def test_signin_email_is_queued(self, client, mailoutbox):
+        client.post(
+            reverse("emailauth:email-auth-initiate"),
+            {"username": "john.smith", "domain": "@digital.trade.gov.uk"},
+        )
+
+        assert mailoutbox == []
+
+        email = OutboundEmail.objects.get()
+        token = EmailToken.objects.get()
+
+        assert email.to_address == "john.smith@digital.trade.gov.uk"
+        assert email.from_address == settings.EMAIL_FROM
+        assert email.status == OutboundEmail.PENDING
+        assert reverse("emailauth:email-auth-signin", kwargs=dict(token=token.token)) in (
+            email.message
+        )
+
+        assert outbox.send_pending() == 1
+
+        assert len(mailoutbox) == 1
+        assert mailoutbox[0].to == ["john.smith@digital.trade.gov.uk"]
+        assert mailoutbox[0].body == email.message
+
+        email.refresh_from_db()
+        assert email.status == OutboundEmail.SENT
+        assert email.sent is not None
+        assert email.attempts == 1
+        assert email.message == ""
+
+    def test_sender_is_woken_on_commit(self, mocker, settings):
+        settings.EMAIL_OUTBOX_THREAD = True
+        on_commit = mocker.patch("sso.emailauth.outbox.transaction.on_commit")
+
+        outbox.enqueue("test@test.com", "subject", "message")
+
+        on_commit.assert_called_once_with(outbox.sender.wake)
+
+    def test_sender_is_not_woken_without_thread(self, mocker, settings):
+        settings.EMAIL_OUTBOX_THREAD = False
+        on_commit = mocker.patch("sso.emailauth.outbox.transaction.on_commit")
+
+        outbox.enqueue("test@test.com", "subject", "message")
+
+        assert not on_commit.called
+
+    def test_rate_limit(self, settings):
+        settings.EMAIL_OUTBOX_RATE_LIMIT = 2
+        settings.EMAIL_OUTBOX_RATE_LIMIT_PERIOD = 60
+
+        with freeze_time("2021-05-10 10:00:00") as frozen_time:
+            outbox.enqueue("test@test.com", "subject", "message", requester_ip="1.1.1.1")
+            assert not outbox.is_rate_limited("test@test.com", "1.1.1.1")
+
+            outbox.enqueue("test@test.com", "subject", "message", requester_ip="1.1.1.1")
+            assert outbox.is_rate_limited("test@test.com", "1.1.1.1")
+
+            # the limit is per requester and address
+            assert not outbox.is_rate_limited("test@test.com", "2.2.2.2")
+            assert not outbox.is_rate_limited("test@test.com", None)
+            assert not outbox.is_rate_limited("other@test.com", "1.1.1.1")
+
+            frozen_time.tick(dt.timedelta(seconds=61))
+
+            assert not outbox.is_rate_limited("test@test.com", "1.1.1.1")
+
+    def test_rate_limited_request_makes_no_token(self, client, settings):
+        settings.EMAIL_OUTBOX_RATE_LIMIT = 1
+
+        for _ in range(2):
+            response = client.post(
+                reverse("emailauth:email-auth-initiate"),
+                {"username": "john.smith", "domain": "@digital.trade.gov.uk"},
+                HTTP_X_FORWARDED_FOR="1.1.1.1, 2.2.2.2, 3.3.3.3",
+            )
+
+            assert response.status_code == 302
+
+        assert EmailToken.objects.count() == 1
+        assert list(OutboundEmail.objects.values_list("requester_ip", flat=True)) == ["1.1.1.1"]
+
+    def test_batches_share_a_connection(self, mocker, mailoutbox):
+        get_connection = mocker.spy(outbox, "get_connection")
+
+        for i in range(5):
+            outbox.enqueue(f"test{i}@test.com", "subject", "message")
+
+        assert outbox.send_pending(batch_size=2) == 5
+
+        assert get_connection.call_count == 3
+        assert len(mailoutbox) == 5
+        assert OutboundEmail.objects.filter(status=OutboundEmail.SENT).count() == 5
+
+    def test_emails_are_leased_while_they_are_sent(self, mocker, settings, mailoutbox):
+        settings.EMAIL_OUTBOX_LEASE = 300
+        leased = []
+
+        def send(message, connection):
+            # the claim has been made, and other senders skip the email until the lease runs out
+            email = OutboundEmail.objects.get()
+            leased.append(email.send_after - timezone.now() > dt.timedelta(seconds=290))
+
+        mocker.patch("sso.emailauth.outbox._send", side_effect=send)
+        outbox.enqueue("test@test.com", "subject", "message")
+
+        assert outbox.send_pending() == 1
+
+        assert leased == [True]
+        assert OutboundEmail.objects.get().status == OutboundEmail.SENT
+
+    def test_failed_email_is_retried_with_backoff(self, mocker, settings, mailoutbox):
+        settings.EMAIL_OUTBOX_RETRY_DELAY = 30
+        settings.EMAIL_OUTBOX_MAX_ATTEMPTS = 3
+        send_messages = mocker.patch(
+            "django.core.mail.backends.locmem.EmailBackend.send_messages",
+            side_effect=SMTPException("relay unavailable"),
+        )
+
+        with freeze_time("2021-05-10 10:00:00") as frozen_time:
+            email = outbox.enqueue("test@test.com", "subject", "message")
+
+            assert outbox.send_pending() == 0
+
+            email.refresh_from_db()
+            assert email.status == OutboundEmail.PENDING
+            assert email.attempts == 1
+            assert email.last_error == "relay unavailable"
+            assert email.send_after == timezone.now() + dt.timedelta(seconds=30)
+
+            # not due yet
+            assert outbox.send_pending() == 0
+            assert send_messages.call_count == 1
+
+            frozen_time.tick(dt.timedelta(seconds=30))
+            assert outbox.send_pending() == 0
+
+            email.refresh_from_db()
+            assert email.attempts == 2
+            assert email.send_after == timezone.now() + dt.timedelta(seconds=60)
+
+            frozen_time.tick(dt.timedelta(seconds=60))
+            assert outbox.send_pending() == 0
+
+            email.refresh_from_db()
+            assert email.status == OutboundEmail.FAILED
+            assert email.attempts == 3
+            assert email.message == ""
+
+            frozen_time.tick(dt.timedelta(days=1))
+            assert outbox.send_pending() == 0
+            assert send_messages.call_count == 3
+
+        assert mailoutbox == []
+
+    def test_failed_connection_is_retried(self, mocker, mailoutbox):
+        mocker.patch(
+            "django.core.mail.backends.locmem.EmailBackend.open",
+            side_effect=ConnectionRefusedError("connection refused"),
+        )
+
+        outbox.enqueue("test1@test.com", "subject", "message")
+        outbox.enqueue("test2@test.com", "subject", "message")
+
+        assert outbox.send_pending() == 0
+
+        assert mailoutbox == []
+        assert list(OutboundEmail.objects.order_by("pk").values_list("status", "attempts")) == [
+            (OutboundEmail.PENDING, 1),
+            (OutboundEmail.PENDING, 1),
+        ]
+
+    def test_connection_is_left_open_for_the_next_call(self, mocker, mailoutbox):
+        connection = outbox.get_connection()
+        close = mocker.spy(connection, "close")
+
+        outbox.enqueue("test1@test.com", "subject", "message")
+        assert outbox.send_pending(connection=connection) == 1
+
+        outbox.enqueue("test2@test.com", "subject", "message")
+        assert outbox.send_pending(connection=connection) == 1
+
+        assert not close.called
+        assert len(mailoutbox) == 2
+
+    def test_closed_connection_is_reopened(self, mocker, mailoutbox):
+        send_messages = mocker.patch(
+            "django.core.mail.backends.locmem.EmailBackend.send_messages",
+            side_effect=[SMTPServerDisconnected("closed by the relay"), 1],
+        )
+        close = mocker.patch("django.core.mail.backends.locmem.EmailBackend.close")
+
+        email = outbox.enqueue("test@test.com", "subject", "message")
+
+        assert outbox.send_pending() == 1
+
+        email.refresh_from_db()
+        assert email.status == OutboundEmail.SENT
+        assert email.attempts == 1
+        assert send_messages.call_count == 2
+        # once to reopen it, and once when the emails have been sent
+        assert close.call_count == 2
+
+    def test_send_stats(self, mocker, mailoutbox):
+        mocker.patch.dict(outbox.stats, {"sent": 0, "failed": 0, "send_seconds": 0.0})
+        outbox.enqueue("test1@test.com", "subject", "message")
+        outbox.enqueue("test2@test.com", "subject", "message")
+        mocker.patch(
+            "django.core.mail.backends.locmem.EmailBackend.send_messages",
+            side_effect=[1, SMTPException("rejected")],
+        )
+
+        outbox.send_pending()
+
+        assert outbox.stats["sent"] == 1
+        assert outbox.stats["failed"] == 1
+        assert outbox.stats["send_seconds"] > 0
+
+    def test_delete_old(self):
+        with freeze_time("2021-05-01 10:00:00"):
+            sent = outbox.enqueue("test1@test.com", "subject", "message")
+            pending = outbox.enqueue("test2@test.com", "subject", "message")
+            OutboundEmail.objects.filter(pk=sent.pk).update(status=OutboundEmail.SENT)
+
+        with freeze_time("2021-05-10 10:00:00"):
+            recent = outbox.enqueue("test3@test.com", "subject", "message")
+            OutboundEmail.objects.filter(pk=recent.pk).update(status=OutboundEmail.SENT)
+
+            assert outbox.delete_old(7) == 1
+
+        assert set(OutboundEmail.objects.values_list("pk", flat=True)) == {pending.pk, recent.pk}
+
+    def test_send_outbound_emails_command(self, mailoutbox):
+        outbox.enqueue("test@test.com", "subject", "message")
+
+        out = StringIO()
+        call_command("send_outbound_emails", stdout=out)
+
+        assert len(mailoutbox) == 1
+        assert "Sent 1 email(s), deleted 0 old email(s)" in out.getvalue()
+
+
+class TestSigninEmail:
+    def test_render_signin_email(self):
+        subject, message = signin_email.render_signin_email("https://sso.test/signin/abc/")
+
+        assert subject == "DIT: Complete your sign in"
+        assert "https://sso.test/signin/abc/" in message
+
+    def test_templates_are_compiled_once(self, mocker, settings):
+        get_template = mocker.spy(signin_email, "get_template")
+        # replaced, so that the templates compiled by an earlier test aren't used
+        settings.TEMPLATES = [dict(settings.TEMPLATES[0])]
+
+        signin_email.render_signin_email("https://sso.test/signin/abc/")
+        _, message = signin_email.render_signin_email("https://sso.test/signin/def/")
+
+        assert "https://sso.test/signin/def/" in message
+        assert get_template.call_count == 2
+
+        settings.TEMPLATES = [dict(settings.TEMPLATES[0])]
+        signin_email.render_signin_email("https://sso.test/signin/abc/")
+
+        assert get_template.call_count == 4
+
+    def test_render_stats(self, mocker):
+        mocker.patch.dict(signin_email.stats, {"rendered": 0, "render_seconds": 0.0})
+
+        signin_email.render_signin_email("https://sso.test/signin/abc/")
+        signin_email.render_signin_email("https://sso.test/signin/def/")
+
+        assert signin_email.stats["rendered"] == 2
+        assert signin_email.stats["render_seconds"] > 0
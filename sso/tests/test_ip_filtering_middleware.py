@@ -1,7 +1,10 @@
+from unittest import mock
+
+import pytest
 from django.http import HttpResponse
 
 from sso.core.ip_filter import get_client_ip
-from sso.core.middleware import AdminIpRestrictionMiddleware
+from sso.core.middleware import AdminIpRestrictionMiddleware, is_admin_request
 
 
 def test_get_client_ip_no_header(rf):
@@ -91,3 +94,42 @@ def test_ip_restriction_invalid_ip(rf, settings):
     assert (
         AdminIpRestrictionMiddleware(lambda _: HttpResponse(status=200))(request).status_code == 401
     )  # noqa
+
+
+def test_ip_restriction_valid_ip_range(rf, settings):
+    settings.RESTRICT_ADMIN = True
+    settings.ALLOWED_ADMIN_IPS = []
+    settings.ALLOWED_ADMIN_IP_RANGES = ["1.1.0.0/16"]
+
+    request = rf.get("/admin/", HTTP_X_FORWARDED_FOR="1.1.1.1, 2.2.2.2, 3.3.3.3")
+
+    assert (
+        AdminIpRestrictionMiddleware(lambda _: HttpResponse(status=200))(request).status_code == 200
+    )  # noqa
+
+    settings.ALLOWED_ADMIN_IP_RANGES = ["1.2.0.0/16"]
+
+    assert (
+        AdminIpRestrictionMiddleware(lambda _: HttpResponse(status=200))(request).status_code == 401
+    )  # noqa
+
+
+@pytest.mark.parametrize(
+    "path,is_admin",
+    [
+        ("/admin/", True),
+        ("/admin/user/user/", True),
+        ("/admin/login/", False),
+        ("/o/introspect/", False),
+        ("/", False),
+    ],
+)
+def test_is_admin_request(rf, path, is_admin):
+    assert is_admin_request(rf.get(path)) == is_admin
+
+
+def test_is_admin_request_only_resolves_admin_paths(rf):
+    with mock.patch("sso.core.middleware.resolve") as resolve:
+        assert not is_admin_request(rf.get("/o/introspect/"))
+
+    assert not resolve.called
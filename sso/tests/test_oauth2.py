@@ -1,10 +1,16 @@
 import pytest
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
 
 try:
     from django.urls import reverse
 except ImportError:
     from django.core.urlresolvers import reverse
 
+from sso.oauth2.introspection import _client_generation_key, _token_generation_key, hash_token
+from sso.oauth2.models import Application
+from sso.oauth2.registry import get_application_by_client_id, get_application_by_key
 from .factories.oauth import AccessTokenFactory, ApplicationFactory, UserFactory
 
 pytestmark = [pytest.mark.django_db]
@@ -175,3 +181,340 @@ class TestIntrospectView:
         assert response_json["access_type"] == "cross_client"
         assert response_json["source_name"] == application.name
         assert response_json["source_client_id"] == application.client_id
+
+
+class TestIntrospectionCache:
+    OAUTH2_INTROSPECTION_URL = reverse("oauth2:introspect")
+
+    @pytest.fixture
+    def introspect(self, api_client):
+        application = ApplicationFactory()
+
+        introspect_token = AccessTokenFactory(
+            application=application, user=UserFactory(), scope="introspection read"
+        )
+
+        api_client.credentials(HTTP_AUTHORIZATION="Bearer " + introspect_token.token)
+
+        def _introspect(token_value):
+            return api_client.get(self.OAUTH2_INTROSPECTION_URL + f"?token={token_value}")
+
+        _introspect.application = application
+        return _introspect
+
+    def test_response_is_cached(self, introspect):
+        token = AccessTokenFactory(application=introspect.application, user=UserFactory())
+
+        assert introspect(token.token).json()["scope"] == token.scope
+
+        # bypasses the signals, so the cached response is still served
+        type(token).objects.filter(pk=token.pk).update(scope="changed")
+
+        assert introspect(token.token).json()["scope"] == token.scope
+
+    @pytest.mark.django_db(transaction=True)
+    def test_saving_token_invalidates_response(self, introspect):
+        token = AccessTokenFactory(application=introspect.application, user=UserFactory())
+
+        assert introspect(token.token).json()["active"] is True
+
+        token.expires = token.expires.replace(year=2000)
+        token.save()
+
+        response = introspect(token.token)
+        assert response.status_code == 200
+        assert response.json() == {"active": False}
+
+    @pytest.mark.django_db(transaction=True)
+    def test_revoking_token_invalidates_response(self, introspect):
+        token = AccessTokenFactory(application=introspect.application, user=UserFactory())
+
+        assert introspect(token.token).json()["active"] is True
+
+        token.revoke()
+
+        assert introspect(token.token).status_code == 401
+
+    @pytest.mark.django_db(transaction=True)
+    def test_response_is_invalidated_once_the_change_commits(self, introspect):
+        token = AccessTokenFactory(application=introspect.application, user=UserFactory())
+
+        assert introspect(token.token).json()["active"] is True
+
+        with transaction.atomic():
+            token.revoke()
+
+            # until the revoke commits, other processes can still read the token as active
+            assert introspect(token.token).json()["active"] is True
+
+        assert introspect(token.token).status_code == 401
+
+    @pytest.mark.django_db(transaction=True)
+    def test_allow_tokens_from_change_invalidates_response(self, introspect):
+        other_application = ApplicationFactory()
+        token = AccessTokenFactory(application=other_application, user=UserFactory())
+
+        assert introspect(token.token).status_code == 401
+
+        introspect.application.allow_tokens_from.add(other_application)
+
+        assert introspect(token.token).json()["access_type"] == "cross_client"
+
+        other_application.application_set.clear()
+
+        assert introspect(token.token).status_code == 401
+
+    def test_evicted_generation_is_a_miss(self, introspect):
+        token = AccessTokenFactory(application=introspect.application, user=UserFactory())
+        cache = caches[settings.INTROSPECTION_CACHE]
+        # there are no generations when the response is built
+        cache.delete_many(
+            [
+                _client_generation_key(introspect.application.client_id),
+                _token_generation_key(hash_token(token.token)),
+            ]
+        )
+
+        assert introspect(token.token).json()["active"] is True
+
+        # the generations are evicted, while the response survives
+        cache.delete_many(
+            [
+                _client_generation_key(introspect.application.client_id),
+                _token_generation_key(hash_token(token.token)),
+            ]
+        )
+        # bypasses the signals, so only an uncached response can see the expiry
+        type(token).objects.filter(pk=token.pk).update(expires=token.expires.replace(year=2000))
+
+        assert introspect(token.token).json() == {"active": False}
+
+    def test_denied_response_is_not_cached_when_negative_ttl_is_zero(self, introspect, settings):
+        settings.INTROSPECTION_NEGATIVE_CACHE_TTL = 0
+
+        assert introspect("does-not-exist").status_code == 401
+
+        # bypasses the signals, so only an uncached response can see the new token
+        token = AccessTokenFactory.build(
+            application=introspect.application, user=UserFactory(), token="does-not-exist"
+        )
+        type(token).objects.bulk_create([token])
+
+        assert introspect("does-not-exist").json()["active"] is True
+
+    def test_responses_are_cached_per_introspecting_client(self, introspect, api_client):
+        token = AccessTokenFactory(application=introspect.application, user=UserFactory())
+
+        assert introspect(token.token).status_code == 200
+
+        other_token = AccessTokenFactory(
+            application=ApplicationFactory(), user=UserFactory(), scope="introspection read"
+        )
+        api_client.credentials(HTTP_AUTHORIZATION="Bearer " + other_token.token)
+
+        assert introspect(token.token).status_code == 401
+
+
+class TestBatchIntrospectView:
+    OAUTH2_BATCH_INTROSPECTION_URL = reverse("oauth2:introspect-batch")
+
+    @pytest.fixture
+    def application(self, api_client):
+        application = ApplicationFactory()
+
+        introspect_token = AccessTokenFactory(
+            application=application, user=UserFactory(), scope="introspection read"
+        )
+        api_client.credentials(HTTP_AUTHORIZATION="Bearer " + introspect_token.token)
+
+        return application
+
+    def test_introspects_tokens_in_request_order(self, api_client, application):
+        other_application = ApplicationFactory()
+        allowed_application = ApplicationFactory()
+        application.allow_tokens_from.add(allowed_application)
+
+        user = UserFactory(email="test@bbb.com")
+        own_token = AccessTokenFactory(application=application, user=user)
+        allowed_token = AccessTokenFactory(application=allowed_application, user=user)
+        other_token = AccessTokenFactory(application=other_application, user=user)
+
+        response = api_client.post(
+            self.OAUTH2_BATCH_INTROSPECTION_URL,
+            {"tokens": [own_token.token, "does-not-exist", allowed_token.token, other_token.token]},
+            format="json",
+        )
+
+        assert response.status_code == 200
+
+        results = response.json()["results"]
+        assert [result["token"] for result in results] == [
+            own_token.token,
+            "does-not-exist",
+            allowed_token.token,
+            other_token.token,
+        ]
+        assert [result["status"] for result in results] == [200, 401, 200, 401]
+        assert results[0]["data"]["access_type"] == "client"
+        assert results[0]["data"]["username"] == "test@bbb.com"
+        assert results[1]["data"] == {"active": False}
+        assert results[2]["data"]["access_type"] == "cross_client"
+        assert results[3]["data"] == {"active": False}
+
+    def test_accepts_form_encoded_tokens(self, api_client, application):
+        token = AccessTokenFactory(application=application, user=UserFactory())
+
+        response = api_client.post(
+            self.OAUTH2_BATCH_INTROSPECTION_URL, {"token": [token.token, "does-not-exist"]}
+        )
+
+        assert response.status_code == 200
+        assert [result["status"] for result in response.json()["results"]] == [200, 401]
+
+    def test_tokens_are_loaded_in_one_query(
+        self, api_client, application, django_assert_max_num_queries
+    ):
+        tokens = [
+            AccessTokenFactory(application=application, user=UserFactory()).token for _ in range(10)
+        ]
+
+        # authenticating the bearer token, then loading every introspected token and its user's
+        # email addresses
+        with django_assert_max_num_queries(3):
+            response = api_client.post(
+                self.OAUTH2_BATCH_INTROSPECTION_URL, {"tokens": tokens}, format="json"
+            )
+
+        assert response.status_code == 200
+        assert all(result["data"]["active"] for result in response.json()["results"])
+
+    def test_cross_client_tokens_are_checked_in_one_query(
+        self, api_client, application, django_assert_max_num_queries
+    ):
+        allowed_application = ApplicationFactory()
+        application.allow_tokens_from.add(allowed_application)
+        tokens = [
+            AccessTokenFactory(application=allowed_application, user=UserFactory()).token
+            for _ in range(10)
+        ]
+
+        # as above, then loading the applications whose tokens can be introspected
+        with django_assert_max_num_queries(4):
+            response = api_client.post(
+                self.OAUTH2_BATCH_INTROSPECTION_URL, {"tokens": tokens}, format="json"
+            )
+
+        assert [result["data"]["access_type"] for result in response.json()["results"]] == [
+            "cross_client"
+        ] * 10
+
+    def test_too_many_tokens(self, api_client, application, settings):
+        settings.INTROSPECTION_BATCH_MAX_TOKENS = 2
+
+        response = api_client.post(
+            self.OAUTH2_BATCH_INTROSPECTION_URL, {"tokens": ["a", "b", "c"]}, format="json"
+        )
+
+        assert response.status_code == 400
+
+    @pytest.mark.parametrize("body", [{}, {"tokens": []}, {"tokens": "a"}, {"tokens": [1]}])
+    def test_invalid_body(self, api_client, application, body):
+        response = api_client.post(self.OAUTH2_BATCH_INTROSPECTION_URL, body, format="json")
+
+        assert response.status_code == 400
+
+    def test_get_not_allowed(self, api_client, application):
+        response = api_client.get(self.OAUTH2_BATCH_INTROSPECTION_URL)
+
+        assert response.status_code == 405
+
+    def test_requires_introspection_scope(self, api_client):
+        token = AccessTokenFactory(scope="read")
+        api_client.credentials(HTTP_AUTHORIZATION="Bearer " + token.token)
+
+        response = api_client.post(
+            self.OAUTH2_BATCH_INTROSPECTION_URL, {"tokens": [token.token]}, format="json"
+        )
+
+        assert response.status_code == 403
+
+
+class TestApplicationRegistry:
+    def test_get_application_by_client_id_is_cached(self, django_assert_num_queries):
+        application = ApplicationFactory()
+
+        with django_assert_num_queries(1):
+            assert get_application_by_client_id(application.client_id) == application
+            assert get_application_by_client_id(application.client_id) == application
+
+    def test_get_application_by_key_is_cached(self, django_assert_num_queries):
+        application = ApplicationFactory()
+
+        with django_assert_num_queries(1):
+            assert get_application_by_key(application.application_key) == application
+            assert get_application_by_key(application.application_key) == application
+
+    def test_get_application_by_client_id_does_not_exist(self):
+        with pytest.raises(Application.DoesNotExist):
+            get_application_by_client_id("does-not-exist")
+
+    @pytest.mark.django_db(transaction=True)
+    def test_saving_application_evicts_cached_entry(self):
+        application = ApplicationFactory(display_name="before")
+
+        assert get_application_by_client_id(application.client_id).display_name == "before"
+
+        application.display_name = "after"
+        application.save()
+
+        assert get_application_by_client_id(application.client_id).display_name == "after"
+
+    @pytest.mark.django_db(transaction=True)
+    def test_entry_is_evicted_once_the_change_commits(self):
+        application = ApplicationFactory(display_name="before")
+
+        get_application_by_client_id(application.client_id)
+
+        with transaction.atomic():
+            application.display_name = "after"
+            application.save()
+
+            # other processes still read the previous row until the change commits
+            assert get_application_by_client_id(application.client_id).display_name == "before"
+
+        assert get_application_by_client_id(application.client_id).display_name == "after"
+
+    @pytest.mark.django_db(transaction=True)
+    def test_changing_client_id_evicts_previous_entry(self):
+        application = ApplicationFactory()
+        previous_client_id = application.client_id
+
+        get_application_by_client_id(previous_client_id)
+
+        application.client_id = "new-client-id"
+        application.save()
+
+        with pytest.raises(Application.DoesNotExist):
+            get_application_by_client_id(previous_client_id)
+
+    @pytest.mark.django_db(transaction=True)
+    def test_deleting_application_evicts_cached_entry(self):
+        application = ApplicationFactory()
+        client_id = application.client_id
+
+        get_application_by_client_id(client_id)
+        application.delete()
+
+        with pytest.raises(Application.DoesNotExist):
+            get_application_by_client_id(client_id)
+
+    @pytest.mark.django_db(transaction=True)
+    def test_default_access_applications_are_updated_on_save(self):
+        application = ApplicationFactory(default_access_allowed=True)
+
+        assert Application.get_default_access_applications() == [application]
+
+        application.default_access_allowed = False
+        application.save()
+
+        assert Application.get_default_access_applications() == []
@@ -0,0 +1,54 @@
+from sso.core.policy import (
+    compile_allowed_ips,
+    compile_email_domains,
+    compile_email_order,
+    CompiledSetting,
+)
+
+
+def test_compile_email_domains():
+    assert compile_email_domains(" aaa.com,bbb.com , ,") == frozenset({"aaa.com", "bbb.com"})
+    assert compile_email_domains(None) == frozenset()
+
+
+def test_compile_email_domains_lower_cases_domains():
+    assert compile_email_domains("AAA.com,Bbb.Com") == frozenset({"aaa.com", "bbb.com"})
+
+
+def test_compile_email_order_keeps_order():
+    assert compile_email_order("ccc.com, aaa.com,bbb.com") == ("ccc.com", "aaa.com", "bbb.com")
+
+
+def test_compiled_values_are_reused():
+    assert compile_allowed_ips("1.1.1.1, 10.0.0.0/8") is compile_allowed_ips("1.1.1.1, 10.0.0.0/8")
+
+
+def test_compile_allowed_ips():
+    allowed_ips = compile_allowed_ips("1.1.1.1, 10.0.0.0/8, ::1, not-an-ip")
+
+    assert "1.1.1.1" in allowed_ips
+    assert "10.20.30.40" in allowed_ips
+    assert "::1" in allowed_ips
+    assert "1.1.1.2" not in allowed_ips
+    assert "not-an-ip" not in allowed_ips
+    assert not compile_allowed_ips("")
+
+
+def test_compiled_setting_is_compiled_again_when_replaced(settings):
+    compiled = CompiledSetting("DEFAULT_EMAIL_ORDER", compile=compile_email_order)
+
+    settings.DEFAULT_EMAIL_ORDER = "aaa.com"
+    assert compiled.get() == ("aaa.com",)
+
+    settings.DEFAULT_EMAIL_ORDER = "bbb.com"
+    assert compiled.get() == ("bbb.com",)
+
+
+def test_ip_allowlist_merges_overlapping_ranges():
+    allowed_ips = compile_allowed_ips("10.0.0.0/16, 10.0.128.0/24, 10.1.0.0/16, 10.3.0.0/16")
+
+    assert "10.1.255.255" in allowed_ips
+    assert "10.2.0.0" not in allowed_ips
+    assert "10.3.0.0" in allowed_ips
+    assert "9.255.255.255" not in allowed_ips
+    assert "2001:db8::1" not in allowed_ips
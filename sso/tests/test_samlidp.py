@@ -1,16 +1,23 @@
 import datetime
+import threading
 
 import pytest
+from django.core.management import call_command
+from django.db import connection, transaction
 from django.http import HttpRequest
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from saml2.s_utils import deflate_and_base64_encode
 
+from sso.samlidp.metadata import MetadataRefresher
 from sso.samlidp.models import SamlApplication
 from sso.samlidp.processors import (
     ApplicationPermissionProcessor,
     AWSProcessor,
     ModelProcessor,
 )
+from sso.samlidp.registry import get_application_by_entity_id
 from sso.tests.factories.saml import SamlApplicationFactory
 from sso.tests.factories.user import (
     AccessProfileFactory,
@@ -93,6 +100,38 @@ class TestModelProcessor:
 
         assert not processor.has_access(request)
 
+    def test_has_access_ip_restriction_matches_whole_ip(self, rf):
+        saml_app = SamlApplicationFactory(entity_id="an_entity_id", allowed_ips="11.1.1.10")
+        ap = AccessProfileFactory(saml_apps_list=[saml_app])
+        processor = ModelProcessor("an_entity_id")
+
+        request = rf.get("/whatever/", HTTP_X_FORWARDED_FOR="1.1.1.1, 2.2.2.2, 3.3.3.3")
+        request.user = UserFactory(add_access_profiles=[ap])
+
+        assert not processor.has_access(request)
+
+    def test_has_access_ip_restriction_no_valid_ips(self, rf):
+        saml_app = SamlApplicationFactory(entity_id="an_entity_id", allowed_ips="not-an-ip")
+        ap = AccessProfileFactory(saml_apps_list=[saml_app])
+        processor = ModelProcessor("an_entity_id")
+
+        request = rf.get("/whatever/", HTTP_X_FORWARDED_FOR="1.1.1.1, 2.2.2.2, 3.3.3.3")
+        request.user = UserFactory(add_access_profiles=[ap])
+
+        assert not processor.has_access(request)
+
+    def test_has_access_ip_restriction_valid_ip_range(self, rf):
+        saml_app = SamlApplicationFactory(
+            entity_id="an_entity_id", allowed_ips="8.8.8.8, 1.1.1.0/24"
+        )
+        ap = AccessProfileFactory(saml_apps_list=[saml_app])
+        processor = ModelProcessor("an_entity_id")
+
+        request = rf.get("/whatever/", HTTP_X_FORWARDED_FOR="1.1.1.1, 2.2.2.2, 3.3.3.3")
+        request.user = UserFactory(add_access_profiles=[ap])
+
+        assert processor.has_access(request)
+
     def test_has_access_user_not_in_profile(self, rf):
         SamlApplicationFactory(entity_id="an_entity_id")
         processor = ModelProcessor("an_entity_id")
@@ -236,6 +275,22 @@ class TestModelProcessor:
         assert not user.contact_email
         assert processor.get_user_id(user, None, None, None) == user.email
 
+    def test_identity_plan_is_a_single_query(self, rf, django_assert_num_queries):
+        saml_app = SamlApplicationFactory(entity_id="an_entity_id")
+        aps = AccessProfileFactory.create_batch(3, saml_apps_list=[saml_app])
+        user = UserFactory(add_access_profiles=aps)
+        ServiceEmailAddressFactory(user=user, saml_application=saml_app, email=user.emails.first())
+
+        processor = ModelProcessor("an_entity_id")
+
+        request = rf.get("/whatever/")
+        request.user = user
+
+        with django_assert_num_queries(1):
+            assert processor.has_access(request)
+            assert processor.get_user_id(user, None, None, None) == user.email
+            assert processor.get_service_email(user) == user.email
+
 
 class TestAWSProcessor:
     def test_create_identity_role_is_provided(self, settings):
@@ -307,6 +362,132 @@ class TestApplicationPermissionProcessor:
         assert set(identity["groups"]) == {ap1.permission, ap8.permission}
 
 
+class TestApplicationRegistry:
+    def test_get_application_by_entity_id_is_cached(self, django_assert_num_queries):
+        application = SamlApplicationFactory(entity_id="an_entity_id")
+
+        with django_assert_num_queries(1):
+            assert get_application_by_entity_id("an_entity_id") == application
+            assert ModelProcessor("an_entity_id")._application == application
+
+    @pytest.mark.django_db(transaction=True)
+    def test_saving_application_evicts_cached_entry(self):
+        application = SamlApplicationFactory(entity_id="an_entity_id", active=True)
+
+        assert get_application_by_entity_id("an_entity_id").active
+
+        application.active = False
+        application.save()
+
+        assert not get_application_by_entity_id("an_entity_id").active
+
+    @pytest.mark.django_db(transaction=True)
+    def test_entry_is_evicted_once_the_change_commits(self):
+        application = SamlApplicationFactory(entity_id="an_entity_id", active=True)
+
+        get_application_by_entity_id("an_entity_id")
+
+        with transaction.atomic():
+            application.active = False
+            application.save()
+
+            # other processes still read the previous row until the change commits
+            assert get_application_by_entity_id("an_entity_id").active
+
+        assert not get_application_by_entity_id("an_entity_id").active
+
+    @pytest.mark.django_db(transaction=True)
+    def test_changing_entity_id_evicts_previous_entry(self):
+        application = SamlApplicationFactory(entity_id="an_entity_id")
+
+        get_application_by_entity_id("an_entity_id")
+
+        application.entity_id = "a_new_entity_id"
+        application.save()
+
+        with pytest.raises(SamlApplication.DoesNotExist):
+            get_application_by_entity_id("an_entity_id")
+
+    @pytest.mark.django_db(transaction=True)
+    def test_deleting_application_evicts_cached_entry(self):
+        application = SamlApplicationFactory(entity_id="an_entity_id")
+
+        get_application_by_entity_id("an_entity_id")
+        application.delete()
+
+        with pytest.raises(SamlApplication.DoesNotExist):
+            get_application_by_entity_id("an_entity_id")
+
+
+class TestRefreshSamlMetadata:
+    def test_refreshes_metadata_that_is_due(self, mocker):
+        due = SamlApplicationFactory(remote_metadata_url="https://sp.example.com/metadata/")
+        SamlApplication.objects.filter(pk=due.pk).update(
+            metadata_expiration_dt=timezone.now() + datetime.timedelta(minutes=30)
+        )
+        not_due = SamlApplicationFactory(remote_metadata_url="https://sp2.example.com/metadata/")
+        SamlApplication.objects.filter(pk=not_due.pk).update(
+            metadata_expiration_dt=timezone.now() + datetime.timedelta(days=1)
+        )
+        SamlApplicationFactory(remote_metadata_url="")
+
+        refresh_metadata = mocker.patch.object(
+            SamlApplication, "refresh_metadata", autospec=True, return_value=True
+        )
+        mocker.patch.object(SamlApplication, "save", autospec=True)
+
+        call_command("refresh_saml_metadata")
+
+        assert [args[0].pk for args, _ in refresh_metadata.call_args_list] == [due.pk]
+
+    def test_refresh_saves_only_the_metadata(self, mocker):
+        application = SamlApplicationFactory(remote_metadata_url="https://sp.example.com/metadata/")
+        SamlApplication.objects.filter(pk=application.pk).update(
+            metadata_expiration_dt=timezone.now() - datetime.timedelta(minutes=1)
+        )
+        expires = timezone.now() + datetime.timedelta(days=1)
+
+        def refresh_metadata(self, force_refresh=False):
+            self.local_metadata = "<md:EntityDescriptor/>"
+            self.metadata_expiration_dt = expires
+            return True
+
+        mocker.patch.object(SamlApplication, "refresh_metadata", refresh_metadata)
+        rebuild_application_access = mocker.patch("sso.user.signals.rebuild_application_access")
+
+        call_command("refresh_saml_metadata")
+
+        application.refresh_from_db()
+        assert application.local_metadata == "<md:EntityDescriptor/>"
+        assert application.metadata_expiration_dt == expires
+        assert not rebuild_application_access.called
+
+    def test_refresher_thread(self, mocker, settings):
+        settings.SAML_METADATA_REFRESH_INTERVAL = 0.01
+        refreshed = threading.Event()
+        refresh_due_metadata = mocker.patch(
+            "sso.samlidp.metadata.refresh_due_metadata",
+            side_effect=lambda: refreshed.set() or ([], []),
+        )
+        refresher = MetadataRefresher()
+
+        refresher.start()
+        try:
+            assert refreshed.wait(5)
+        finally:
+            refresher.stop()
+
+        assert refresh_due_metadata.called
+
+    def test_refresher_thread_is_disabled(self, settings):
+        settings.SAML_METADATA_REFRESH_INTERVAL = 0
+        refresher = MetadataRefresher()
+
+        refresher.start()
+
+        assert refresher._thread is None
+
+
 class TestIdpInitiatedLogin:
     def test_alias_entry(self, client, settings):
 
@@ -424,3 +605,42 @@ class TestSpInitiatedLogin:
 
         assert response.status_code == 200
         assert b'<form method="post" action="https://testing.com/saml2/acs/">' in response.content
+
+    def test_query_count_does_not_depend_on_access_profiles(self, client):
+        saml_app = SamlApplicationFactory(
+            entity_id="http://testsp/saml2/metadata/",
+            _processor="sso.samlidp.processors.ApplicationPermissionProcessor",
+        )
+
+        def login_queries(access_profile_count):
+            access_profiles = AccessProfileFactory.create_batch(
+                access_profile_count, saml_apps_list=[saml_app]
+            )
+            user = UserFactory(
+                add_access_profiles=access_profiles,
+                application_permission_list=ApplicationPermissionFactory.create_batch(
+                    access_profile_count, saml2_application=saml_app
+                ),
+            )
+            client.force_login(user)
+
+            session = client.session
+            session.update(
+                {
+                    "Binding": "urn:oasis:names:tc:SAML:2.0:bindings:HTTP-Redirect",
+                    "SAMLRequest": saml_request(),
+                    "RelayState": "",
+                }
+            )
+            session.save()
+
+            with CaptureQueriesContext(connection) as queries:
+                response = client.get(reverse("djangosaml2idp:saml_login_process"))
+
+            assert response.status_code == 200
+            return len(queries)
+
+        # the first login fills the application caches
+        login_queries(1)
+
+        assert login_queries(1) == login_queries(5)
@@ -0,0 +1,101 @@
+import datetime
+
+import pytest
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.core.management import call_command
+from django.utils import timezone
+from freezegun import freeze_time
+
+from sso.core.sessions import SessionStore
+
+pytestmark = [pytest.mark.django_db]
+
+
+@pytest.fixture
+def session_key():
+    session = SessionStore()
+    session["user"] = "test"
+    session.save()
+
+    return session.session_key
+
+
+class TestSessionStore:
+    def test_unchanged_session_is_not_saved_within_tolerance(
+        self, session_key, settings, django_assert_num_queries
+    ):
+        settings.SESSION_SAVE_TOLERANCE = 300
+        expire_date = Session.objects.get().expire_date
+
+        with django_assert_num_queries(0):
+            session = SessionStore(session_key)
+            assert session["user"] == "test"
+            session.save()
+
+        assert Session.objects.get().expire_date == expire_date
+
+    def test_unchanged_session_is_saved_outside_tolerance(self, session_key, settings):
+        settings.SESSION_SAVE_TOLERANCE = 300
+        expire_date = Session.objects.get().expire_date
+
+        with freeze_time(timezone.now() + datetime.timedelta(seconds=301)):
+            SessionStore(session_key).save()
+
+        assert Session.objects.get().expire_date > expire_date
+
+    def test_changed_session_is_saved(self, session_key):
+        session = SessionStore(session_key)
+        session["user"] = "changed"
+        session.save()
+
+        assert SessionStore(session_key)["user"] == "changed"
+        assert SessionStore().decode(Session.objects.get().session_data)["user"] == "changed"
+
+    def test_session_is_loaded_from_database_when_not_cached(self, session_key, settings):
+        caches[settings.SESSION_CACHE_ALIAS].clear()
+
+        assert SessionStore(session_key)["user"] == "test"
+
+    def test_deleted_session_is_not_loaded(self, session_key):
+        SessionStore(session_key).delete()
+
+        assert SessionStore(session_key).load() == {}
+
+    def test_flushed_session_is_not_loaded_by_another_store(self, redis_caches, settings):
+        session = SessionStore()
+        session["user"] = "test"
+        session.save()
+
+        # loaded by another process, so it's in the shared cache
+        assert SessionStore(session.session_key)["user"] == "test"
+
+        session_key = session.session_key
+        session.flush()
+
+        assert SessionStore(session_key).load() == {}
+
+        # and with a cold cache, the session isn't in the database either
+        caches[settings.SESSION_CACHE_ALIAS].clear()
+
+        assert SessionStore(session_key).load() == {}
+
+
+def test_local_sessions_cache_uses_the_db_engine(settings):
+    """The tests' caches are locmem, so sessions must not be read from them"""
+    assert settings.CACHES[settings.SESSION_CACHE_ALIAS]["BACKEND"].endswith("LocMemCache")
+    assert settings.SESSION_ENGINE == "django.contrib.sessions.backends.db"
+
+
+def test_clearsessions_deletes_expired_sessions_in_batches(settings):
+    settings.SESSION_CLEAR_BATCH_SIZE = 2
+
+    for expiry in [-10, -10, -10, -10, -10, 3600]:
+        session = SessionStore()
+        session["user"] = "test"
+        session.set_expiry(expiry)
+        session.save()
+
+    call_command("clearsessions")
+
+    assert Session.objects.count() == 1
@@ -2,12 +2,15 @@ import datetime
 from unittest import mock
 
 import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.http import HttpRequest
 from django.utils import timezone
 from freezegun import freeze_time
 
+from sso.user.last_accessed import LastAccessedBuffer
 from sso.user.middleware import UpdatedLastAccessedMiddleware
-from sso.user.models import AccessProfile, User
+from sso.user.models import AccessProfile, ApplicationAccess, User
 
 from .factories.oauth import ApplicationFactory
 from .factories.saml import SamlApplicationFactory
@@ -498,6 +501,18 @@ class TestUser:
         assert user.emails.count() == 2
         assert user.emails.last().email == "upper@case.com"
 
+    def test_email_domain_is_set_on_save(self):
+        user = UserFactory(email="test@Trade.gov.uk")
+        email = user.emails.create(email="other@Digital.Trade.gov.uk")
+
+        assert user.emails.get(email="test@trade.gov.uk").domain == "trade.gov.uk"
+        assert email.domain == "digital.trade.gov.uk"
+
+        email.email = "other@example.com"
+        email.save(update_fields=["email"])
+
+        assert user.emails.get(email="other@example.com").domain == "example.com"
+
     @freeze_time("2017-06-22 15:50:00.000000+00:00")
     def test_user_last_accessed_field_updates(self, rf, mocker):
 
@@ -528,6 +543,75 @@ class TestUser:
             tz=datetime.timezone.utc
         )
 
+    def test_user_last_accessed_not_updated_within_resolution(self, rf, mocker, settings):
+        settings.LAST_ACCESSED_RESOLUTION = 300
+        user = UserFactory(email="goblin@example.com")
+        middleware = UpdatedLastAccessedMiddleware(get_response=mocker.MagicMock())
+
+        request = rf.get("/")
+        request.user = user
+
+        with freeze_time("2017-06-22 15:50:00"):
+            middleware(request)
+
+        with freeze_time("2017-06-22 15:54:59"):
+            middleware(request)
+
+        assert User.objects.get(pk=user.pk).last_accessed == datetime.datetime(
+            2017, 6, 22, 15, 50, tzinfo=datetime.timezone.utc
+        )
+
+        with freeze_time("2017-06-22 15:55:00"):
+            middleware(request)
+
+        assert User.objects.get(pk=user.pk).last_accessed == datetime.datetime(
+            2017, 6, 22, 15, 55, tzinfo=datetime.timezone.utc
+        )
+
+    def test_user_last_accessed_write_behind(self, rf, mocker, settings):
+        settings.LAST_ACCESSED_WRITE_BEHIND = True
+        settings.LAST_ACCESSED_FLUSH_INTERVAL = 0
+        settings.LAST_ACCESSED_RESOLUTION = 0
+        buffer = mocker.patch("sso.user.middleware.buffer", LastAccessedBuffer())
+
+        users = [UserFactory(), UserFactory()]
+        middleware = UpdatedLastAccessedMiddleware(get_response=mocker.MagicMock())
+
+        for minute, user in [(50, users[0]), (51, users[1]), (52, users[0])]:
+            request = rf.get("/")
+            request.user = user
+            with freeze_time(f"2017-06-22 15:{minute}:00"):
+                middleware(request)
+
+        assert User.objects.filter(last_accessed__isnull=False).count() == 0
+        assert len(buffer) == 2
+
+        assert buffer.flush() == 2
+
+        assert User.objects.get(pk=users[0].pk).last_accessed == datetime.datetime(
+            2017, 6, 22, 15, 52, tzinfo=datetime.timezone.utc
+        )
+        assert User.objects.get(pk=users[1].pk).last_accessed == datetime.datetime(
+            2017, 6, 22, 15, 51, tzinfo=datetime.timezone.utc
+        )
+        assert buffer.stats == {"buffered": 3, "flushed": 2, "skipped": 0}
+        assert buffer.flush() == 0
+
+    def test_last_accessed_buffer_flushes_in_one_update(
+        self, django_assert_max_num_queries, settings
+    ):
+        settings.LAST_ACCESSED_FLUSH_INTERVAL = 0
+        buffer = LastAccessedBuffer()
+
+        for user in [UserFactory() for _ in range(5)]:
+            buffer.record(user.pk, timezone.now())
+
+        # bulk_update wraps the update in a savepoint
+        with django_assert_max_num_queries(3) as captured:
+            assert buffer.flush() == 5
+
+        assert [q["sql"].split()[0] for q in captured.captured_queries].count("UPDATE") == 1
+
     def test_email_user_id_is_created_on_save(self, settings):
         user = User()
         user.email = "test@test.com"
@@ -564,6 +648,124 @@ class TestUser:
         assert set(user.get_extra_emails()) == set(["email1@test.com", "email2@test.com"])
 
 
+class TestApplicationAccessIndex:
+    def test_can_access_is_a_single_query(self, django_assert_num_queries):
+        app = ApplicationFactory()
+        user = UserFactory(add_permitted_applications=[app])
+
+        with django_assert_num_queries(1):
+            assert user.can_access(app)
+
+    def test_email_login_does_not_rebuild_access(self, django_assert_num_queries):
+        app = SamlApplicationFactory(allow_access_by_email_suffix="testing.com")
+        user = UserFactory(email="hello@testing.com")
+
+        # loading the email and saving its last login
+        with django_assert_num_queries(2):
+            User.objects.set_email_last_login_time("hello@testing.com")
+
+        assert user.can_access(app)
+
+    def test_removing_email_revokes_access(self):
+        app = SamlApplicationFactory(allow_access_by_email_suffix="testing.com")
+        user = UserFactory(email="primary@example.com", email_list=["alias@testing.com"])
+
+        assert user.can_access(app)
+
+        user.emails.get(email="alias@testing.com").delete()
+
+        assert not user.can_access(app)
+
+    def test_changing_email_suffix_updates_access(self):
+        app = ApplicationFactory(allow_access_by_email_suffix="testing.com")
+        user = UserFactory(email="hello@testing.com")
+
+        assert user.can_access(app)
+
+        app.allow_access_by_email_suffix = "other.com"
+        app.save()
+
+        assert not user.can_access(app)
+
+    def test_removing_application_from_access_profile_revokes_access(self):
+        app = ApplicationFactory()
+        ap = AccessProfile.objects.create(name="test profile")
+        ap.oauth2_applications.add(app)
+        user = UserFactory(add_access_profiles=[ap])
+
+        assert user.can_access(app)
+
+        ap.oauth2_applications.clear()
+
+        assert not user.can_access(app)
+
+    def test_deleting_access_profile_revokes_access(self):
+        app = SamlApplicationFactory()
+        ap = AccessProfile.objects.create(name="test profile")
+        ap.saml2_applications.add(app)
+        user = UserFactory(add_access_profiles=[ap])
+
+        assert user.can_access(app)
+
+        ap.delete()
+
+        assert not user.can_access(app)
+
+    def test_deactivating_saml_application_revokes_profile_access(self):
+        app = SamlApplicationFactory()
+        ap = AccessProfile.objects.create(name="test profile")
+        ap.saml2_applications.add(app)
+        user = UserFactory(add_access_profiles=[ap])
+
+        app.active = False
+        app.save()
+
+        assert not user.can_access(app)
+
+    def test_removing_user_from_application_revokes_access(self):
+        user = UserFactory()
+        app = ApplicationFactory(users=[user])
+
+        assert user.can_access(app)
+
+        app.users.remove(user)
+
+        assert not user.can_access(app)
+
+    def test_deleting_user_removes_index_rows(self):
+        app = ApplicationFactory(allow_access_by_email_suffix="testing.com")
+        user = UserFactory(email="hello@testing.com", add_permitted_applications=[app])
+
+        user.delete()
+
+        assert not ApplicationAccess.objects.exists()
+
+    def test_verify_command_reports_out_of_sync_index(self):
+        app = ApplicationFactory()
+        user = UserFactory(add_permitted_applications=[app])
+
+        ApplicationAccess.objects.all().delete()
+
+        with pytest.raises(CommandError):
+            call_command("access_index", "verify")
+
+        assert not user.can_access(app)
+
+    def test_rebuild_command_repairs_index(self):
+        app = ApplicationFactory()
+        user = UserFactory(add_permitted_applications=[app])
+        other_user = UserFactory()
+
+        ApplicationAccess.objects.all().delete()
+        ApplicationAccess.objects.create(user=other_user, oauth2_application=app)
+
+        call_command("access_index", "rebuild")
+
+        assert user.can_access(app)
+        assert not other_user.can_access(app)
+        call_command("access_index", "verify")
+
+
 class TestAccessProfile:
     def test_is_allowed_true(self):
         app = ApplicationFactory()
@@ -725,3 +927,30 @@ class TestAccessProfile:
         permitted_apps = user.get_permitted_applications()
 
         assert ["A", "B", "C", "D", "E"] == [app["name"] for app in permitted_apps]
+
+    @pytest.mark.parametrize("include_non_public", [True, False])
+    def test_get_permitted_applications_by_user(
+        self, include_non_public, django_assert_num_queries
+    ):
+        ap = AccessProfile.objects.create()
+        ap.oauth2_applications.add(ApplicationFactory(display_name="C", public=True))
+        ap.saml2_applications.add(SamlApplicationFactory(pretty_name="B", public=False))
+        direct_app = ApplicationFactory(display_name="A", public=True)
+        ApplicationFactory(display_name="D", default_access_allowed=True, public=False)
+
+        users = [
+            UserFactory(add_access_profiles=[ap], add_permitted_applications=[direct_app]),
+            UserFactory(add_permitted_applications=[direct_app]),
+            UserFactory(),
+        ]
+
+        # the default access applications, then the users' applications
+        with django_assert_num_queries(2):
+            permitted_applications = User.objects.get_permitted_applications_by_user(
+                [user.pk for user in users], include_non_public=include_non_public
+            )
+
+        assert permitted_applications == {
+            user.pk: user.get_permitted_applications(include_non_public=include_non_public)
+            for user in users
+        }
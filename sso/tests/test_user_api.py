@@ -1,10 +1,12 @@
 from datetime import timedelta
 
 import pytest
+from django.db.models import Q
 from django.urls import reverse_lazy
 from django.utils import timezone
 
 from sso.oauth2.models import Application
+from sso.user.models import User
 
 from .factories.oauth import AccessTokenFactory, ApplicationFactory
 from .factories.saml import SamlApplicationFactory
@@ -13,6 +15,19 @@ from .factories.user import AccessProfileFactory, GroupFactory, UserFactory
 pytestmark = [pytest.mark.django_db]
 
 
+def add_access_graph(user, size=3):
+    """Give a user several emails, permitted applications and access profiles"""
+    for i in range(size):
+        user.emails.create(email=f"user{i}@alias.com")
+        user.permitted_applications.add(ApplicationFactory())
+        user.access_profiles.add(
+            AccessProfileFactory(
+                oauth_apps_list=[ApplicationFactory()],
+                saml_apps_list=[SamlApplicationFactory()],
+            )
+        )
+
+
 def get_oauth_token(expires=None, user=None, scope="read"):
 
     if not user:
@@ -71,6 +86,21 @@ class TestAPIGetUserMe:
             "access_profiles": [],
         }
 
+    @pytest.mark.parametrize("size", [1, 5])
+    def test_query_count(self, api_client, django_assert_num_queries, size):
+        user, token = get_oauth_token()
+        add_access_graph(user, size)
+
+        api_client.credentials(HTTP_AUTHORIZATION="Bearer " + token)
+
+        # the access token, the user's emails, permitted applications, access profiles and
+        # their oauth2 and saml2 applications, then the default access applications
+        with django_assert_num_queries(7):
+            response = api_client.get(self.GET_USER_ME_URL)
+
+        assert response.status_code == 200
+        assert len(response.json()["permitted_applications"]) == 1 + 3 * size
+
     def test_fails_with_invalid_token(self, api_client):
         """
         Test that with a invalid token you cannot get the details of the logged in user.
@@ -286,6 +316,20 @@ class TestApiUserIntrospect:
             "access_profiles": [],
         }
 
+    @pytest.mark.parametrize("size", [1, 5])
+    def test_query_count(self, api_client, django_assert_num_queries, size):
+        user, token = get_oauth_token(scope="introspection")
+        add_access_graph(user, size)
+
+        api_client.credentials(HTTP_AUTHORIZATION="Bearer " + token)
+
+        # the access token and the user, then the same queries as /me
+        with django_assert_num_queries(8):
+            response = api_client.get(self.GET_USER_INTROSPECT_URL + "?email=user1@example.com")
+
+        assert response.status_code == 200
+        assert len(response.json()["access_profiles"]) == size
+
     def test_with_valid_token_and_email_alias(self, api_client):
         user, token = get_oauth_token(scope="introspection")
 
@@ -620,6 +664,175 @@ class TestAPISearchUsers:
         assert response.status_code == 200
         assert response.data["count"] == expected_results
 
+    @pytest.mark.parametrize("search_mode", ("regex", "fulltext"))
+    @pytest.mark.parametrize(
+        "autocomplete, expected_results",
+        (
+            ("john", 1),
+            ("first", 2),
+            ("first2 last2", 1),
+            ("Last2 First2", 1),
+            ("las", 2),
+            ("irst", 0),
+            ("  ", 3),
+        ),
+    )
+    def test_autocomplete_filter_search_modes(
+        self, api_client, settings, setup_users, search_mode, autocomplete, expected_results
+    ):
+        settings.USER_SEARCH_MODE = search_mode
+        search_user, token = setup_users
+
+        api_client.credentials(HTTP_AUTHORIZATION="Bearer " + token)
+        response = api_client.get(self.GET_USER_SEARCH_URL, {"autocomplete": autocomplete})
+
+        assert response.status_code == 200
+        assert response.data["count"] == expected_results
+
+    @pytest.mark.parametrize("search_mode, expected_results", (("regex", 0), ("fulltext", 1)))
+    def test_autocomplete_filter_matches_email_in_full_text_mode(
+        self, api_client, settings, search_mode, expected_results
+    ):
+        settings.USER_SEARCH_MODE = search_mode
+        search_user, def_oauth_app, token = self.setup_search_user()
+        UserFactory(email="jane.roe-smith@example.com", first_name="Jane", last_name="Roe")
+
+        api_client.credentials(HTTP_AUTHORIZATION="Bearer " + token)
+        response = api_client.get(self.GET_USER_SEARCH_URL, {"autocomplete": "smi"})
+
+        assert response.status_code == 200
+        assert response.data["count"] == expected_results
+
+    @pytest.mark.parametrize(
+        "search_mode, expected_order",
+        (("regex", ["Alice", "Bob"]), ("fulltext", ["Bob", "Alice"])),
+    )
+    def test_autocomplete_filter_ranks_exact_matches_first_in_full_text_mode(
+        self, api_client, settings, search_mode, expected_order
+    ):
+        settings.USER_SEARCH_MODE = search_mode
+        search_user, def_oauth_app, token = self.setup_search_user()
+        UserFactory(email="alice@example.com", first_name="Alice", last_name="Hartley")
+        UserFactory(email="bob@example.com", first_name="Bob", last_name="Hart")
+
+        api_client.credentials(HTTP_AUTHORIZATION="Bearer " + token)
+        response = api_client.get(self.GET_USER_SEARCH_URL, {"autocomplete": "hart"})
+
+        assert response.status_code == 200
+        assert [user["first_name"] for user in response.json()["results"]] == expected_order
+
+    def test_cursor_pagination(self, api_client):
+        search_user, def_oauth_app, token = self.setup_search_user()
+        for first_name in ["Carol", "Alice", "Dave", "Bob", "Alice"]:
+            UserFactory(first_name=first_name, last_name="Smith")
+
+        api_client.credentials(HTTP_AUTHORIZATION="Bearer " + token)
+        expected = [
+            user["user_id"] for user in api_client.get(self.GET_USER_SEARCH_URL).data["results"]
+        ]
+
+        url = self.GET_USER_SEARCH_URL + "?pagination=cursor&page_size=2"
+        user_ids = []
+        while url:
+            response = api_client.get(url)
+
+            assert response.status_code == 200
+            assert "count" not in response.data
+            user_ids.extend(user["user_id"] for user in response.data["results"])
+            url = response.data["next"]
+
+        assert len(expected) == 6
+        assert user_ids == expected
+
+    def test_cursor_pagination_follows_autocomplete_ranking(self, api_client, settings):
+        settings.USER_SEARCH_MODE = "fulltext"
+        search_user, def_oauth_app, token = self.setup_search_user()
+        UserFactory(email="alice@example.com", first_name="Alice", last_name="Hartley")
+        UserFactory(email="bob@example.com", first_name="Bob", last_name="Hart")
+        UserFactory(email="carol@example.com", first_name="Carol", last_name="Hart")
+
+        api_client.credentials(HTTP_AUTHORIZATION="Bearer " + token)
+        response = api_client.get(
+            self.GET_USER_SEARCH_URL,
+            {"autocomplete": "hart", "pagination": "cursor", "page_size": 2},
+        )
+        first_names = [user["first_name"] for user in response.data["results"]]
+        response = api_client.get(response.data["next"])
+        first_names += [user["first_name"] for user in response.data["results"]]
+
+        assert first_names == ["Bob", "Carol", "Alice"]
+        assert response.data["next"] is None
+
+    def test_cursor_pagination_keeps_tied_ranks(self, api_client, settings):
+        settings.USER_SEARCH_MODE = "fulltext"
+        search_user, def_oauth_app, token = self.setup_search_user()
+        for letter in "abcde":
+            UserFactory(email=f"person.{letter}@example.com", first_name="Ann", last_name="Hart")
+        UserFactory(email="bob@example.com", first_name="Bob", last_name="Hartley")
+
+        api_client.credentials(HTTP_AUTHORIZATION="Bearer " + token)
+        expected = [
+            user["user_id"]
+            for user in api_client.get(self.GET_USER_SEARCH_URL, {"autocomplete": "hart"}).data[
+                "results"
+            ]
+        ]
+
+        url = self.GET_USER_SEARCH_URL + "?autocomplete=hart&pagination=cursor&page_size=2"
+        user_ids = []
+        while url and len(user_ids) <= len(expected):
+            response = api_client.get(url)
+            user_ids.extend(user["user_id"] for user in response.data["results"])
+            url = response.data["next"]
+
+        assert len(expected) == 6
+        assert user_ids == expected
+
+    def test_invalid_cursor(self, api_client):
+        search_user, def_oauth_app, token = self.setup_search_user()
+
+        api_client.credentials(HTTP_AUTHORIZATION="Bearer " + token)
+        response = api_client.get(
+            self.GET_USER_SEARCH_URL, {"pagination": "cursor", "cursor": "not-a-cursor"}
+        )
+
+        assert response.status_code == 404
+
+    def test_fields(self, api_client):
+        search_user, def_oauth_app, token = self.setup_search_user()
+
+        api_client.credentials(HTTP_AUTHORIZATION="Bearer " + token)
+        response = api_client.get(self.GET_USER_SEARCH_URL, {"fields": "user_id, first_name"})
+
+        assert response.status_code == 200
+        assert response.json()["results"] == [
+            {"user_id": str(search_user.user_id), "first_name": "John"}
+        ]
+
+    @pytest.mark.parametrize("fields", ["", "user_id,password"])
+    def test_invalid_fields(self, api_client, fields):
+        search_user, def_oauth_app, token = self.setup_search_user()
+
+        api_client.credentials(HTTP_AUTHORIZATION="Bearer " + token)
+        response = api_client.get(self.GET_USER_SEARCH_URL, {"fields": fields})
+
+        assert response.status_code == 400
+
+    @pytest.mark.parametrize("pagination, queries", [("offset", 4), ("cursor", 3)])
+    @pytest.mark.parametrize("size", [1, 5])
+    def test_query_count(self, api_client, django_assert_num_queries, pagination, queries, size):
+        search_user, def_oauth_app, token = self.setup_search_user()
+        UserFactory.create_batch(size)
+
+        api_client.credentials(HTTP_AUTHORIZATION="Bearer " + token)
+
+        # the access token, then the offset pagination count, the page of users and their emails
+        with django_assert_num_queries(queries):
+            response = api_client.get(self.GET_USER_SEARCH_URL, {"pagination": pagination})
+
+        assert response.status_code == 200
+        assert len(response.data["results"]) == 1 + size
+
     @pytest.mark.parametrize(
         "default_access_allowed, expected_results",
         ((True, 3), (False, 1)),
@@ -660,6 +873,49 @@ class TestAPISearchUsers:
         assert response.status_code == 200
         assert response.data["count"] == expected_results
 
+    def test_access_filter_matches_joined_query(self, api_client):
+        """
+        The access filter finds the same users as joining each kind of access and deduplicating,
+        and matches email domains exactly, as `User.can_access` does
+        """
+        application = ApplicationFactory(allow_access_by_email_suffix="aaa.com, bbb.com")
+        profile = AccessProfileFactory(oauth_apps_list=[application])
+        search_user = UserFactory(email="one@aaa.com", email_list=["one@bbb.com"])
+        UserFactory(
+            email="two@ccc.com",
+            add_permitted_applications=[application],
+            add_access_profiles=[profile],
+        )
+        UserFactory(
+            email="three@ccc.com",
+            add_access_profiles=[profile, AccessProfileFactory(oauth_apps_list=[application])],
+        )
+        UserFactory(email="four@sub.aaa.com")
+        UserFactory(email="five@ccc.com")
+        UserFactory(email="six@ccc.com", add_permitted_applications=[ApplicationFactory()])
+        access_token = AccessTokenFactory(
+            application=application,
+            user=search_user,
+            expires=(timezone.now() + timedelta(days=1)),
+            scope="search",
+        )
+
+        joined = (
+            User.objects.filter(permitted_applications=application)
+            | User.objects.filter(access_profiles__oauth2_applications=application)
+            | User.objects.filter(Q(emails__domain="aaa.com") | Q(emails__domain="bbb.com"))
+        ).distinct()
+
+        api_client.credentials(HTTP_AUTHORIZATION="Bearer " + access_token.token)
+        response = api_client.get(self.GET_USER_SEARCH_URL, {"fields": "user_id"})
+
+        assert response.status_code == 200
+        assert response.data["count"] == 3
+        assert sorted(user["user_id"] for user in response.data["results"]) == sorted(
+            str(user.user_id) for user in joined
+        )
+        assert all(user.can_access(application) for user in joined)
+
     def test_list_all_users_access_profile(self, api_client):
         """
         searching with an app that has default_access_allowed False
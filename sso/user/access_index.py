@@ -0,0 +1,192 @@
+"""
+Maintains the `ApplicationAccess` index that backs `User.can_access`.
+
+A user is granted access to an application when:
+
+  - one of their email domains is in the application's `allow_access_by_email_suffix` list
+  - the application is in their `permitted_applications` (OAuth2 only)
+  - one of their access profiles includes the application (SAML2 applications must be active)
+
+The index can be rebuilt for a single user or a single application; both compute the expected
+set of rows from the source tables and apply the difference.
+"""
+import logging
+
+from sso.core.policy import compile_email_domains
+from sso.oauth2.models import Application as OAuthApplication
+from sso.samlidp.models import SamlApplication
+from .models import ApplicationAccess, EmailAddress, User
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+
+
+def get_allowed_email_domains(application):
+    """
+    Return the frozenset of email domains in the application's `allow_access_by_email_suffix`
+    list
+    """
+    return compile_email_domains(application.allow_access_by_email_suffix)
+
+
+def _application_field(application):
+    if isinstance(application, OAuthApplication):
+        return "oauth2_application"
+    return "saml2_application"
+
+
+def _email_suffix_applications(model, domains):
+    return {
+        app.pk
+        for app in model.objects.exclude(allow_access_by_email_suffix__isnull=True)
+        .exclude(allow_access_by_email_suffix="")
+        .only("pk", "allow_access_by_email_suffix")
+        if not get_allowed_email_domains(app).isdisjoint(domains)
+    }
+
+
+def expected_user_access(user):
+    """
+    Return a tuple `(oauth2_application_ids, saml2_application_ids)` of the applications the
+    user should be granted access to.
+    """
+
+    domains = set(EmailAddress.objects.filter(user_id=user.pk).values_list("domain", flat=True))
+
+    oauth2_ids = _email_suffix_applications(OAuthApplication, domains)
+    oauth2_ids.update(OAuthApplication.objects.filter(users=user.pk).values_list("pk", flat=True))
+    oauth2_ids.update(
+        OAuthApplication.objects.filter(accessprofile__users=user.pk).values_list("pk", flat=True)
+    )
+
+    saml2_ids = _email_suffix_applications(SamlApplication, domains)
+    saml2_ids.update(
+        SamlApplication.objects.filter(accessprofile__users=user.pk, active=True).values_list(
+            "pk", flat=True
+        )
+    )
+
+    return oauth2_ids, saml2_ids
+
+
+def expected_application_access(application):
+    """Return the set of user ids that should be granted access to the application"""
+
+    domains = get_allowed_email_domains(application)
+    user_ids = set()
+
+    if domains:
+        user_ids.update(
+            EmailAddress.objects.filter(domain__in=domains).values_list("user_id", flat=True)
+        )
+
+    if isinstance(application, OAuthApplication):
+        user_ids.update(application.users.values_list("pk", flat=True))
+        user_ids.update(
+            User.objects.filter(access_profiles__oauth2_applications=application).values_list(
+                "pk", flat=True
+            )
+        )
+    elif application.active:
+        user_ids.update(
+            User.objects.filter(access_profiles__saml2_applications=application).values_list(
+                "pk", flat=True
+            )
+        )
+
+    return user_ids
+
+
+def _sync(queryset, id_field, expected_ids, build_row, prune_only=False):
+    """
+    Delete index rows in `queryset` not in `expected_ids` and create the missing ones.
+
+    Returns a tuple `(missing, stale)` of the ids that were (or, in prune only mode, would be)
+    added and removed.
+    """
+    existing_ids = set(queryset.values_list(id_field, flat=True))
+
+    missing = expected_ids - existing_ids
+    stale = existing_ids - expected_ids
+
+    if stale:
+        queryset.filter(**{f"{id_field}__in": stale}).delete()
+
+    if missing and not prune_only:
+        ApplicationAccess.objects.bulk_create(
+            [build_row(pk) for pk in missing], batch_size=BATCH_SIZE, ignore_conflicts=True
+        )
+
+    return missing, stale
+
+
+def rebuild_user_access(user, prune_only=False):
+    """
+    Rebuild the index rows for a single user.
+
+    `prune_only` only removes rows; it is used when the user may be in the process of being
+    deleted, where inserting rows would violate the foreign key once the user is removed.
+    """
+    oauth2_ids, saml2_ids = expected_user_access(user)
+    user_access = ApplicationAccess.objects.filter(user_id=user.pk)
+
+    _sync(
+        user_access.filter(oauth2_application__isnull=False),
+        "oauth2_application_id",
+        oauth2_ids,
+        lambda pk: ApplicationAccess(user_id=user.pk, oauth2_application_id=pk),
+        prune_only=prune_only,
+    )
+    _sync(
+        user_access.filter(saml2_application__isnull=False),
+        "saml2_application_id",
+        saml2_ids,
+        lambda pk: ApplicationAccess(user_id=user.pk, saml2_application_id=pk),
+        prune_only=prune_only,
+    )
+
+
+def rebuild_application_access(application, dry_run=False):
+    """
+    Rebuild the index rows for a single application.
+
+    Returns a tuple `(missing, stale)` of the user ids that were out of sync. If `dry_run`
+    is True the index is not modified.
+    """
+    field = _application_field(application)
+    queryset = ApplicationAccess.objects.filter(**{field: application})
+    expected_ids = expected_application_access(application)
+
+    if dry_run:
+        existing_ids = set(queryset.values_list("user_id", flat=True))
+        return expected_ids - existing_ids, existing_ids - expected_ids
+
+    return _sync(
+        queryset,
+        "user_id",
+        expected_ids,
+        lambda pk: ApplicationAccess(user_id=pk, **{field: application}),
+    )
+
+
+def rebuild_access_profile_users(profile):
+    """Rebuild the index for every user that has been assigned an access profile"""
+
+    for user in profile.users.only("pk"):
+        rebuild_user_access(user)
+
+
+def rebuild_access_profile_applications(profile):
+    """Rebuild the index for every application included in an access profile"""
+
+    for application in profile.oauth2_applications.all():
+        rebuild_application_access(application)
+
+    for application in profile.saml2_applications.all():
+        rebuild_application_access(application)
+
+
+def all_applications():
+    yield from OAuthApplication.objects.all()
+    yield from SamlApplication.objects.all()
@@ -2,6 +2,7 @@ from django import forms
 from django.contrib import admin, messages
 from django.contrib.admin import helpers
 from django.core.exceptions import PermissionDenied
+from django.db.models import prefetch_related_objects
 
 from django.forms import ModelForm
 from django.forms.widgets import CheckboxSelectMultiple
@@ -15,7 +16,8 @@ from django.utils.translation import gettext as _
 from oauth2_provider.admin import ApplicationAdmin as OAuth2ApplicationAdmin
 
 from sso.oauth2.models import Application
-from .filter import ApplicationFilter
+from .access_index import rebuild_user_access
+from .filter import ApplicationFilter, EmailDomainFilter
 from .models import AccessProfile, ApplicationPermission, EmailAddress, ServiceEmailAddress, User
 
 
@@ -90,7 +92,13 @@ class UserAdmin(admin.ModelAdmin):
         "user_id",
         "email_user_id",
     )
-    list_filter = (ApplicationFilter, "access_profiles__name", "is_superuser", "is_active")
+    list_filter = (
+        ApplicationFilter,
+        EmailDomainFilter,
+        "access_profiles__name",
+        "is_superuser",
+        "is_active",
+    )
     fields = (
         "email_user_id",
         "user_id",
@@ -146,18 +154,29 @@ class UserAdmin(admin.ModelAdmin):
             fields += ("is_staff", "is_superuser", "groups", "user_permissions")
         return fields
 
+    def get_changelist_instance(self, request):
+        """
+        Prefetch the emails, permitted applications and access profiles listed for a page of users
+        at once
+        """
+        changelist = super().get_changelist_instance(request)
+        prefetch_related_objects(
+            changelist.result_list, "emails", "permitted_applications", "access_profiles"
+        )
+        return changelist
+
     def list_permitted_applications(self, obj):
-        return ", ".join(obj.permitted_applications.all().values_list("name", flat=True))
+        return ", ".join(application.name for application in obj.permitted_applications.all())
 
     list_permitted_applications.short_description = "permitted applications"
 
     def list_access_profiles(self, obj):
-        return ", ".join(obj.access_profiles.all().values_list("name", flat=True))
+        return ", ".join(access_profile.name for access_profile in obj.access_profiles.all())
 
     list_access_profiles.short_description = "access profiles"
 
     def email_list(self, obj):
-        return ", ".join(obj.emails.all().values_list("email", flat=True))
+        return ", ".join(email.email for email in obj.emails.all())
 
     def show_permissions_link(self, obj):
         return mark_safe(
@@ -229,6 +248,9 @@ class UserAdmin(admin.ModelAdmin):
                 for email in all_emails - primary_emails:
                     primary_obj.emails.add(email)
 
+                # emails are moved with a bulk update which bypasses the access index signals
+                rebuild_user_access(primary_obj)
+
                 # delete the merged users
                 for obj in queryset:
                     if obj.pk != primary_obj_id:
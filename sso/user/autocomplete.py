@@ -2,9 +2,48 @@ import re
 from functools import reduce
 from operator import or_
 
-from django.db.models import Q
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVectorField
+from django.db.models import DecimalField, Expression, F, Q
+from django.db.models.functions import Cast
 from django_filters import CharFilter
 
+FULL_TEXT = "fulltext"
+
+# Must match the expression of the `user_user_search_idx` index, so that the index is used.
+# Names are weighted above the local part of the email address, in which dots, underscores and
+# hyphens separate words. The columns are NOT NULL, so they don't need to be coalesced.
+USER_SEARCH_DOCUMENT_SQL = (
+    "(setweight(to_tsvector('simple'::regconfig, {first_name} || ' ' || {last_name}), 'A') || "
+    "setweight(to_tsvector('simple'::regconfig, "
+    "translate(split_part({email}, '@', 1), '._-', '   ')), 'B'))"
+)
+
+
+class UserSearchDocument(Expression):
+    """The full text search document of a user, as indexed by `user_user_search_idx`"""
+
+    output_field = SearchVectorField()
+
+    def __init__(self):
+        super().__init__()
+        self.columns = [F("first_name"), F("last_name"), F("email")]
+
+    def get_source_expressions(self):
+        return self.columns
+
+    def set_source_expressions(self, exprs):
+        self.columns = exprs
+
+    def as_sql(self, compiler, connection):
+        first_name, last_name, email = (compiler.compile(column)[0] for column in self.columns)
+        return (
+            USER_SEARCH_DOCUMENT_SQL.format(
+                first_name=first_name, last_name=last_name, email=email
+            ),
+            [],
+        )
+
 
 class AutocompleteFilter(CharFilter):
     """
@@ -15,16 +54,20 @@ class AutocompleteFilter(CharFilter):
     it operates.
     """
 
-    def __init__(self, *args, search_fields=None, **kwargs):
+    def __init__(self, *args, search_fields=None, search_document=None, **kwargs):
         """
         Initialises the filter.
 
         The search_fields keyword argument specifies which fields to search and is required.
+
+        The optional search_document keyword argument is a full text search document expression,
+        which is searched instead when `settings.USER_SEARCH_MODE` is "fulltext".
         """
         if search_fields is None:
             raise ValueError("The search_fields keyword argument must be specified")
 
         self.search_fields = search_fields
+        self.search_document = search_document
         super().__init__(*args, **kwargs)
 
     def filter(self, queryset, value):
@@ -34,6 +77,11 @@ class AutocompleteFilter(CharFilter):
         if self.field_name not in self.parent.form.data:
             return queryset
 
+        if self.search_document is not None and settings.USER_SEARCH_MODE == FULL_TEXT:
+            return _apply_full_text_filter_to_queryset(
+                queryset, self.search_document, self.search_fields, value
+            )
+
         return _apply_autocomplete_filter_to_queryset(queryset, self.search_fields, value)
 
 
@@ -72,6 +120,47 @@ def _apply_autocomplete_filter_to_queryset(queryset, autocomplete_fields, search
     )
 
 
+def _apply_full_text_filter_to_queryset(
+    queryset, search_document, autocomplete_fields, search_string
+):
+    """
+    Performs an autocomplete search against a full text search document.
+
+    Each word in search_string must match a prefix of a word in the document. Unlike the regex
+    search, this can use a GIN index on the document.
+
+    Results are ordered by how well they match: users with a word matching each search word
+    exactly rank first, and matches in higher weighted parts of the document (e.g. names rather
+    than email addresses) rank above others. Ties are ordered by the fields in
+    autocomplete_fields and then pk, as with the regex search.
+    """
+    words = re.findall(r"[^\W_]+", search_string.lower())
+
+    if not words:
+        return queryset.order_by(
+            *autocomplete_fields,
+            "pk",
+        )
+
+    prefix_query = SearchQuery(
+        " & ".join(f"{word}:*" for word in words), search_type="raw", config="simple"
+    )
+    exact_query = SearchQuery(" & ".join(words), search_type="raw", config="simple")
+
+    # the rank is rounded to a numeric, which a cursor position can hold exactly: a float4 may
+    # not be equal to the value it's written as in a cursor, so ties would be skipped
+    search_rank = Cast(
+        SearchRank(search_document, exact_query) + SearchRank(search_document, prefix_query),
+        DecimalField(max_digits=12, decimal_places=6),
+    )
+
+    return (
+        queryset.annotate(search_document=search_document, search_rank=search_rank)
+        .filter(search_document=prefix_query)
+        .order_by("-search_rank", *autocomplete_fields, "pk")
+    )
+
+
 def _make_filter_q_for_token(fields, escaped_token):
     r"""
     Creates a Q object that checks if a token appears in a list of fields (as a prefix).
@@ -0,0 +1,121 @@
+"""
+The user change log that the activity stream pages over.
+
+Every change to a user that appears in the activity stream appends a `UserChangeEvent`. Events
+are ordered by `(transaction_id, id)`: the id of the transaction that recorded them, then their
+sequence id. Sequence ids alone are not safe to page over, as they are allocated in insert order
+but become visible in commit order, so a reader could page past an event whose transaction had
+not yet committed.
+
+Instead, `events_after` only returns events recorded by transactions older than every
+transaction still running (the snapshot's `xmin`). Any event that becomes visible later was
+recorded by a newer transaction, so it is ordered after every event already returned: each event
+is returned exactly once, without a delay.
+
+An event is superseded when a later event for the same user exists. The stream builds its
+activities from the user's current state, so superseded events are skipped and can be deleted by
+`compact`.
+"""
+import logging
+
+from django.db import connection
+from django.db.models import BigIntegerField, Func
+
+from .models import User, UserChangeEvent
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+
+# Saving only these fields doesn't change anything in the activity stream
+IGNORED_USER_FIELDS = frozenset(["last_accessed", "last_login"])
+IGNORED_EMAIL_ADDRESS_FIELDS = frozenset(["last_login"])
+
+_EVENTS = UserChangeEvent._meta.db_table
+
+# the event is recorded by a transaction older than every running transaction
+_VISIBLE = f"{_EVENTS}.transaction_id < txid_snapshot_xmin(txid_current_snapshot())"
+
+_SUPERSEDED = (
+    f"EXISTS (SELECT 1 FROM {_EVENTS} later WHERE later.user_id = {_EVENTS}.user_id "
+    f"AND (later.transaction_id, later.id) > ({_EVENTS}.transaction_id, {_EVENTS}.id))"
+)
+
+
+class TransactionId(Func):
+    function = "txid_current"
+    output_field = BigIntegerField()
+
+
+def record_user_changes(user_ids):
+    """Append an event for each of these users"""
+    user_ids = set(user_ids)
+
+    if user_ids:
+        UserChangeEvent.objects.bulk_create(
+            [
+                UserChangeEvent(user_id=user_id, transaction_id=TransactionId())
+                for user_id in user_ids
+            ],
+            batch_size=BATCH_SIZE,
+        )
+
+
+def record_access_profile_changes(access_profile_ids):
+    """Append an event for each user with one of these access profiles"""
+    record_user_changes(
+        User.access_profiles.through.objects.filter(
+            accessprofile_id__in=access_profile_ids
+        ).values_list("user_id", flat=True)
+    )
+
+
+def parse_cursor(cursor):
+    """
+    Return the `(transaction_id, id)` position of a cursor, or the start of the log if the
+    cursor is missing or was issued before the change log existed.
+    """
+    try:
+        transaction_id, event_id = cursor.split("_")
+        return int(transaction_id), int(event_id)
+    except (AttributeError, ValueError):
+        return 0, 0
+
+
+def format_cursor(event):
+    return f"{event.transaction_id}_{event.id}"
+
+
+def events_after(cursor):
+    """Return the ordered, visible and not superseded events after a cursor position"""
+    return (
+        UserChangeEvent.objects.extra(
+            where=[
+                f"({_EVENTS}.transaction_id, {_EVENTS}.id) > (%s, %s)",
+                _VISIBLE,
+                f"NOT {_SUPERSEDED}",
+            ],
+            params=parse_cursor(cursor),
+        )
+        .select_related("user")
+        .order_by("transaction_id", "id")
+    )
+
+
+def compact():
+    """
+    Delete superseded events and the events of deleted users, and return how many were
+    deleted.
+    """
+    users, pk = User._meta.db_table, User._meta.pk.column
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {_EVENTS} WHERE {_SUPERSEDED} "
+            f"OR NOT EXISTS (SELECT 1 FROM {users} WHERE {users}.{pk} = {_EVENTS}.user_id)"
+        )
+        deleted = cursor.rowcount
+
+    logger.info("Deleted %d superseded user change events", deleted)
+
+    return deleted
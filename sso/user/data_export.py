@@ -1,7 +1,34 @@
 from django.contrib.auth import get_user_model
+from django.db.models import prefetch_related_objects
 
 from sso.user.models import EmailAddress
 
+EXPORT_BATCH_SIZE = 2000
+
+
+def _users_in_batches(batch_size=EXPORT_BATCH_SIZE):
+    """
+    Yield the users ordered by email, prefetching the emails, access profiles and permitted
+    applications of each batch of users at once.
+
+    The batches are fetched by email, which is unique, rather than with `QuerySet.iterator()`,
+    which ignores `prefetch_related`.
+    """
+    users = get_user_model().objects.order_by("email")
+    last_email = None
+
+    while True:
+        batch = users if last_email is None else users.filter(email__gt=last_email)
+        batch = list(batch[:batch_size])
+        prefetch_related_objects(batch, "emails", "access_profiles", "permitted_applications")
+
+        yield from batch
+
+        if len(batch) < batch_size:
+            return
+
+        last_email = batch[-1].email
+
 
 class UserDataExport:
     def __iter__(self):
@@ -21,7 +48,7 @@ class UserDataExport:
             "other emails",
         ]
 
-        for user in get_user_model().objects.all().order_by("email"):
+        for user in _users_in_batches():
             if user.last_login:
                 last_login = user.last_login.strftime("%Y-%m-%d %H:%m:%S")
             else:
@@ -34,7 +61,7 @@ class UserDataExport:
 
             date_joined = user.date_joined.strftime("%Y-%m-%d %H:%m:%S")
 
-            other_emails = user.emails.exclude(email=user.email).values_list("email", flat=True)
+            other_emails = [email.email for email in user.emails.all() if email.email != user.email]
             access_profiles = "|".join(ap.slug for ap in user.access_profiles.all())
             permitted_applications = "|".join(pa.name for pa in user.permitted_applications.all())
             row = [
@@ -1,7 +1,9 @@
 from django.contrib import admin
+from django.db.models import Exists, OuterRef
 from django.utils.translation import ugettext_lazy as _
 
 from sso.oauth2.models import Application
+from .models import EmailAddress
 
 
 class ApplicationFilter(admin.SimpleListFilter):
@@ -21,3 +23,26 @@ class ApplicationFilter(admin.SimpleListFilter):
         if self.value():
             query = None if self.value() == "noperms" else self.value()
             return queryset.filter(permitted_applications=query)
+
+
+class EmailDomainFilter(admin.SimpleListFilter):
+
+    title = _("email domain")
+
+    parameter_name = "email_domain"
+
+    def lookups(self, request, model_admin):
+
+        domains = (
+            EmailAddress.objects.exclude(domain__isnull=True)
+            .order_by("domain")
+            .values_list("domain", flat=True)
+        )
+
+        return [(domain, domain) for domain in domains.distinct()]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(
+                Exists(EmailAddress.objects.filter(user=OuterRef("pk"), domain=self.value()))
+            )
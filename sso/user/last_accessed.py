@@ -0,0 +1,114 @@
+"""
+Write-behind buffer for `User.last_accessed`.
+
+With `settings.LAST_ACCESSED_WRITE_BEHIND` enabled, `UpdatedLastAccessedMiddleware` records
+access times here instead of updating the user row on every request. The buffer keeps the
+latest time per user and a background thread writes them with a single `bulk_update` every
+`settings.LAST_ACCESSED_FLUSH_INTERVAL` seconds, and once more when the process exits.
+
+Each process has its own buffer, so a user's last access can be up to one flush interval late
+and is lost if the process is killed without running its exit handlers.
+"""
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+
+
+class LastAccessedBuffer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._thread = None
+        self._stopped = None
+        self.stats = {"buffered": 0, "flushed": 0, "skipped": 0}
+
+    def record(self, user_id, accessed):
+        with self._lock:
+            self.stats["buffered"] += 1
+            if user_id not in self._pending or self._pending[user_id] < accessed:
+                self._pending[user_id] = accessed
+
+        self._start()
+
+    def skipped(self):
+        with self._lock:
+            self.stats["skipped"] += 1
+
+    def __len__(self):
+        return len(self._pending)
+
+    def flush(self):
+        """Write the buffered access times to the database and return how many were written"""
+        from .models import User
+
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        if not pending:
+            return 0
+
+        try:
+            User.objects.bulk_update(
+                [User(pk=user_id, last_accessed=accessed) for user_id, accessed in pending.items()],
+                ["last_accessed"],
+                batch_size=BATCH_SIZE,
+            )
+        except Exception:
+            logger.exception("Failed to flush last accessed times for %d users", len(pending))
+
+            # put them back for the next flush, unless they have been superseded since
+            with self._lock:
+                for user_id, accessed in pending.items():
+                    if user_id not in self._pending or self._pending[user_id] < accessed:
+                        self._pending[user_id] = accessed
+            return 0
+
+        with self._lock:
+            self.stats["flushed"] += len(pending)
+
+        logger.info(
+            "Flushed last accessed times for %d users (buffered: %d, flushed: %d, skipped: %d)",
+            len(pending),
+            self.stats["buffered"],
+            self.stats["flushed"],
+            self.stats["skipped"],
+        )
+
+        return len(pending)
+
+    def _start(self):
+        if self._thread is not None or settings.LAST_ACCESSED_FLUSH_INTERVAL <= 0:
+            return
+
+        with self._lock:
+            if self._thread is None:
+                self._stopped = threading.Event()
+                self._thread = threading.Thread(
+                    target=self._run, name="last-accessed-flush", daemon=True
+                )
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stopped.wait(settings.LAST_ACCESSED_FLUSH_INTERVAL):
+            close_old_connections()
+            self.flush()
+
+    def stop(self):
+        """Stop the flush thread and write anything still buffered"""
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+
+        self.flush()
+
+
+buffer = LastAccessedBuffer()
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from sso.user.access_index import all_applications, rebuild_application_access
+
+
+class Command(BaseCommand):
+    help = "Verify or rebuild the user application access index used by User.can_access"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "action",
+            choices=("verify", "rebuild"),
+            help="verify: report applications whose index is out of sync; rebuild: fix them",
+        )
+
+    def handle(self, *args, action, **kwargs):
+        dry_run = action == "verify"
+        out_of_sync = 0
+
+        for application in all_applications():
+            missing, stale = rebuild_application_access(application, dry_run=dry_run)
+
+            if missing or stale:
+                out_of_sync += 1
+                self.stdout.write(
+                    f"{application.application_key}: {len(missing)} missing, {len(stale)} stale"
+                )
+
+        if dry_run and out_of_sync:
+            raise CommandError(f"{out_of_sync} application(s) have an out of sync access index")
+
+        self.stdout.write(f"{action} complete: {out_of_sync} application(s) out of sync")
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from sso.user.change_log import compact
+
+
+class Command(BaseCommand):
+    help = "Delete user change events that have been superseded, or whose user has been deleted"
+
+    def handle(self, *args, **kwargs):
+        deleted = compact()
+
+        self.stdout.write(f"Deleted {deleted} user change event(s)")
@@ -1,13 +1,37 @@
 import logging
 
 from django.contrib.auth.models import BaseUserManager
+from django.db import models
+from django.db.models import prefetch_related_objects
 from django.utils import timezone
 
 
 logger = logging.getLogger(__name__)
 
+# The relations read by `User.get_emails_for_application` and `User.get_permitted_applications`
+ACCESS_GRAPH = (
+    "emails",
+    "permitted_applications",
+    "access_profiles__oauth2_applications",
+    "access_profiles__saml2_applications",
+)
 
-class UserManager(BaseUserManager):
+
+def prefetch_access_graph(users):
+    """Prefetch the access graph of users that have already been loaded"""
+    prefetch_related_objects(users, *ACCESS_GRAPH)
+
+
+class UserQuerySet(models.QuerySet):
+    def with_access_graph(self):
+        """
+        Prefetch each user's emails, permitted applications and access profiles with their
+        applications, so that serialising the users takes a constant number of queries.
+        """
+        return self.prefetch_related(*ACCESS_GRAPH)
+
+
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
     def _create_user(self, email, password, **extra_fields):
         """
         Creates and saves a User with the given email and password.
@@ -59,4 +83,66 @@ class UserManager(BaseUserManager):
 
         email_obj = EmailAddress.objects.get(email=email.lower())
         email_obj.last_login = timezone.now()
-        email_obj.save()
+        email_obj.save(update_fields=["last_login"])
+
+    def get_permitted_applications_by_user(
+        self, user_ids, include_non_public=False, get_default_access_allowed_apps=None
+    ):
+        """
+        Return a dict of user id to the applications that user has access to, in the same form
+        as `User.get_permitted_applications`.
+
+        Directly permitted applications and those granted by access profiles are loaded for all
+        the users in a single query.
+        """
+        from sso.oauth2.models import Application
+
+        if get_default_access_allowed_apps is None:
+            get_default_access_allowed_apps = Application.get_default_access_applications
+
+        permitted_applications = self.model.permitted_applications.through.objects
+        access_profiles = self.model.access_profiles.through.objects
+
+        def _fields(prefix, key, name):
+            return (
+                "user_id",
+                f"{prefix}__{key}",
+                f"{prefix}__{name}",
+                f"{prefix}__start_url",
+                f"{prefix}__public",
+            )
+
+        rows = (
+            permitted_applications.filter(user_id__in=user_ids)
+            .values_list(*_fields("application", "application_key", "display_name"))
+            .union(
+                access_profiles.filter(
+                    user_id__in=user_ids, accessprofile__oauth2_applications__isnull=False
+                ).values_list(
+                    *_fields(
+                        "accessprofile__oauth2_applications", "application_key", "display_name"
+                    )
+                ),
+                access_profiles.filter(
+                    user_id__in=user_ids, accessprofile__saml2_applications__isnull=False
+                ).values_list(*_fields("accessprofile__saml2_applications", "slug", "pretty_name")),
+            )
+        )
+
+        default_apps = [
+            (app.application_key, app.display_name, app.start_url, app.public)
+            for app in get_default_access_allowed_apps()
+        ]
+
+        apps_by_user = {user_id: set(default_apps) for user_id in user_ids}
+        for user_id, *app in rows:
+            apps_by_user[user_id].add(tuple(app))
+
+        return {
+            user_id: [
+                {"key": key, "url": url, "name": name}
+                for key, name, url, public in sorted(apps, key=lambda app: app[1])
+                if include_non_public or public
+            ]
+            for user_id, apps in apps_by_user.items()
+        }
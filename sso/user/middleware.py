@@ -1,5 +1,8 @@
+from django.conf import settings
 from django.utils.timezone import now
 
+from .last_accessed import buffer
+
 
 class UpdatedLastAccessedMiddleware(object):
     def __init__(self, get_response):
@@ -13,5 +16,19 @@ class UpdatedLastAccessedMiddleware(object):
 
     def set_last_accessed_date(self, request):
         if request.user.is_authenticated:
-            request.user.last_accessed = now()
-            request.user.save(update_fields=["last_accessed"])
+            accessed = now()
+            previous = request.user.last_accessed
+
+            if (
+                previous
+                and 0 <= (accessed - previous).total_seconds() < settings.LAST_ACCESSED_RESOLUTION
+            ):
+                buffer.skipped()
+                return
+
+            request.user.last_accessed = accessed
+
+            if settings.LAST_ACCESSED_WRITE_BEHIND:
+                buffer.record(request.user.pk, accessed)
+            else:
+                request.user.save(update_fields=["last_accessed"])
@@ -0,0 +1,111 @@
+# Generated by Django 3.1.6 on 2021-04-12 10:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def _allowed_email_domains(application):
+    if not application.allow_access_by_email_suffix:
+        return set()
+
+    return {domain.strip() for domain in application.allow_access_by_email_suffix.split(",")}
+
+
+def populate_application_access(apps, schema_editor):
+    ApplicationAccess = apps.get_model("user", "ApplicationAccess")
+    EmailAddress = apps.get_model("user", "EmailAddress")
+    User = apps.get_model("user", "User")
+    Application = apps.get_model("oauth2", "Application")
+    SamlApplication = apps.get_model("samlidp", "SamlApplication")
+
+    def email_users(application):
+        user_ids = set()
+        for domain in _allowed_email_domains(application):
+            user_ids.update(
+                EmailAddress.objects.filter(email__endswith=f"@{domain}").values_list(
+                    "user_id", flat=True
+                )
+            )
+        return user_ids
+
+    for application in Application.objects.all():
+        user_ids = email_users(application)
+        user_ids.update(application.users.values_list("pk", flat=True))
+        user_ids.update(
+            User.objects.filter(access_profiles__oauth2_applications=application).values_list(
+                "pk", flat=True
+            )
+        )
+        ApplicationAccess.objects.bulk_create(
+            [ApplicationAccess(user_id=pk, oauth2_application=application) for pk in user_ids],
+            batch_size=1000,
+        )
+
+    for application in SamlApplication.objects.all():
+        user_ids = email_users(application)
+        if application.active:
+            user_ids.update(
+                User.objects.filter(access_profiles__saml2_applications=application).values_list(
+                    "pk", flat=True
+                )
+            )
+        ApplicationAccess.objects.bulk_create(
+            [ApplicationAccess(user_id=pk, saml2_application=application) for pk in user_ids],
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("oauth2", "0012_auto_20210302_1809"),
+        ("samlidp", "0007_samlapplication_public"),
+        ("user", "0037_update_became_inactive_on_field"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ApplicationAccess",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                (
+                    "oauth2_application",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="user_access",
+                        to="oauth2.application",
+                    ),
+                ),
+                (
+                    "saml2_application",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="user_access",
+                        to="samlidp.samlapplication",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="application_access",
+                        to="user.user",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "application access",
+                "unique_together": {("user", "saml2_application"), ("user", "oauth2_application")},
+            },
+        ),
+        migrations.RunPython(populate_application_access, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 3.1.6 on 2021-04-19 09:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("user", "0038_applicationaccess"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserChangeEvent",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                ("transaction_id", models.BigIntegerField()),
+                ("created", models.DateTimeField(default=django.utils.timezone.now)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        db_constraint=False,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="change_events",
+                        to="user.user",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="userchangeevent",
+            index=models.Index(fields=["transaction_id", "id"], name="user_change_sequence_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="userchangeevent",
+            index=models.Index(
+                fields=["user", "transaction_id", "id"], name="user_change_user_sequence_idx"
+            ),
+        ),
+        # Start the log with an event for every user, in the order the activity stream
+        # previously returned them
+        migrations.RunSQL(
+            """
+            INSERT INTO user_userchangeevent (user_id, transaction_id, created)
+            SELECT id, txid_current(), last_modified FROM user_user
+            ORDER BY last_modified, user_id
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    Index the full text search document that `sso.user.autocomplete.UserSearchDocument`
+    searches. The expression must be kept in sync with `USER_SEARCH_DOCUMENT_SQL`.
+    """
+
+    dependencies = [
+        ("user", "0039_userchangeevent"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=(
+                "CREATE INDEX user_user_search_idx ON user_user USING gin (("
+                "setweight(to_tsvector('simple'::regconfig, first_name || ' ' || last_name), 'A') || "
+                "setweight(to_tsvector('simple'::regconfig, "
+                "translate(split_part(email, '@', 1), '._-', '   ')), 'B')))"
+            ),
+            reverse_sql="DROP INDEX user_user_search_idx",
+        ),
+    ]
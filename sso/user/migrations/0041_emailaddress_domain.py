@@ -0,0 +1,63 @@
+from django.db import migrations, models
+from django.db.models import Func, Max, Value
+from django.db.models.functions import Lower
+
+BATCH_SIZE = 5000
+
+
+def _domain():
+    return Func(
+        Lower("email"), Value("@"), Value(2), function="split_part", output_field=models.CharField()
+    )
+
+
+def populate_domain(apps, schema_editor):
+    """Set the domain of existing email addresses, committing each batch of ids separately"""
+    EmailAddress = apps.get_model("user", "EmailAddress")
+
+    last_id = EmailAddress.objects.aggregate(last_id=Max("id"))["last_id"] or 0
+
+    for start in range(0, last_id + 1, BATCH_SIZE):
+        EmailAddress.objects.filter(
+            id__gte=start, id__lt=start + BATCH_SIZE, domain__isnull=True
+        ).update(domain=_domain())
+
+
+def populate_missing_domains(apps, schema_editor):
+    """
+    Set the domain of the email addresses added while the batches were running, by a process that
+    didn't set it
+    """
+    EmailAddress = apps.get_model("user", "EmailAddress")
+
+    EmailAddress.objects.filter(domain__isnull=True).update(domain=_domain())
+
+
+class Migration(migrations.Migration):
+
+    # the batches are committed as they are made, so that the table isn't locked for the backfill
+    atomic = False
+
+    dependencies = [
+        ("user", "0040_user_search_index"),
+    ]
+
+    operations = [
+        # nullable, so that adding the column doesn't rewrite the table
+        migrations.AddField(
+            model_name="emailaddress",
+            name="domain",
+            field=models.CharField(editable=False, max_length=255, null=True),
+        ),
+        migrations.RunPython(populate_domain, reverse_code=migrations.RunPython.noop),
+        # still nullable, as processes running the previous release insert email addresses
+        # without a domain until the deploy completes; a later migration makes it NOT NULL
+        migrations.AlterField(
+            model_name="emailaddress",
+            name="domain",
+            field=models.CharField(
+                db_index=True, default="", editable=False, max_length=255, null=True
+            ),
+        ),
+        migrations.RunPython(populate_missing_domains, reverse_code=migrations.RunPython.noop),
+    ]
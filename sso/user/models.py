@@ -28,6 +28,11 @@ def build_email_user_id(email, user_id):
     return f"{username}-{hash}{settings.EMAIL_ID_DOMAIN}"
 
 
+def get_email_domain(email):
+    """Return the lower cased domain of an email address, e.g. `trade.gov.uk`"""
+    return email.split("@")[1].lower() if "@" in email else ""
+
+
 class ApplicationPermission(models.Model):
     """Application level permissions.
     To allow management of user access for an application via Staff-sso;
@@ -232,60 +237,31 @@ class User(AbstractBaseUser, PermissionsMixin):
     def get_extra_emails(self):
         return list(self.emails.exclude(email=self.email).values_list("email", flat=True))
 
-    def _is_allowed_email(self, application):
-        """Returns True if any of the user's emails are whitelisted in the OAuth2 app"""
-
-        def _remove_username(email):
-            return email.split("@")[1]
-
-        if not application.allow_access_by_email_suffix:
-            return False
-
-        allowed_emails = {
-            email.strip() for email in application.allow_access_by_email_suffix.split(",")
-        }
-
-        emails = self._get_domain_to_email_mapping().keys()
-
-        return not allowed_emails.isdisjoint(emails)
-
     def _get_domain_to_email_mapping(self):
         """Return a dictionary of a user's emails and the domain, e.g. `{domain: email}` """
 
-        def _remove_username(email):
-            return email.split("@")[1]
-
-        return {
-            _remove_username(email): email
-            for email in self.emails.all().values_list("email", flat=True)
-        }
+        # iterates over `emails.all()` so that prefetched emails are used
+        return {email.domain: email.email for email in self.emails.all()}
 
     def can_access(self, application: Union[OAuthApplication, "SamlApplication"]):
-        """ Can the user access this application?"""
+        """Can the user access this application?
+
+        Access granted by email suffix, permitted applications and access profiles is
+        materialised in the `ApplicationAccess` index (see `sso.user.access_index`), so this
+        is a single indexed lookup.
+        """
 
         if not self.is_active:
             return False
 
-        if self._is_allowed_email(application):
-            return True
-
         if isinstance(application, OAuthApplication):
-            # Saml permissions can only be granted via an AccessProfile
-
             # does the application grant access?
             if application.default_access_allowed:
                 return True
 
-            # is the user permitted to access the application directly?
-            if application in self.permitted_applications.all():
-                return True
-
-        # is the user granted access by an access profile?
-        for profile in self.access_profiles.all():
-            if profile.is_allowed(application):
-                return True
+            return self.application_access.filter(oauth2_application=application).exists()
 
-        return False
+        return self.application_access.filter(saml2_application=application).exists()
 
     @staticmethod
     def can_access_all_settings(application: Union[OAuthApplication, "SamlApplication"]):
@@ -304,7 +280,7 @@ class User(AbstractBaseUser, PermissionsMixin):
 
         if not application or application.provide_immutable_email:
             return self.email, sorted(
-                list(self.emails.exclude(email=self.email).values_list("email", flat=True))
+                email.email for email in self.emails.all() if email.email != self.email
             )
 
         emails = self._get_domain_to_email_mapping()
@@ -362,14 +338,22 @@ class User(AbstractBaseUser, PermissionsMixin):
 class EmailAddress(models.Model):
     user = models.ForeignKey(User, related_name="emails", on_delete=models.CASCADE)
     email = models.EmailField(unique=True)
+    # the domain of the email, so that users can be found by email domain with an index scan.
+    # Nullable until every running process sets it, see migration 0041.
+    domain = models.CharField(max_length=255, db_index=True, default="", editable=False, null=True)
     last_login = models.DateTimeField(null=True)
 
     def save(self, *args, **kwargs):
         """
-        Ensure that emails are lower cased
+        Ensure that emails are lower cased and that the domain matches the email
         """
 
         self.email = self.email.lower()
+        self.domain = get_email_domain(self.email)
+
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "email" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "domain"}
 
         return super().save(*args, **kwargs)
 
@@ -390,3 +374,74 @@ class ServiceEmailAddress(models.Model):
 
     class Meta:
         unique_together = ("user", "saml_application", "email")
+
+
+class ApplicationAccess(models.Model):
+    """Materialised index of the applications a user has been granted access to.
+
+    Rows are maintained by the signal handlers in `sso.user.signals` and can be verified or
+    rebuilt with the `access_index` management command. Access granted to all users via
+    `Application.default_access_allowed` and the user's `is_active` flag are not indexed.
+    """
+
+    user = models.ForeignKey(User, related_name="application_access", on_delete=models.CASCADE)
+
+    oauth2_application = models.ForeignKey(
+        "oauth2.Application",
+        related_name="user_access",
+        blank=True,
+        null=True,
+        on_delete=models.CASCADE,
+    )
+
+    saml2_application = models.ForeignKey(
+        "samlidp.SamlApplication",
+        related_name="user_access",
+        blank=True,
+        null=True,
+        on_delete=models.CASCADE,
+    )
+
+    def __str__(self):
+        return f"{self.user} - {self.oauth2_application or self.saml2_application}"
+
+    class Meta:
+        verbose_name_plural = "application access"
+        unique_together = (("user", "oauth2_application"), ("user", "saml2_application"))
+
+
+class UserChangeEvent(models.Model):
+    """An entry in the append-only log of user changes that the activity stream pages over.
+
+    Events are recorded by the signal handlers in `sso.user.signals` when a user, their email
+    addresses, access profiles or permitted applications change. Each records the id of the
+    database transaction that created it, so that the stream only returns events once every
+    transaction that could precede them has finished; see `sso.user.change_log`. Events that
+    have been superseded by a later event for the same user are skipped by the stream and can
+    be deleted with the `compact_user_changes` management command.
+    """
+
+    id = models.BigAutoField(primary_key=True)
+
+    # Events outlive their user until they are compacted, so there is no constraint
+    user = models.ForeignKey(
+        User,
+        related_name="change_events",
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+    )
+
+    transaction_id = models.BigIntegerField()
+
+    created = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.transaction_id}_{self.id} - {self.user_id}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["transaction_id", "id"], name="user_change_sequence_idx"),
+            models.Index(
+                fields=["user", "transaction_id", "id"], name="user_change_user_sequence_idx"
+            ),
+        ]
@@ -0,0 +1,127 @@
+import base64
+import json
+from functools import reduce
+from operator import or_
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetCursorPagination(BasePagination):
+    """
+    Cursor pagination that keeps the ordering of the queryset, for `?pagination=cursor`.
+
+    Unlike `LimitOffsetPagination`, this doesn't count the results and doesn't skip rows with an
+    offset, so every page takes the same time. The cursor is the position of the last result
+    on a page: the values of the queryset's ordering fields, which are filtered on to get the
+    next page. The pk is added to the ordering, so that the position is unique.
+
+    Pages can only be followed forwards, and the ordering fields must be model fields or
+    annotations whose values are loaded with the results.
+    """
+
+    mode_query_param = "pagination"
+    mode = "cursor"
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 1000
+    invalid_cursor_message = "Invalid cursor"
+
+    @classmethod
+    def is_requested(cls, request):
+        return request.query_params.get(cls.mode_query_param) == cls.mode
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_ordering(self, queryset):
+        ordering = [field for field in queryset.query.order_by if isinstance(field, str)]
+
+        if "pk" not in ordering and "-pk" not in ordering:
+            ordering.append("pk")
+
+        return ordering
+
+    def decode_cursor(self, request, ordering):
+        encoded = request.query_params.get(self.cursor_query_param)
+
+        if encoded is None:
+            return None
+
+        try:
+            position = json.loads(base64.urlsafe_b64decode(encoded.encode("ascii")))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+        if not isinstance(position, list) or len(position) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        return position
+
+    def encode_cursor(self, obj, ordering):
+        position = json.dumps([getattr(obj, field.lstrip("-")) for field in ordering], default=str)
+        return base64.urlsafe_b64encode(position.encode("utf-8")).decode("ascii")
+
+    def after(self, ordering, position):
+        """Return a Q object for the results that are ordered after a position"""
+        conditions = []
+
+        for i, field in enumerate(ordering):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            ties = [
+                (previous.lstrip("-"), value) for previous, value in zip(ordering, position[:i])
+            ]
+
+            conditions.append(Q(*ties, **{f"{name}__{lookup}": position[i]}))
+
+        return reduce(or_, conditions)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request, self.ordering)
+
+        if position is not None:
+            queryset = queryset.filter(self.after(self.ordering, position))
+
+        # read one more than a page to tell if there is a next page, without counting
+        results = list(queryset[: self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page = results[: self.page_size]
+
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+
+        url = self.request.build_absolute_uri()
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(self.page[-1], self.ordering)
+        )
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True},
+                "results": schema,
+            },
+        }
@@ -74,15 +74,16 @@ class UserListSerializer(serializers.Serializer):
         )
 
     def to_representation(self, obj):
-        app = self.context["request"].auth.application
-
-        primary_email, _ = obj.get_emails_for_application(app)
-
-        return {
-            "user_id": str(obj.user_id),
-            "email_user_id": obj.email_user_id,
-            "first_name": obj.first_name,
-            "last_name": obj.last_name,
-            "email": primary_email,
-            "contact_email": obj.contact_email,
-        }
+        """Represent the fields in the `fields` context, which defaults to all of them"""
+        representation = {}
+
+        for field in self.context.get("fields", self.Meta.fields):
+            if field == "email":
+                app = self.context["request"].auth.application
+                representation["email"], _ = obj.get_emails_for_application(app)
+            elif field == "user_id":
+                representation["user_id"] = str(obj.user_id)
+            else:
+                representation[field] = getattr(obj, field)
+
+        return representation
@@ -0,0 +1,168 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from sso.oauth2.models import Application as OAuthApplication
+from sso.samlidp.metadata import METADATA_FIELDS
+from sso.samlidp.models import SamlApplication
+from .access_index import (
+    rebuild_access_profile_applications,
+    rebuild_access_profile_users,
+    rebuild_application_access,
+    rebuild_user_access,
+)
+from .change_log import (
+    IGNORED_EMAIL_ADDRESS_FIELDS,
+    IGNORED_USER_FIELDS,
+    record_access_profile_changes,
+    record_user_changes,
+)
+from .models import AccessProfile, EmailAddress, User
+
+M2M_POST_ACTIONS = ("post_add", "post_remove", "post_clear")
+
+
+@receiver(m2m_changed, sender=User.permitted_applications.through)
+def permitted_applications_changed(sender, instance, action, reverse, **kwargs):
+    if action not in M2M_POST_ACTIONS:
+        return
+
+    if reverse:
+        rebuild_application_access(instance)
+    else:
+        rebuild_user_access(instance)
+
+
+@receiver(m2m_changed, sender=User.access_profiles.through)
+def user_access_profiles_changed(sender, instance, action, reverse, **kwargs):
+    if action not in M2M_POST_ACTIONS:
+        return
+
+    if reverse:
+        rebuild_access_profile_applications(instance)
+    else:
+        rebuild_user_access(instance)
+
+
+@receiver(m2m_changed, sender=AccessProfile.oauth2_applications.through)
+@receiver(m2m_changed, sender=AccessProfile.saml2_applications.through)
+def access_profile_applications_changed(sender, instance, action, reverse, **kwargs):
+    if action not in M2M_POST_ACTIONS:
+        return
+
+    if reverse:
+        rebuild_application_access(instance)
+    else:
+        rebuild_access_profile_users(instance)
+
+
+@receiver(pre_delete, sender=AccessProfile)
+def access_profile_pre_delete(sender, instance, **kwargs):
+    # the m2m rows are removed by cascade without an m2m_changed signal, so record the
+    # applications that need to be rebuilt once the profile has gone.
+    instance._access_index_applications = [
+        *instance.oauth2_applications.all(),
+        *instance.saml2_applications.all(),
+    ]
+
+
+@receiver(post_delete, sender=AccessProfile)
+def access_profile_deleted(sender, instance, **kwargs):
+    for application in getattr(instance, "_access_index_applications", []):
+        rebuild_application_access(application)
+
+
+@receiver(post_save, sender=OAuthApplication)
+@receiver(post_save, sender=SamlApplication)
+def application_saved(sender, instance, update_fields, **kwargs):
+    # refreshing the metadata of a SAML application can't change who has access to it
+    if update_fields is not None and set(update_fields) <= set(METADATA_FIELDS):
+        return
+
+    rebuild_application_access(instance)
+
+
+@receiver(post_save, sender=EmailAddress)
+def email_address_saved(sender, instance, update_fields, **kwargs):
+    # saving only the last login, as every sign in does, can't change the user's access
+    if update_fields is not None and set(update_fields) <= {"last_login"}:
+        return
+
+    rebuild_user_access(User(pk=instance.user_id))
+
+
+@receiver(post_delete, sender=EmailAddress)
+def email_address_deleted(sender, instance, **kwargs):
+    # Removing an email can only revoke access. Email addresses are also deleted when their
+    # user is, so rows are never added here.
+    rebuild_user_access(User(pk=instance.user_id), prune_only=True)
+
+
+# Change log
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, update_fields, **kwargs):
+    if update_fields is not None and set(update_fields) <= IGNORED_USER_FIELDS:
+        return
+
+    record_user_changes([instance.pk])
+
+
+@receiver(post_save, sender=EmailAddress)
+def email_address_saved_change_log(sender, instance, update_fields, **kwargs):
+    if update_fields is not None and set(update_fields) <= IGNORED_EMAIL_ADDRESS_FIELDS:
+        return
+
+    record_user_changes([instance.user_id])
+
+
+@receiver(post_delete, sender=EmailAddress)
+def email_address_deleted_change_log(sender, instance, **kwargs):
+    record_user_changes([instance.user_id])
+
+
+@receiver(m2m_changed, sender=User.permitted_applications.through)
+@receiver(m2m_changed, sender=User.access_profiles.through)
+def user_relations_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in M2M_POST_ACTIONS:
+            record_user_changes([instance.pk])
+        return
+
+    # `instance` is the application or access profile and `pk_set` the users
+    if action == "pre_clear":
+        instance._change_log_user_ids = list(instance.users.values_list("pk", flat=True))
+    elif action in ("post_add", "post_remove"):
+        record_user_changes(pk_set)
+    elif action == "post_clear":
+        record_user_changes(getattr(instance, "_change_log_user_ids", []))
+
+
+@receiver(m2m_changed, sender=AccessProfile.oauth2_applications.through)
+@receiver(m2m_changed, sender=AccessProfile.saml2_applications.through)
+def access_profile_relations_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in M2M_POST_ACTIONS:
+            record_access_profile_changes([instance.pk])
+        return
+
+    # `instance` is the application and `pk_set` the access profiles
+    if action == "pre_clear":
+        instance._change_log_access_profile_ids = list(
+            instance.accessprofile_set.values_list("pk", flat=True)
+        )
+    elif action in ("post_add", "post_remove"):
+        record_access_profile_changes(pk_set)
+    elif action == "post_clear":
+        record_access_profile_changes(getattr(instance, "_change_log_access_profile_ids", []))
+
+
+@receiver(pre_delete, sender=AccessProfile)
+def access_profile_pre_delete_change_log(sender, instance, **kwargs):
+    # the users' m2m rows are removed by cascade, so record the users before they go
+    instance._change_log_user_ids = list(instance.users.values_list("pk", flat=True))
+
+
+@receiver(post_delete, sender=AccessProfile)
+def access_profile_deleted_change_log(sender, instance, **kwargs):
+    record_user_changes(getattr(instance, "_change_log_user_ids", []))
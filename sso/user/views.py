@@ -1,18 +1,20 @@
-from functools import reduce
-from operator import or_
-
 from django.contrib.auth import get_user_model
-from django.db.models import Q
+from django.db.models import Exists, OuterRef, prefetch_related_objects, Q
 from django_filters.rest_framework import DjangoFilterBackend, FilterSet
 from oauth2_provider.contrib.rest_framework import TokenHasScope
 
 from rest_framework import mixins, permissions, status, viewsets
+from rest_framework.exceptions import ValidationError
 from rest_framework.filters import OrderingFilter
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 
 from sso.oauth2.models import Application as OAuthApplication
-from .autocomplete import AutocompleteFilter
-from .models import User
+from .access_index import get_allowed_email_domains
+from .autocomplete import AutocompleteFilter, UserSearchDocument
+from .managers import prefetch_access_graph
+from .models import EmailAddress, User
+from .pagination import KeysetCursorPagination
 from .serializers import (
     UserDetailsSerializer,
     UserListSerializer,
@@ -26,7 +28,9 @@ class UserRetrieveViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
     serializer_class = UserSerializer
 
     def get_object(self):
-        return self.request.user
+        user = self.request.user
+        prefetch_access_graph([user])
+        return user
 
     def partial_update(self, request):
         serializer = UserDetailsSerializer(data=request.data)
@@ -78,6 +82,8 @@ class UserIntrospectViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
             # The user does not have permission to access this OAuth2 application
             return Response(status=status.HTTP_404_NOT_FOUND)
 
+        prefetch_access_graph([selected_user])
+
         serializer = UserSerializer(selected_user, context=dict(request=request))
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -86,6 +92,7 @@ class UserAutoCompleteFilter(FilterSet):
 
     autocomplete = AutocompleteFilter(
         search_fields=("first_name", "last_name"),
+        search_document=UserSearchDocument(),
     )
 
     class Meta:
@@ -111,14 +118,51 @@ class UserListViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
     ordering_fields = ("first_name", "last_name")
     _default_ordering = ("first_name", "last_name")
 
+    @property
+    def pagination_class(self):
+        """Results are paginated by offset, or by cursor with `?pagination=cursor`"""
+        if KeysetCursorPagination.is_requested(self.request):
+            return KeysetCursorPagination
+
+        return api_settings.DEFAULT_PAGINATION_CLASS
+
+    def get_requested_fields(self):
+        """Return the fields requested with `?fields=`, a comma separated list, or all of them"""
+        all_fields = self.serializer_class.Meta.fields
+        requested = self.request.query_params.get("fields")
+
+        if requested is None:
+            return all_fields
+
+        fields = tuple(field.strip() for field in requested.split(",") if field.strip())
+        if not fields or not set(fields) <= set(all_fields):
+            raise ValidationError({"fields": [f"Choose one or more of: {', '.join(all_fields)}"]})
+
+        return fields
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context["fields"] = self.get_requested_fields()
+        return context
+
+    def list(self, request, *args, **kwargs):
+        """
+        List the users, loading only the requested fields and those that are ordered by, and
+        prefetching the emails of a page of users at once if the email is requested.
+        """
+        fields = self.get_requested_fields()
+        queryset = self.filter_queryset(self.get_queryset()).only(*fields, *self.ordering_fields)
+
+        page = self.paginate_queryset(queryset)
+
+        if "email" in fields:
+            prefetch_related_objects(page, "emails")
+
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
     def _allowed_by_email_domain_qs(self, application):
-        return reduce(
-            or_,
-            (
-                Q(("emails__email__icontains", domain))
-                for domain in application.allow_access_by_email_suffix.split(",")
-            ),
-        )
+        return Q(domain__in=get_allowed_email_domains(application))
 
     def _oauth_filtered_qs(self, queryset, application):
         """
@@ -126,15 +170,31 @@ class UserListViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
         retrieves all users with allowed email domains, if relevant setting was on
         retrieves users if this application is within thier permitted applications
         retrieves users if user's access profile allows this application
+
+        Each of these is an EXISTS subquery rather than a join, so users aren't repeated and
+        the results don't need to be made distinct.
         """
-        permitted_qs = queryset.filter(permitted_applications=application)
-        access_qs = queryset.filter(access_profiles__oauth2_applications=application)
+        permitted = Exists(
+            User.permitted_applications.through.objects.filter(
+                user=OuterRef("pk"), application=application
+            )
+        )
+        by_access_profile = Exists(
+            User.access_profiles.through.objects.filter(
+                user=OuterRef("pk"), accessprofile__oauth2_applications=application
+            )
+        )
+        access = permitted | by_access_profile
+
         if application.allow_access_by_email_suffix:
-            email_qs = queryset.filter(self._allowed_by_email_domain_qs(application))
-            qs = email_qs | permitted_qs | access_qs
-        else:
-            qs = permitted_qs | access_qs
-        return qs.distinct()  # remove dups
+            by_email = Exists(
+                EmailAddress.objects.filter(
+                    self._allowed_by_email_domain_qs(application), user=OuterRef("pk")
+                )
+            )
+            access = by_email | access
+
+        return queryset.filter(access)
 
     def get_queryset(self):
         queryset = super().get_queryset()